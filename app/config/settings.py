@@ -20,6 +20,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',  # Search lookups (trigram_similar)
     'rest_framework',
     'conversations',
 ]
@@ -104,6 +105,22 @@ STATIC_URL = "/static/"  # Public URL prefix for static files
 STATIC_ROOT = BASE_DIR / "staticfiles"  # collectstatic output for serving
 STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"  # Hashed files for caching
 
+# --- Logging ---------------------------------------------------------
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "conversations": {
+            "handlers": ["console"],
+            "level": os.environ.get("APP_LOG_LEVEL", "INFO"),
+        },
+    },
+}  # App timings (e.g. chatbot time-to-first-token) go to stdout
+
 # --- Rest Framework Defaults -----------------------------------------
 
 REST_FRAMEWORK = {
@@ -125,3 +142,5 @@ SECURE_PROXY_SSL_HEADER = ("HTTP_X_FORWARDED_PROTO", "https")  # Trust upstream
 SECURE_SSL_REDIRECT = os.environ.get("SECURE_SSL_REDIRECT", "0") == "1"  # Redirect HTTP to HTTPS
 SESSION_COOKIE_SECURE = os.environ.get("SESSION_COOKIE_SECURE", "0") == "1"  # HTTPS-only session cookie
 CSRF_COOKIE_SECURE = os.environ.get("CSRF_COOKIE_SECURE", "0") == "1"  # HTTPS-only CSRF cookie
+
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")  # Bearer token for /api/metrics/ scrapes
@@ -1,6 +1,31 @@
 from django.contrib import admin
-from .models import Conversation, Message
+from .models import (
+    ChatMessage,
+    ChatSession,
+    Conversation,
+    DietFoodStat,
+    DietStat,
+    FavoriteFood,
+    Food,
+    LLMCacheEntry,
+    Message,
+    OrderedDish,
+    SimulationJob,
+    SimulationRun,
+    SimulationShard,
+)
 
 # Register models for admin visibility
 admin.site.register(Conversation)
 admin.site.register(Message)
+admin.site.register(SimulationJob)
+admin.site.register(LLMCacheEntry)
+admin.site.register(DietStat)
+admin.site.register(DietFoodStat)
+admin.site.register(ChatSession)
+admin.site.register(ChatMessage)
+admin.site.register(SimulationRun)
+admin.site.register(SimulationShard)
+admin.site.register(Food)
+admin.site.register(FavoriteFood)
+admin.site.register(OrderedDish)
@@ -0,0 +1,181 @@
+from collections import Counter
+
+from django.db import connection, transaction
+from django.db.models import Count, Max, Sum
+
+from .foods import LINK_MODELS, canonical_foods, food_counts
+from .models import Conversation, DietFoodStat, DietStat
+
+
+# Count conversations per diet, and favorite and ordered foods per diet, for the given
+# (diet, favorite_foods, ordered_dishes) rows. A food counts once per conversation and kind,
+# like a row of the FavoriteFood or OrderedDish table.
+def count_rows(rows) -> tuple[Counter, Counter]:
+    known = {diet for diet, _ in Conversation.DIET_CHOICES}
+    diets = Counter()
+    foods = Counter()  # (diet, kind, food) -> conversations
+    for diet, favorite_foods, ordered_dishes in rows:
+        if diet not in known:
+            continue  # Skip unknown diet
+        diets[diet] += 1
+        for kind, items in [("favorite", favorite_foods), ("ordered", ordered_dishes)]:
+            for food in canonical_foods(items):
+                foods[(diet, kind, food)] += 1
+    return diets, foods
+
+
+# Add counts to the stat tables with INSERT ... ON CONFLICT increments.
+# Keys are applied in sorted order so concurrent writers lock rows consistently.
+# Every touched diet row gets its version bumped, which invalidates dashboard caches.
+# Deltas may be negative (reclassification); PostgreSQL checks the proposed row before the
+# conflict, so a new row starts at no less than 0 and the delta itself goes to the update.
+def apply_counts(diets: Counter, foods: Counter) -> None:
+    diet_table = DietStat._meta.db_table
+    food_table = DietFoodStat._meta.db_table
+    touched = sorted(set(diets) | {diet for diet, _, _ in foods})
+    with connection.cursor() as cursor:
+        if touched:
+            cursor.executemany(
+                f"INSERT INTO {diet_table} (diet, conversation_count, version, updated_at) "
+                f"VALUES (%s, GREATEST(%s, 0), 1, clock_timestamp()) "
+                f"ON CONFLICT (diet) DO UPDATE SET "
+                f"conversation_count = {diet_table}.conversation_count + %s, "
+                f"version = {diet_table}.version + 1, updated_at = clock_timestamp()",
+                [(diet, diets.get(diet, 0), diets.get(diet, 0)) for diet in touched],
+            )
+        if foods:
+            cursor.executemany(
+                f"INSERT INTO {food_table} (diet, kind, food, count) "
+                f"VALUES (%s, %s, %s, GREATEST(%s, 0)) "
+                f"ON CONFLICT (diet, kind, food) DO UPDATE SET "
+                f"count = {food_table}.count + %s",
+                [
+                    (diet, kind, food, count, count)
+                    for (diet, kind, food), count in sorted(foods.items())
+                ],
+            )
+
+
+# Fold newly saved conversations into the stats; call inside the writing transaction.
+def record_conversations(conversations) -> None:
+    apply_counts(
+        *count_rows(
+            (conv.diet, conv.favorite_foods, conv.ordered_dishes) for conv in conversations
+        )
+    )
+
+
+# Move reclassified conversations between diet buckets; call inside the updating transaction.
+# changes are (old_diet, new_diet, favorite_foods, ordered_dishes) tuples.
+def record_reclassified(changes) -> None:
+    changes = list(changes)
+    diets, foods = count_rows((new, favorite, ordered) for _, new, favorite, ordered in changes)
+    old_diets, old_foods = count_rows(
+        (old, favorite, ordered) for old, _, favorite, ordered in changes
+    )
+    diets.subtract(old_diets)  # Keeps negative deltas
+    foods.subtract(old_foods)
+    apply_counts(
+        Counter({key: delta for key, delta in diets.items() if delta}),
+        Counter({key: delta for key, delta in foods.items() if delta}),
+    )
+
+
+# Recompute all stats with SQL GROUP BY over the conversation and food link tables.
+# The exclusive lock makes concurrent writers wait, so no increment is lost or doubled.
+def rebuild_stats() -> tuple[int, int]:
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"LOCK TABLE {DietStat._meta.db_table}, {DietFoodStat._meta.db_table} "
+                "IN EXCLUSIVE MODE"
+            )
+        previous = dashboard_state()["version"]
+        DietStat.objects.all().delete()
+        DietFoodStat.objects.all().delete()
+        known = [diet for diet, _ in Conversation.DIET_CHOICES]
+        diets = Counter(
+            dict(
+                Conversation.objects.filter(diet__in=known)
+                .values_list("diet")
+                .annotate(total=Count("id"))
+                .values_list("diet", "total")
+            )
+        )
+        foods = Counter(
+            {
+                (diet, kind, food): total
+                for kind in LINK_MODELS
+                for (diet, food), total in food_counts(kind, known).items()
+            }
+        )
+        apply_counts(diets, foods)
+        DietStat.objects.update(version=previous + 1)  # Versions keep growing across rebuilds
+    return sum(diets.values()), len(foods)
+
+
+# --- Readers ----------------------------------------------------------
+
+# Version and time of the last stats change; one query over the few diet rows.
+# The version only grows, so it can key caches and ETags of anything built from the stats.
+def dashboard_state() -> dict[str, object]:
+    state = DietStat.objects.aggregate(
+        version=Sum("version"), rows=Count("id"), updated_at=Max("updated_at")
+    )
+    return {
+        "version": state["version"] or 0,
+        "rows": state["rows"],
+        "updated_at": state["updated_at"],
+    }
+
+
+# Conversation count per diet, with every diet present.
+def diet_counts() -> dict[str, int]:
+    counts = {diet: 0 for diet, _ in Conversation.DIET_CHOICES}  # Baseline
+    for diet, count in DietStat.objects.values_list("diet", "conversation_count"):
+        if diet in counts:
+            counts[diet] = count
+    return counts
+
+
+# Most frequent favorite (or ordered) foods for one diet, read from the stat index.
+def top_foods(diet: str, top_n: int, kind: str = "favorite") -> list[tuple[str, int]]:
+    return list(
+        DietFoodStat.objects.filter(diet=diet, kind=kind, count__gt=0)  # Moved-out foods stay at 0
+        .order_by("-count", "food")
+        .values_list("food", "count")[:top_n]
+    )
+
+
+# Most frequent favorite (or ordered) foods for every diet.
+def top_foods_by_diet(top_n: int, kind: str = "favorite") -> dict[str, list[tuple[str, int]]]:
+    return {diet: top_foods(diet, top_n, kind) for diet, _ in Conversation.DIET_CHOICES}
+
+
+# LLM cost and latency per diet mode over the most recent `window` simulated conversations.
+# Bounded by the (created_at, id) index so the dashboard never scans the whole table.
+def llm_usage_by_mode(window: int) -> list[dict[str, object]]:
+    table = Conversation._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT diet_mode, COUNT(*), SUM(llm_cost), AVG(input_tokens + output_tokens), "
+            f"percentile_cont(0.5) WITHIN GROUP (ORDER BY llm_ms), "
+            f"percentile_cont(0.95) WITHIN GROUP (ORDER BY llm_ms) "
+            f"FROM (SELECT diet_mode, llm_calls, llm_cost, input_tokens, output_tokens, llm_ms "
+            f"FROM {table} ORDER BY created_at DESC, id DESC LIMIT %s) recent "
+            f"WHERE llm_calls > 0 GROUP BY diet_mode ORDER BY diet_mode",
+            [window],
+        )
+        rows = cursor.fetchall()
+    return [
+        {
+            "diet_mode": mode or "unknown",
+            "conversations": count,
+            "total_cost": total_cost or 0,
+            "avg_cost": (total_cost or 0) / count,
+            "avg_tokens": round(avg_tokens or 0),
+            "p50_ms": round(p50 or 0),
+            "p95_ms": round(p95 or 0),
+        }
+        for mode, count, total_cost, avg_tokens, p50, p95 in rows
+    ]
@@ -0,0 +1,219 @@
+import os
+from dataclasses import dataclass
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+
+from .llm import ChatReply, agenerate_chat, agenerate_text
+from .models import ChatMessage, ChatSession
+from .prompts import PROMPTS
+
+HISTORY_TOKEN_BUDGET = int(os.environ.get("CHAT_HISTORY_TOKENS", "1500"))  # Prompt history cap
+CHAINING = os.environ.get("CHAT_CHAINING", "1") == "1"  # Use previous_response_id when possible
+WINDOW_MAX_MESSAGES = 40  # Most recent messages read when rebuilding the window
+SUMMARY_MAX_MESSAGES = 200  # Most messages folded into the summary at once
+
+
+# Rough token count (about 4 characters per token); good enough for budgeting.
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+# What to send for one turn.
+@dataclass
+class ChatPrompt:
+    messages: list[dict[str, str]]  # Role messages; only the new one when chained
+    instructions: str
+    previous_response_id: str | None = None
+
+
+# Return the user's session, a new one when session_id is None, or None if it is not theirs.
+async def aget_session(user, session_id=None) -> ChatSession | None:
+    if session_id is None:
+        return await ChatSession.objects.acreate(user=user)
+    return await ChatSession.objects.filter(pk=session_id, user=user).afirst()
+
+
+# Bot instructions first and the summary after them, so the instructions stay a cached prefix.
+def _instructions(session: ChatSession) -> str:
+    instructions = PROMPTS["chat"].instructions
+    if not session.summary:
+        return instructions
+    return f"{instructions}\n\nSummary of the conversation so far: {session.summary}"
+
+
+def _summary_input(session: ChatSession, messages: list[dict[str, object]]) -> str:
+    transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+    return PROMPTS["chat_summary"].render(
+        summary=session.summary or "(none)", transcript=transcript
+    )
+
+
+# Fold messages into the rolling summary so the prompt only carries the recent window.
+async def _asummarize(session: ChatSession, messages: list[dict[str, object]]) -> None:
+    session.summary = await agenerate_text(
+        _summary_input(session, messages),
+        PROMPTS["chat_summary"].instructions,
+        cache=False,
+        site="chat_summary",
+    )
+    session.summarized_through = messages[-1]["turn_index"]
+    await session.asave(update_fields=["summary", "summarized_through", "updated_at"])
+
+
+# The prompt when the provider-side chain is still under the token budget: only the new
+# message is sent. None when the history has to be rebuilt from the window.
+def _chained_prompt(session: ChatSession, user_input: str, chain: bool) -> ChatPrompt | None:
+    budget = HISTORY_TOKEN_BUDGET - estimate_tokens(user_input)
+    if chain and session.last_response_id and session.context_tokens <= budget:
+        new_message = {"role": "user", "content": user_input}
+        return ChatPrompt([new_message], _instructions(session), session.last_response_id)
+    return None
+
+
+def _recent_messages(session: ChatSession):
+    return (
+        session.messages.filter(turn_index__gt=session.summarized_through)
+        .order_by("-turn_index")
+        .values("turn_index", "role", "content", "tokens")[:WINDOW_MAX_MESSAGES]
+    )  # Newest first
+
+
+def _older_messages(session: ChatSession, window_start: int):
+    return (
+        session.messages.filter(
+            turn_index__gt=session.summarized_through, turn_index__lt=window_start
+        )
+        .order_by("turn_index")
+        .values("turn_index", "role", "content")[:SUMMARY_MAX_MESSAGES]
+    )
+
+
+# The newest messages that fit the budget next to the summary, oldest first,
+# and the turn index the window starts at.
+def _fit_window(
+    session: ChatSession, recent: list[dict[str, object]], user_input: str
+) -> tuple[list[dict[str, object]], int]:
+    budget = HISTORY_TOKEN_BUDGET - estimate_tokens(user_input)
+    window = []
+    used = estimate_tokens(session.summary)
+    for message in recent:
+        if used + message["tokens"] > budget:
+            break
+        window.append(message)
+        used += message["tokens"]
+    window.reverse()
+    window_start = window[0]["turn_index"] if window else session.turn_count + 1
+    return window, window_start
+
+
+def _window_prompt(
+    session: ChatSession, window: list[dict[str, object]], user_input: str
+) -> ChatPrompt:
+    messages = [
+        {"role": message["role"], "content": message["content"]}
+        for message in window
+        if message["turn_index"] > session.summarized_through
+    ]
+    return ChatPrompt(
+        messages + [{"role": "user", "content": user_input}], _instructions(session)
+    )
+
+
+# Build the prompt for the next user message.
+# While the provider-side chain stays under the token budget only the new message is sent;
+# otherwise the newest turns that fit the budget are sent and everything older is summarized.
+async def aprepare_turn(
+    session: ChatSession, user_input: str, chain: bool = CHAINING
+) -> ChatPrompt:
+    prompt = _chained_prompt(session, user_input, chain)
+    if prompt is not None:
+        return prompt
+    recent = [message async for message in _recent_messages(session)]
+    window, window_start = _fit_window(session, recent, user_input)
+    if window_start > session.summarized_through + 1:
+        older = [message async for message in _older_messages(session, window_start)]
+        if older:
+            await _asummarize(session, older)
+    return _window_prompt(session, window, user_input)
+
+
+# Store both sides of a turn and move the chain head.
+# Without a response id (e.g. streamed replies) the next turn rebuilds from the window.
+def record_turn(
+    session: ChatSession,
+    user_input: str,
+    reply: str,
+    response_id: str = "",
+    context_tokens: int = 0,
+) -> None:
+    with transaction.atomic():
+        session = ChatSession.objects.select_for_update().get(pk=session.pk)  # Serialize turns
+        first = session.turn_count + 1
+        ChatMessage.objects.bulk_create(
+            [
+                ChatMessage(
+                    session=session,
+                    role="user",
+                    content=user_input,
+                    turn_index=first,
+                    tokens=estimate_tokens(user_input),
+                ),
+                ChatMessage(
+                    session=session,
+                    role="assistant",
+                    content=reply,
+                    turn_index=first + 1,
+                    tokens=estimate_tokens(reply),
+                ),
+            ]
+        )
+        session.turn_count = first + 1
+        session.last_response_id = response_id
+        session.context_tokens = context_tokens
+        session.save(
+            update_fields=["turn_count", "last_response_id", "context_tokens", "updated_at"]
+        )
+
+
+# Turns are serialized with a row lock, which needs a transaction: run it in a thread.
+async def arecord_turn(
+    session: ChatSession,
+    user_input: str,
+    reply: str,
+    response_id: str = "",
+    context_tokens: int = 0,
+) -> None:
+    await sync_to_async(record_turn)(session, user_input, reply, response_id, context_tokens)
+
+
+# The provider dropped the chain (expired or unknown response id); rebuild from the window.
+def _chain_expired(prompt: ChatPrompt, exc: Exception) -> bool:
+    return bool(prompt.previous_response_id) and getattr(exc, "status_code", None) in {400, 404}
+
+
+def _context_tokens(session: ChatSession, prompt: ChatPrompt, reply: ChatReply) -> int:
+    context_tokens = reply.input_tokens + reply.output_tokens
+    if not context_tokens:  # Backend reported no usage; estimate instead
+        context_tokens = (session.context_tokens if prompt.previous_response_id else 0) + sum(
+            estimate_tokens(text)
+            for text in [prompt.instructions, reply.text, *(m["content"] for m in prompt.messages)]
+        )
+    return context_tokens
+
+
+# Answer one user message in a session without blocking the event loop.
+async def achat_reply(session: ChatSession, user_input: str) -> str:
+    prompt = await aprepare_turn(session, user_input)
+    try:
+        reply = await agenerate_chat(
+            prompt.messages, prompt.instructions, prompt.previous_response_id
+        )
+    except Exception as exc:
+        if not _chain_expired(prompt, exc):
+            raise
+        prompt = await aprepare_turn(session, user_input, chain=False)
+        reply = await agenerate_chat(prompt.messages, prompt.instructions)
+    context_tokens = _context_tokens(session, prompt, reply)
+    await arecord_turn(session, user_input, reply.text, reply.response_id, context_tokens)
+    return reply.text
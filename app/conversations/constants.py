@@ -1,5 +1,26 @@
-MAX_RUN_COUNT = 100  # Cap batch runs to keep jobs short
-MAX_EXPORT_COUNT = 500  # Limit export payload size
+MAX_RUN_COUNT = 10000  # Cap per job; runs execute in the background worker
+MAX_EXPORT_COUNT = 500  # Limit buffered export payload size
+EXPORT_CHUNK_SIZE = 2000  # Rows per server-side cursor fetch in streamed exports
 DASHBOARD_LATEST_COUNT = 100  # UI list size for recent runs
 TOP_FOODS_COUNT = 10  # Number of top foods per diet group
+TOP_FOODS_MAX_COUNT = 100  # Upper bound for the foods summary API
 DIET_MODES = {"self", "rules", "llm"}  # Allowed diet selection modes
+SIMULATION_BATCH_SIZE = 50  # Conversations per bulk insert transaction
+JOB_PROGRESS_INTERVAL = 2.0  # Seconds between job progress writes
+JOB_ERRORS_KEPT = 20  # Failure messages stored per job
+JOB_POLL_INTERVAL = 2.0  # Worker sleep when the queue is empty
+PAGE_SIZE = 100  # Default keyset page size for list APIs
+MAX_PAGE_SIZE = 1000  # Largest page a client may request
+DIET_BATCH_SIZE = 25  # Conversations per batched LLM diet classification
+RECLASSIFY_RULES_BATCH_SIZE = 1000  # Rows per transaction when reclassifying with rules
+SIMULATION_RESUME_ATTEMPTS = 2  # Times an interrupted conversation is resumed before it fails
+DASHBOARD_USAGE_WINDOW = 1000  # Recent conversations behind the LLM cost/latency table
+DASHBOARD_CACHE_SECONDS = 300  # Dashboard fragment lifetime; keys also change with the stats
+RUN_PROGRESS_INTERVAL = 10.0  # Seconds between progress lines of a multi-process run
+SEARCH_CONFIG = "english"  # Text search configuration of the tsvector columns and queries
+SEARCH_PAGE_SIZE = 20  # Default page size of ranked search results
+SEARCH_MAX_PAGE_SIZE = 100  # Largest search page a client may request
+SEARCH_FOOD_MATCHES = 20  # Food names a food search expands to, best matches first
+PARTITION_MONTHS_AHEAD = 3  # Monthly partitions kept ready past the current month
+ARCHIVE_KEEP_MONTHS = 12  # Full months of conversations kept online by archive_conversations
+RUN_CLOCK_SKEW_HOURS = 24  # Slack for host clocks when bounding a run's rows by its start time
@@ -0,0 +1,68 @@
+import json
+
+from .llm import generate_structured
+from .prompts import PROMPTS
+
+DIETS = {"omnivore", "vegetarian", "vegan"}  # Valid classifier outputs
+
+
+# Prompt for classifying a single conversation.
+def single_prompt(favorite_foods: list[str], ordered_dishes: list[str]) -> str:
+    return PROMPTS["diet_classification"].render(
+        favorite_foods=favorite_foods, ordered_dishes=ordered_dishes
+    )
+
+
+# Prompt for classifying many conversations in one request.
+def batch_prompt(items: list[tuple[str, list[str], list[str]]]) -> str:
+    lines = [
+        json.dumps({"id": item_id, "favorite_foods": favorite, "ordered_dishes": ordered})
+        for item_id, favorite, ordered in items
+    ]
+    return PROMPTS["diet_batch_classification"].render(customers="\n".join(lines))
+
+
+def _classify(prompt: str, site: str) -> dict[str, object]:
+    template = PROMPTS[site]
+    return generate_structured(
+        prompt, template.instructions, template.schema, template.schema_name, site=site
+    )
+
+
+# Classify one conversation with its own LLM call.
+def classify_diet_llm(favorite_foods: list[str], ordered_dishes: list[str]) -> str:
+    return _classify(single_prompt(favorite_foods, ordered_dishes), "diet_classification")["diet"]
+
+
+# Classify many conversations with one structured call.
+# items are (id, favorite_foods, ordered_dishes); ids missing or invalid in the reply
+# are retried one by one. Returns ({id: diet or None}, LLM calls made).
+def classify_diets_llm_batch(
+    items: list[tuple[object, list[str], list[str]]],
+) -> tuple[dict[object, str | None], int]:
+    if not items:
+        return {}, 0
+    by_key = {str(item_id): (item_id, favorite, ordered) for item_id, favorite, ordered in items}
+    calls = 1
+    try:
+        reply = _classify(
+            batch_prompt([(key, fav, ordered) for key, (_, fav, ordered) in by_key.items()]),
+            "diet_batch_classification",
+        )
+        results = reply.get("results") or []
+    except Exception:
+        results = []  # Whole batch falls back to single calls
+    diets = {}
+    for result in results:
+        key = str(result.get("id"))
+        if key in by_key and result.get("diet") in DIETS:
+            diets[by_key[key][0]] = result["diet"]  # Map back to the caller's id
+    for item_id, favorite, ordered in by_key.values():
+        if item_id in diets:
+            continue
+        calls += 1
+        try:
+            diets[item_id] = classify_diet_llm(favorite, ordered)  # Per-item fallback
+        except Exception:
+            diets[item_id] = None  # Caller decides
+    return diets, calls
@@ -1,4 +1,5 @@
 import re
+from bisect import bisect_right
 
 MEAT_KEYWORDS = {
     "beef",
@@ -22,7 +23,12 @@ MEAT_KEYWORDS = {
     "crab",
     "lobster",
     "anchovy",
-}  # Detect meat or fish signals
+    "fish sauce",
+    "oyster sauce",
+    "chicken stock",
+    "beef broth",
+    "bone broth",
+}  # Detect meat or fish signals; multi-word phrases allowed
 
 ANIMAL_PRODUCT_KEYWORDS = {
     "cheese",
@@ -35,35 +41,108 @@ ANIMAL_PRODUCT_KEYWORDS = {
     "honey",
 }  # Detect dairy or eggs
 
-TOKEN_RE = re.compile(r"\b[\w']+\b", re.UNICODE)  # Extract word tokens
+PLANT_BASED_PHRASES = {
+    "peanut butter",
+    "almond butter",
+    "cocoa butter",
+    "coconut milk",
+    "almond milk",
+    "soy milk",
+    "oat milk",
+    "rice milk",
+    "coconut cream",
+    "cashew cream",
+}  # Plant foods whose names contain an animal keyword
 
+PLANT_BASED_PREFIXES = {"vegan", "plant based", "meatless", "dairy free"}  # "vegan cheese" etc.
 
-# Normalize text into a set of lowercase word tokens.
-def _tokenize(text: str) -> set[str]:
-    cleaned = text.replace("-", " ")  # Split hyphenated words
-    return set(TOKEN_RE.findall(cleaned.lower()))  # Normalize tokens
+SEPARATOR = "\n"  # Joins items; phrases never match across it
+ROW_SEPARATOR = "\x00"  # Joins rows in classify_many
+SIBILANT_ENDINGS = ("s", "x", "z", "ch", "sh")  # Words pluralized with "es"
+SPACE_TRANSLATION = str.maketrans({"-": " ", "_": " ", "\t": " "})  # Split hyphenated words
 
 
-# Aggregate unique tokens across a list of input items.
-def _collect_tokens(items: list[str] | None) -> set[str]:
-    tokens = set()
-    for item in items or []:
-        if not item:
-            continue  # Skip blanks
-        tokens |= _tokenize(str(item))
-    return tokens  # Combined tokens
+# Lowercase and turn word joiners into spaces; phrase patterns accept any run of spaces.
+def _normalize(text: str) -> str:
+    return text.lower().translate(SPACE_TRANSLATION)
 
 
-# Infer diet by checking food tokens against meat and animal-product keywords.
+# Singular and plural spellings of a keyword; only the last word of a phrase is inflected.
+def _variants(keyword: str) -> set[str]:
+    *head, last = keyword.split()
+    forms = {last, last + "s"}
+    if last.endswith(SIBILANT_ENDINGS):
+        forms.add(last + "es")  # fish -> fishes, but not cod -> codes
+    if last.endswith("y") and last[-2:-1] not in set("aeiou"):
+        forms.add(last[:-1] + "ies")  # anchovy -> anchovies
+    return {" ".join([*head, form]) for form in forms}
+
+
+# Regex alternation for a keyword set, longest first so phrases win over their words.
+def _alternation(keywords) -> str:
+    forms = set()
+    for keyword in keywords:
+        forms |= _variants(_normalize(keyword))
+    ordered = sorted(forms, key=lambda form: (-len(form), form))
+    return "|".join(re.escape(form).replace(r"\ ", " +") for form in ordered)
+
+
+# Compiled once at import: plant phrases first so they consume e.g. "peanut butter".
+DIET_RE = re.compile(
+    r"(?<![\w'])(?:"
+    rf"(?P<plant>(?:{_alternation(PLANT_BASED_PREFIXES)}) +[\w']+|{_alternation(PLANT_BASED_PHRASES)})"
+    rf"|(?P<meat>{_alternation(MEAT_KEYWORDS)})"
+    rf"|(?P<animal>{_alternation(ANIMAL_PRODUCT_KEYWORDS)})"
+    r")(?![\w'])"
+)
+WORD_RE = re.compile(r"\w")  # Any evidence at all
+ROW_RE = re.compile(ROW_SEPARATOR)
+
+
+# Join non-blank items of both lists into one text.
+def _row_text(favorite_foods: list[str] | None, ordered_dishes: list[str] | None) -> str:
+    return SEPARATOR.join(
+        str(item) for item in (favorite_foods or []) + (ordered_dishes or []) if item
+    )
+
+
+# Infer diet by checking foods against meat and animal-product keywords.
 def classify_diet_rules(
     favorite_foods: list[str] | None,
     ordered_dishes: list[str] | None,
 ) -> str | None:
-    tokens = _collect_tokens(favorite_foods) | _collect_tokens(ordered_dishes)
-    if not tokens:
+    text = _normalize(_row_text(favorite_foods, ordered_dishes))
+    if not WORD_RE.search(text):
         return None  # No evidence
-    if tokens & MEAT_KEYWORDS:
-        return "omnivore"  # Meat or fish found
-    if tokens & ANIMAL_PRODUCT_KEYWORDS:
-        return "vegetarian"  # Animal product found
-    return "vegan"  # Plant-only default
+    animal = False
+    for match in DIET_RE.finditer(text):
+        if match.lastgroup == "meat":
+            return "omnivore"  # Meat or fish found
+        if match.lastgroup == "animal":
+            animal = True
+    return "vegetarian" if animal else "vegan"  # Animal product found, else plant-only
+
+
+# Classify many (favorite_foods, ordered_dishes) rows with a single regex scan.
+# Returns one diet (or None for rows without evidence) per input row, in order.
+def classify_many(rows) -> list[str | None]:
+    texts = [_row_text(favorite, ordered) for favorite, ordered in rows]
+    if not texts:
+        return []
+    blob = _normalize(ROW_SEPARATOR.join(texts))
+    starts = [0] + [match.end() for match in ROW_RE.finditer(blob)]  # Row offsets
+    meat = [False] * len(texts)
+    animal = [False] * len(texts)
+    for match in DIET_RE.finditer(blob):
+        row = bisect_right(starts, match.start()) - 1
+        if match.lastgroup == "meat":
+            meat[row] = True
+        elif match.lastgroup == "animal":
+            animal[row] = True
+    return [
+        None if not WORD_RE.search(text)
+        else "omnivore" if meat[row]
+        else "vegetarian" if animal[row]
+        else "vegan"
+        for row, text in enumerate(texts)
+    ]
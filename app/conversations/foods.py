@@ -0,0 +1,71 @@
+from django.db.models import Count
+
+from .models import Conversation, FavoriteFood, Food, OrderedDish
+
+FOOD_MAX_LENGTH = 255  # Food.name and DietFoodStat.food column size
+LINK_MODELS = {"favorite": FavoriteFood, "ordered": OrderedDish}  # Kind -> link table
+CONVERSATION_LOOKUPS = {"favorite": "favorites", "ordered": "orders"}  # Kind -> M2M field
+
+
+# Canonical form used for food counting and the food table.
+def normalize_food(food) -> str:
+    return str(food).strip().lower()[:FOOD_MAX_LENGTH]
+
+
+# Canonical names in first-seen order; blanks and repeats are dropped.
+def canonical_foods(foods) -> list[str]:
+    names = {}
+    for food in foods or []:
+        if food:
+            name = normalize_food(food)
+            if name:
+                names.setdefault(name, None)
+    return list(names)
+
+
+# Food ids by name, inserting the names not seen before.
+# Names are inserted in sorted order so concurrent writers lock rows consistently.
+def food_ids(names) -> dict[str, int]:
+    names = sorted(set(names))
+    if not names:
+        return {}
+    Food.objects.bulk_create([Food(name=name) for name in names], ignore_conflicts=True)
+    return dict(Food.objects.filter(name__in=names).values_list("name", "id"))
+
+
+# Link saved conversations to their favorite and ordered foods.
+# Call inside the transaction that writes the conversations.
+def link_foods(conversations) -> None:
+    favorites = {conv.pk: canonical_foods(conv.favorite_foods) for conv in conversations}
+    orders = {conv.pk: canonical_foods(conv.ordered_dishes) for conv in conversations}
+    ids = food_ids(
+        name for links in (favorites, orders) for names in links.values() for name in names
+    )
+    for model, links in [(FavoriteFood, favorites), (OrderedDish, orders)]:
+        model.objects.bulk_create(
+            [
+                model(conversation_id=pk, food_id=ids[name], position=position)
+                for pk, names in links.items()
+                for position, name in enumerate(names, start=1)
+            ]
+        )
+
+
+# --- Readers ----------------------------------------------------------
+
+# Conversations per (diet, food) for one kind, counted by SQL GROUP BY over the link table.
+def food_counts(kind: str, diets) -> dict[tuple[str, str], int]:
+    return {
+        (diet, food): total
+        for diet, food, total in LINK_MODELS[kind].objects.filter(conversation__diet__in=diets)
+        .values_list("conversation__diet", "food__name")
+        .annotate(total=Count("id"))
+        .values_list("conversation__diet", "food__name", "total")
+    }
+
+
+# Conversations that list `food` as a favorite or an order, through the (food, conversation) index.
+def conversations_with_food(food: str, kind: str = "favorite"):
+    return Conversation.objects.filter(
+        **{f"{CONVERSATION_LOOKUPS[kind]}__name": normalize_food(food)}
+    )
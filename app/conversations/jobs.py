@@ -0,0 +1,116 @@
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .constants import SIMULATION_BATCH_SIZE
+from .models import SimulationJob
+from .persistence import run_conversations
+from .progress import ProgressWriter
+from .runs import open_run, reopen_run, run_shard
+
+
+# Queue a simulation run for the worker; returns immediately.
+def enqueue_simulation(count: int, diet_mode: str, user=None) -> SimulationJob:
+    return SimulationJob.objects.create(
+        count=count,
+        diet_mode=diet_mode,
+        requested_by=user if user and user.is_authenticated else None,
+    )
+
+
+async def aenqueue_simulation(count: int, diet_mode: str, user=None) -> SimulationJob:
+    return await SimulationJob.objects.acreate(
+        count=count,
+        diet_mode=diet_mode,
+        requested_by=user if user and user.is_authenticated else None,
+    )
+
+
+# Atomically claim the oldest queued job; concurrent workers skip locked rows.
+def claim_next_job() -> SimulationJob | None:
+    with transaction.atomic():
+        job = (
+            SimulationJob.objects.select_for_update(skip_locked=True)
+            .filter(status="queued")
+            .order_by("created_at")
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = "running"
+        job.started_at = timezone.now()
+        job.save(update_fields=["status", "started_at"])
+    return job
+
+
+# Run key of a job: conversations are labelled job-<id>_customer_<n>.
+def job_run_key(job: SimulationJob) -> str:
+    return f"job-{job.pk}"
+
+
+# Put a job left running by a dead worker back in the queue. Its run keeps what was
+# saved, so the next worker only simulates the missing conversations.
+def requeue_job(job: SimulationJob) -> bool:
+    return bool(
+        SimulationJob.objects.filter(pk=job.pk, status__in=["running", "failed"]).update(
+            status="queued", error="", finished_at=None
+        )
+    )
+
+
+# Execute a claimed job through its simulation run and store its final status.
+# The run makes the job idempotent: a requeued job skips the conversations already saved.
+def run_job(
+    job: SimulationJob,
+    concurrency: int = 1,
+    batch_size: int = SIMULATION_BATCH_SIZE,
+) -> SimulationJob:
+    progress = None
+    try:
+        run = open_run(job_run_key(job), job.count, job.diet_mode, 1)
+        if job.run_id is None:
+            job.run = run
+            job.save(update_fields=["run"])
+        job.completed, job.failed, job.errors = run_conversations(run).count(), 0, []
+        if reopen_run(run):  # Also resets a shard a dead worker left running
+            progress = ProgressWriter(job)
+            progress.start()
+            shard, _ = run_shard(
+                run, 0, concurrency=concurrency, batch_size=batch_size, on_progress=progress.record
+            )
+            job.status, job.error = shard.status, shard.error
+        else:
+            job.status = "succeeded"  # Every conversation was already saved
+    except Exception as exc:
+        job.status = "failed"
+        job.error = str(exc)  # Whole run aborted
+    finally:
+        if progress is not None:
+            progress.stop()
+    if progress is not None:
+        for key, value in progress.snapshot().items():
+            setattr(job, key, value)
+    job.finished_at = timezone.now()
+    close_old_connections()  # Long runs can outlive the connection
+    job.save(
+        update_fields=["status", "error", "completed", "failed", "errors", "finished_at"]
+    )
+    return job
+
+
+# Serialize job state for the status endpoint.
+def job_payload(job: SimulationJob) -> dict[str, object]:
+    return {
+        "id": job.id,
+        "status": job.status,
+        "count": job.count,
+        "diet_mode": job.diet_mode,
+        "run": job_run_key(job) if job.run_id else None,
+        "completed": job.completed,
+        "failed": job.failed,
+        "progress": (job.completed + job.failed) / job.count if job.count else 1.0,
+        "errors": job.errors,
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
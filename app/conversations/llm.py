@@ -1,39 +1,404 @@
+import asyncio
 import os
-from openai import OpenAI
+import threading
+import weakref
+from dataclasses import dataclass
+from openai import AsyncOpenAI, OpenAI
+import httpx
 import json
 
+from .llm_cache import build_cache, cache_key
+from .llm_scheduler import Scheduler
+from .metrics import observe_llm_call, record_cache_hit
+
 DEFAULT_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4.1")  # Allow env override
+POOL_SIZE = int(os.environ.get("OPENAI_POOL_SIZE", "20"))  # Max open connections per client
+KEEPALIVE_EXPIRY = float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY", "30"))  # Idle seconds
+REQUEST_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT", "60"))  # Read/write seconds
+CONNECT_TIMEOUT = float(os.environ.get("OPENAI_CONNECT_TIMEOUT", "5"))  # TCP/TLS seconds
+
+
+# --- Shared Clients ---------------------------------------------------
+
+_lock = threading.Lock()
+_sync_client = None  # One pooled client per process
+_async_clients = weakref.WeakKeyDictionary()  # One pooled client per event loop
+_counters = {"requests": 0, "connections_opened": 0}  # Pool reuse counters
+
+
+def _count(key: str) -> None:
+    with _lock:
+        _counters[key] += 1
+
+
+# httpcore trace hook: a TCP connect means a new pooled connection.
+def _trace(event_name: str, info: dict) -> None:
+    if event_name == "connection.connect_tcp.complete":
+        _count("connections_opened")
+
+
+async def _atrace(event_name: str, info: dict) -> None:
+    _trace(event_name, info)
+
+
+def _on_request(request: httpx.Request) -> None:
+    _count("requests")
+    request.extensions["trace"] = _trace  # Observe connection setup
+
+
+async def _aon_request(request: httpx.Request) -> None:
+    _count("requests")
+    request.extensions["trace"] = _atrace  # Observe connection setup
+
+
+def _pool_options() -> dict[str, object]:
+    return {
+        "limits": httpx.Limits(
+            max_connections=POOL_SIZE,
+            max_keepalive_connections=POOL_SIZE,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+        "timeout": httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT),
+    }
+
+
+# Return the process-wide OpenAI client, creating it on first use.
+def get_client() -> OpenAI:
+    global _sync_client
+    with _lock:
+        if _sync_client is None:
+            http_client = httpx.Client(
+                event_hooks={"request": [_on_request]}, **_pool_options()
+            )
+            _sync_client = OpenAI(http_client=http_client, max_retries=0)  # Scheduler retries
+        return _sync_client
+
+
+# Return the AsyncOpenAI client bound to the running event loop.
+# Async connections cannot cross loops, so each loop (e.g. each asyncio.run) gets its own pool.
+def get_async_client() -> AsyncOpenAI:
+    loop = asyncio.get_running_loop()
+    with _lock:
+        client = _async_clients.get(loop)
+        if client is None:
+            http_client = httpx.AsyncClient(
+                event_hooks={"request": [_aon_request]}, **_pool_options()
+            )
+            client = AsyncOpenAI(http_client=http_client, max_retries=0)  # Scheduler retries
+            _async_clients[loop] = client
+        return client
+
+
+# Close the pool bound to the running loop; call before the loop shuts down.
+async def aclose_async_client() -> None:
+    loop = asyncio.get_running_loop()
+    with _lock:
+        client = _async_clients.pop(loop, None)
+    if client is not None:
+        await client.close()
+
+
+# Drop inherited clients in forked children (gunicorn workers) so sockets are never shared.
+def _reset_after_fork() -> None:
+    global _lock, _sync_client, _async_clients, _scheduler
+    _lock = threading.Lock()
+    _sync_client = None
+    _async_clients = weakref.WeakKeyDictionary()
+    _scheduler = None  # Fresh limiter and breaker per worker
+    for key in _counters:
+        _counters[key] = 0  # Count per worker process
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+# Report connection pool reuse for the current process.
+def client_stats() -> dict[str, object]:
+    with _lock:
+        requests = _counters["requests"]
+        opened = _counters["connections_opened"]
+    reused = max(requests - opened, 0)
+    return {
+        "requests": requests,
+        "connections_opened": opened,
+        "connections_reused": reused,
+        "reuse_rate": reused / requests if requests else 0.0,
+    }
+
+
+# --- Response Cache ---------------------------------------------------
+
+_cache = None  # Built lazily from LLM_CACHE_BACKEND
+_cache_ready = False
+
+
+# Return the configured response cache, or None when caching is off.
+def get_cache():
+    global _cache, _cache_ready
+    with _lock:
+        if not _cache_ready:
+            _cache = build_cache()
+            _cache_ready = True
+        return _cache
+
+
+# Report response cache hits and misses for the current process.
+def cache_stats() -> dict[str, object]:
+    cache = get_cache()
+    return cache.stats() if cache else {"enabled": False}
+
+
+# Cache key for a call, or None when this call must not be cached.
+def _lookup_key(use_cache, user_input, instructions, schema=None, name=""):
+    if not use_cache or get_cache() is None:
+        return None
+    return cache_key(DEFAULT_MODEL, instructions, user_input, schema, name)
+
+
+# Build the Responses API format block for schema-enforced output.
+def _json_schema_format(schema: dict[str, object], name: str) -> dict[str, object]:
+    return {
+        "format": {
+            "type": "json_schema",
+            "name": name,
+            "schema": schema,
+            "strict": True,
+        }
+    }
+
+
+# Responses API parameters of one call, as sent directly or inside a batch request file.
+def response_params(
+    user_input: str,
+    instructions: str,
+    schema: dict[str, object] | None = None,
+    name: str = "",
+) -> dict[str, object]:
+    params = {"model": DEFAULT_MODEL, "input": user_input, "instructions": instructions}
+    if schema is not None:
+        params["text"] = _json_schema_format(schema, name)
+    return params
 
 
-def generate_text(user_input: str, instructions: str) -> str:
+def _require_api_key() -> None:
     if not os.environ.get("OPENAI_API_KEY"):
         raise RuntimeError("OPENAI_API_KEY is not set")
-    client = OpenAI()
-    response = client.responses.create(
-        model=DEFAULT_MODEL,
-        input=user_input,
-        instructions=instructions,
-    )  # Call Responses API for text output
-    return response.output_text.strip()  # Normalize output for storage
+
+
+# --- Backends ---------------------------------------------------------
+
+LLM_BACKEND = os.environ.get("LLM_BACKEND", "openai").strip().lower()  # openai or fake
+
+
+# Real provider: the shared pooled OpenAI clients.
+# Backends take Responses API keyword arguments and return objects with
+# output_text (and usage/id), so callers never depend on the provider SDK.
+class OpenAIBackend:
+    name = "openai"
+
+    def create(self, **params):
+        _require_api_key()
+        return get_client().responses.create(**params)
+
+    async def acreate(self, **params):
+        _require_api_key()
+        return await get_async_client().responses.create(**params)
+
+    async def astream(self, **params):
+        _require_api_key()
+        stream = await get_async_client().responses.create(stream=True, **params)
+        async for event in stream:
+            if event.type == "response.output_text.delta":
+                yield event.delta
+
+
+_backend = None  # Selected lazily from LLM_BACKEND
+
+
+# Return the active LLM backend.
+def get_backend():
+    global _backend
+    with _lock:
+        if _backend is None:
+            if LLM_BACKEND == "fake":
+                from .llm_fake import FakeBackend
+
+                _backend = FakeBackend()
+            elif LLM_BACKEND == "openai":
+                _backend = OpenAIBackend()
+            else:
+                raise ValueError(f"Unknown LLM_BACKEND: {LLM_BACKEND}")
+        return _backend
+
+
+# Replace the active backend (benchmarks, offline runs); returns the previous one.
+def set_backend(backend):
+    global _backend
+    with _lock:
+        previous, _backend = _backend, backend
+    return previous
+
+
+# --- Scheduling -------------------------------------------------------
+
+_scheduler = None  # Rate limits, retries and circuit breaker for every backend call
+
+
+# Return the process-wide call scheduler.
+def get_scheduler() -> Scheduler:
+    global _scheduler
+    with _lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+        return _scheduler
+
+
+# Report retries, throttling and breaker state for the current process.
+def scheduler_stats() -> dict[str, object]:
+    return get_scheduler().stats()
+
+
+# Pass cache=False at call sites whose output must vary between identical prompts.
+def generate_text(
+    user_input: str, instructions: str, cache: bool = True, site: str = "text"
+) -> str:
+    key = _lookup_key(cache, user_input, instructions)
+    if key and (hit := get_cache().get(key)) is not None:
+        record_cache_hit(site, DEFAULT_MODEL)
+        return hit  # Served from cache
+    with observe_llm_call(site, DEFAULT_MODEL) as observed:
+        response = observed.response = get_scheduler().call(
+            get_backend().create,
+            model=DEFAULT_MODEL,
+            input=user_input,
+            instructions=instructions,
+        )  # Call Responses API for text output
+    text = response.output_text.strip()  # Normalize output for storage
+    if key:
+        get_cache().set(key, text)
+    return text
 
 
 def generate_structured(
-    user_input: str, instructions: str, schema: dict[str, object], name: str
+    user_input: str,
+    instructions: str,
+    schema: dict[str, object],
+    name: str,
+    cache: bool = True,
+    site: str = "",
 ) -> dict[str, object]:
-    if not os.environ.get("OPENAI_API_KEY"):
-        raise RuntimeError("OPENAI_API_KEY is not set")
-    client = OpenAI()
-    response = client.responses.create(
-        model=DEFAULT_MODEL,
-        input=user_input,
-        instructions=instructions,
-        text={
-            "format": {
-                "type": "json_schema",
-                "name": name,
-                "schema": schema,
-                "strict": True,
-            }
-        },
-    )  # Enforce schema output
-    return json.loads(response.output_text)  # Parse structured JSON
+    key = _lookup_key(cache, user_input, instructions, schema, name)
+    if key and (hit := get_cache().get(key)) is not None:
+        record_cache_hit(site or name, DEFAULT_MODEL)
+        return hit  # Served from cache
+    with observe_llm_call(site or name, DEFAULT_MODEL) as observed:
+        response = observed.response = get_scheduler().call(
+            get_backend().create,
+            model=DEFAULT_MODEL,
+            input=user_input,
+            instructions=instructions,
+            text=_json_schema_format(schema, name),
+        )  # Enforce schema output
+    data = json.loads(response.output_text)  # Parse structured JSON
+    if key:
+        get_cache().set(key, data)
+    return data
+
+
+# Reply to a chat turn, with what the next turn needs to chain onto it.
+@dataclass
+class ChatReply:
+    text: str
+    response_id: str  # Pass as previous_response_id to continue server-side
+    input_tokens: int  # Prompt size the provider saw, chained history included
+    output_tokens: int
+
+
+def _chat_reply(response) -> ChatReply:
+    usage = getattr(response, "usage", None)
+    return ChatReply(
+        text=response.output_text.strip(),
+        response_id=getattr(response, "id", "") or "",
+        input_tokens=getattr(usage, "input_tokens", 0) or 0,
+        output_tokens=getattr(usage, "output_tokens", 0) or 0,
+    )
+
+
+# --- Async Variants ---------------------------------------------------
+
+async def agenerate_text(
+    user_input: str, instructions: str, cache: bool = True, site: str = "text"
+) -> str:
+    key = _lookup_key(cache, user_input, instructions)
+    if key and (hit := await get_cache().aget(key)) is not None:
+        record_cache_hit(site, DEFAULT_MODEL)
+        return hit  # Served from cache
+    with observe_llm_call(site, DEFAULT_MODEL) as observed:
+        response = observed.response = await get_scheduler().acall(
+            get_backend().acreate,
+            model=DEFAULT_MODEL,
+            input=user_input,
+            instructions=instructions,
+        )  # Non-blocking Responses API call
+    text = response.output_text.strip()  # Normalize output for storage
+    if key:
+        await get_cache().aset(key, text)
+    return text
+
+
+async def agenerate_structured(
+    user_input: str,
+    instructions: str,
+    schema: dict[str, object],
+    name: str,
+    cache: bool = True,
+    site: str = "",
+) -> dict[str, object]:
+    key = _lookup_key(cache, user_input, instructions, schema, name)
+    if key and (hit := await get_cache().aget(key)) is not None:
+        record_cache_hit(site or name, DEFAULT_MODEL)
+        return hit  # Served from cache
+    with observe_llm_call(site or name, DEFAULT_MODEL) as observed:
+        response = observed.response = await get_scheduler().acall(
+            get_backend().acreate,
+            model=DEFAULT_MODEL,
+            input=user_input,
+            instructions=instructions,
+            text=_json_schema_format(schema, name),
+        )  # Enforce schema output
+    data = json.loads(response.output_text)  # Parse structured JSON
+    if key:
+        await get_cache().aset(key, data)
+    return data
+
+
+# Generate a chat reply from role messages (never cached).
+# With previous_response_id the provider supplies the earlier turns itself.
+async def agenerate_chat(
+    messages: list[dict[str, str]],
+    instructions: str,
+    previous_response_id: str | None = None,
+    site: str = "chat",
+) -> ChatReply:
+    params = {"model": DEFAULT_MODEL, "input": messages, "instructions": instructions}
+    if previous_response_id:
+        params["previous_response_id"] = previous_response_id
+    with observe_llm_call(site, DEFAULT_MODEL) as observed:
+        response = observed.response = await get_scheduler().acall(
+            get_backend().acreate, **params
+        )
+    return _chat_reply(response)
+
+
+# Yield text deltas as the model produces them (streamed responses are never cached).
+# Metrics cover latency and errors only; deltas carry no token usage.
+# user_input may also be a list of role messages (chat sessions).
+async def astream_text(user_input: str | list, instructions: str, site: str = "stream"):
+    with observe_llm_call(site, DEFAULT_MODEL):
+        async for delta in get_scheduler().astream(
+            get_backend().astream,
+            model=DEFAULT_MODEL,
+            input=user_input,
+            instructions=instructions,
+        ):
+            yield delta
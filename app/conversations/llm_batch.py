@@ -0,0 +1,269 @@
+import json
+import os
+import shutil
+import time
+import uuid
+from dataclasses import dataclass
+from decimal import Decimal
+from pathlib import Path
+from types import SimpleNamespace
+
+from django.conf import settings
+
+from .llm import LLM_BACKEND, get_client
+
+BATCH_ENDPOINT = "/v1/responses"  # Every batch request is a Responses API call
+BATCH_COMPLETION_WINDOW = "24h"  # Only window the provider offers
+BATCH_PRICE_FACTOR = Decimal("0.5")  # Batch requests are billed at half the list price
+BATCH_MAX_REQUESTS = int(os.environ.get("LLM_BATCH_MAX_REQUESTS", "50000"))  # Per input file
+BATCH_POLL_INTERVAL = float(os.environ.get("LLM_BATCH_POLL_INTERVAL", "30"))  # Seconds
+BATCH_DIR = os.environ.get("LLM_BATCH_DIR", "")  # Request/result files; default BASE_DIR
+BATCH_BACKEND = os.environ.get("LLM_BATCH_BACKEND", "").strip().lower()  # openai or local
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}  # No further progress
+
+
+# Outcome of one request line; body is the Responses API object as JSON.
+@dataclass
+class BatchResult:
+    body: dict[str, object] | None = None
+    error: str = ""
+
+    @property
+    def ok(self) -> bool:
+        return self.body is not None and not self.error
+
+    # The SDK's output_text, rebuilt from the raw response JSON.
+    @property
+    def text(self) -> str:
+        return "".join(
+            part.get("text", "")
+            for item in (self.body or {}).get("output", [])
+            if item.get("type") == "message"
+            for part in item.get("content", [])
+            if part.get("type") == "output_text"
+        )
+
+    # Attribute view of the usage, shaped like an SDK response for the metrics.
+    @property
+    def response(self) -> SimpleNamespace:
+        usage = (self.body or {}).get("usage") or {}
+        details = usage.get("input_tokens_details") or {}
+        return SimpleNamespace(
+            usage=SimpleNamespace(
+                input_tokens=usage.get("input_tokens", 0),
+                output_tokens=usage.get("output_tokens", 0),
+                input_tokens_details=SimpleNamespace(
+                    cached_tokens=details.get("cached_tokens", 0)
+                ),
+            )
+        )
+
+
+def _batch_dir() -> Path:
+    return Path(BATCH_DIR) if BATCH_DIR else settings.BASE_DIR / ".llm_batches"
+
+
+# Parse one line of a batch output or error file into (custom_id, result).
+def parse_result_line(line: dict[str, object]) -> tuple[str, BatchResult]:
+    response = line.get("response") or {}
+    body = response.get("body") or {}
+    error = line.get("error")
+    if error:
+        message = error.get("message") if isinstance(error, dict) else error
+        return line["custom_id"], BatchResult(error=str(message))
+    if response.get("status_code") != 200:
+        message = (body.get("error") or {}).get("message") or f"HTTP {response.get('status_code')}"
+        return line["custom_id"], BatchResult(error=message)
+    return line["custom_id"], BatchResult(body=body)
+
+
+# --- Backends ---------------------------------------------------------
+
+# Provider batch interface: upload a JSONL file, create a batch, poll it, read the output.
+class OpenAIBatchBackend:
+    name = "openai"
+
+    def submit(self, path: Path) -> str:
+        client = get_client()
+        with open(path, "rb") as handle:
+            uploaded = client.files.create(file=handle, purpose="batch")
+        batch = client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=BATCH_COMPLETION_WINDOW,
+        )
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        return get_client().batches.retrieve(batch_id).status
+
+    def results(self, batch_id: str):
+        client = get_client()
+        batch = client.batches.retrieve(batch_id)
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in client.files.content(file_id).text.splitlines():
+                if line.strip():
+                    yield json.loads(line)
+
+
+# File-based stand-in for the batch service, for offline runs and tests.
+# A batch is a directory holding input.jsonl; it is answered by a sync backend (the fake
+# one without latency by default) on its first poll and written to output.jsonl in the
+# provider's format.
+class LocalBatchBackend:
+    name = "local"
+
+    def __init__(self, directory: Path | None = None, backend=None):
+        self.directory = Path(directory) if directory else _batch_dir() / "local"
+        if backend is None:
+            from .llm_fake import FakeBackend
+
+            backend = FakeBackend(latency_ms=0, jitter_ms=0)
+        self.backend = backend
+
+    def submit(self, path: Path) -> str:
+        batch_id = f"batch_local_{uuid.uuid4().hex}"
+        folder = self.directory / batch_id
+        folder.mkdir(parents=True)
+        shutil.copyfile(path, folder / "input.jsonl")
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        folder = self.directory / batch_id
+        if not (folder / "output.jsonl").exists():
+            self._process(folder)
+        return "completed"
+
+    def _process(self, folder: Path) -> None:
+        partial = folder / "output.jsonl.tmp"
+        with open(folder / "input.jsonl") as source, open(partial, "w") as target:
+            for number, raw in enumerate(source, 1):
+                request = json.loads(raw)
+                try:
+                    response = self.backend.create(**request["body"])
+                    result = {
+                        "status_code": 200,
+                        "body": _response_body(response),
+                    }
+                except Exception as exc:
+                    result = {
+                        "status_code": getattr(exc, "status_code", 500),
+                        "body": {"error": {"message": str(exc)}},
+                    }
+                line = {
+                    "id": f"batch_req_{number}",
+                    "custom_id": request["custom_id"],
+                    "response": result,
+                    "error": None,
+                }
+                target.write(json.dumps(line) + "\n")
+        partial.rename(folder / "output.jsonl")  # Complete or absent, never half written
+
+    def results(self, batch_id: str):
+        with open(self.directory / batch_id / "output.jsonl") as handle:
+            for line in handle:
+                if line.strip():
+                    yield json.loads(line)
+
+
+# Responses API JSON for a backend response object (output_text and usage only).
+def _response_body(response) -> dict[str, object]:
+    usage = getattr(response, "usage", None)
+    details = getattr(usage, "input_tokens_details", None)
+    return {
+        "id": getattr(response, "id", ""),
+        "object": "response",
+        "status": "completed",
+        "output": [
+            {
+                "type": "message",
+                "role": "assistant",
+                "content": [{"type": "output_text", "text": response.output_text}],
+            }
+        ],
+        "usage": {
+            "input_tokens": getattr(usage, "input_tokens", 0),
+            "output_tokens": getattr(usage, "output_tokens", 0),
+            "input_tokens_details": {"cached_tokens": getattr(details, "cached_tokens", 0)},
+        },
+    }
+
+
+# Batch backend from LLM_BATCH_BACKEND; the local stand-in when the fake LLM is active.
+def get_batch_backend():
+    backend = BATCH_BACKEND or ("local" if LLM_BACKEND == "fake" else "openai")
+    if backend == "local":
+        return LocalBatchBackend()
+    if backend == "openai":
+        return OpenAIBatchBackend()
+    raise ValueError(f"Unknown LLM_BATCH_BACKEND: {backend}")
+
+
+# --- Runner -----------------------------------------------------------
+
+# Write the requests to JSONL files and submit one batch per file; returns {batch_id: size}.
+# File names carry a random part, so runs or shards with the same name never share a file.
+def _submit(requests: dict[str, dict[str, object]], name: str, backend) -> dict[str, int]:
+    folder = _batch_dir() / "requests"
+    folder.mkdir(parents=True, exist_ok=True)
+    custom_ids = list(requests)
+    token = uuid.uuid4().hex[:12]
+    pending = {}
+    for start in range(0, len(custom_ids), BATCH_MAX_REQUESTS):
+        path = folder / f"{name}-{token}-{start // BATCH_MAX_REQUESTS + 1}.jsonl"
+        with open(path, "w") as handle:
+            for custom_id in custom_ids[start:start + BATCH_MAX_REQUESTS]:
+                line = {
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": BATCH_ENDPOINT,
+                    "body": requests[custom_id],
+                }
+                handle.write(json.dumps(line) + "\n")
+        pending[backend.submit(path)] = min(BATCH_MAX_REQUESTS, len(custom_ids) - start)
+    return pending
+
+
+# Submit requests ({custom_id: Responses API params}) as batches of at most
+# BATCH_MAX_REQUESTS, wait for all of them and return {custom_id: BatchResult}.
+# Requests missing from the output (failed or expired batches) come back as errors.
+# on_status(batch_id, status, size) is called on every poll, on_submit({batch_id: size})
+# once everything is submitted. Passing that mapping back as `submitted` resumes polling
+# those batches instead of submitting the requests again (after a restart).
+def run_batch(
+    requests: dict[str, dict[str, object]],
+    name: str,
+    backend=None,
+    poll_interval: float = BATCH_POLL_INTERVAL,
+    on_status=None,
+    submitted: dict[str, int] | None = None,
+    on_submit=None,
+) -> dict[str, BatchResult]:
+    backend = backend or get_batch_backend()
+    custom_ids = list(requests)
+    if submitted:
+        pending = dict(submitted)  # batch_id -> request count
+    else:
+        pending = _submit(requests, name, backend)
+        if on_submit is not None:
+            on_submit(dict(pending))
+
+    results = {}
+    while pending:
+        for batch_id, size in list(pending.items()):
+            status = backend.status(batch_id)
+            if on_status is not None:
+                on_status(batch_id, status, size)
+            if status in TERMINAL_STATUSES:
+                del pending[batch_id]
+                for line in backend.results(batch_id):
+                    custom_id, result = parse_result_line(line)
+                    if custom_id in requests:  # Resumed batches may answer more
+                        results[custom_id] = result
+        if pending:
+            time.sleep(poll_interval)
+    for custom_id in custom_ids:
+        results.setdefault(custom_id, BatchResult(error="No result in the batch output"))
+    return results
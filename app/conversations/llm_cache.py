@@ -0,0 +1,231 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from .models import LLMCacheEntry
+
+CACHE_BACKEND = os.environ.get("LLM_CACHE_BACKEND", "").strip().lower()  # "", memory, db, file
+CACHE_TTL = int(os.environ.get("LLM_CACHE_TTL", "86400"))  # Seconds a response stays valid
+CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "10000"))  # Eviction bound
+CACHE_DIR = os.environ.get("LLM_CACHE_DIR", "")  # File backend location
+PRUNE_EVERY = 100  # Writes between size checks for persistent stores
+
+
+# Content address of a request: same model, prompt and schema give the same key.
+def cache_key(
+    model: str,
+    instructions: str,
+    user_input: str,
+    schema: dict[str, object] | None = None,
+    name: str = "",
+) -> str:
+    payload = json.dumps(
+        {
+            "model": model,
+            "instructions": instructions,
+            "input": user_input,
+            "schema": schema,
+            "name": name,
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# --- Backends ---------------------------------------------------------
+
+# Shared hit/miss bookkeeping; subclasses implement _load/_store.
+class BaseCache:
+    def __init__(self, ttl: int = CACHE_TTL, max_entries: int = CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._stats_lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "sets": 0, "evictions": 0}
+        self._writes = 0
+
+    def _bump(self, key: str, amount: int = 1) -> None:
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    # Count a write; True on every PRUNE_EVERY-th one, even with writers on several threads.
+    def _prune_due(self) -> bool:
+        with self._stats_lock:
+            self._writes += 1
+            return self._writes % PRUNE_EVERY == 0
+
+    def get(self, key: str):
+        value = self._load(key)
+        self._bump("misses" if value is None else "hits")
+        return value
+
+    def set(self, key: str, value) -> None:
+        self._store(key, value, time.time() + self.ttl)
+        self._bump("sets")
+
+    async def aget(self, key: str):
+        return self.get(key)
+
+    async def aset(self, key: str, value) -> None:
+        self.set(key, value)
+
+    def stats(self) -> dict[str, object]:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def _load(self, key: str):
+        raise NotImplementedError
+
+    def _store(self, key: str, value, expires_at: float) -> None:
+        raise NotImplementedError
+
+
+# Per-process LRU dictionary.
+class MemoryCache(BaseCache):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def _load(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._entries[key]  # Expired
+                return None
+            self._entries.move_to_end(key)  # Mark as recently used
+            return entry[1]
+
+    def _store(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)  # Drop least recently used
+                self._bump("evictions")
+
+
+# JSON files on disk, shared by every process on the host.
+class FileCache(BaseCache):
+    def __init__(self, directory: str | Path, **kwargs):
+        super().__init__(**kwargs)
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"  # Shard to keep dirs small
+
+    def _load(self, key):
+        path = self._path(key)
+        try:
+            entry = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None  # Missing or half-written
+        if entry["expires_at"] < time.time():
+            path.unlink(missing_ok=True)
+            return None
+        os.utime(path)  # mtime doubles as last-used time for eviction
+        return entry["value"]
+
+    def _store(self, key, value, expires_at):
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            "w", dir=path.parent, delete=False, encoding="utf-8"
+        ) as handle:
+            json.dump({"expires_at": expires_at, "value": value}, handle)
+        os.replace(handle.name, path)  # Atomic publish
+        if self._prune_due():
+            self.prune()
+
+    # Remove expired files, then the least recently used beyond max_entries.
+    def prune(self) -> None:
+        now = time.time()
+        files = []
+        for path in self.directory.glob("*/*.json"):
+            try:
+                files.append((path.stat().st_mtime, path))
+            except OSError:
+                continue
+        files.sort()
+        excess = len(files) - self.max_entries
+        for mtime, path in files:
+            if excess <= 0 and mtime + self.ttl >= now:
+                break
+            path.unlink(missing_ok=True)
+            excess -= 1
+            self._bump("evictions")
+
+
+# Rows in LLMCacheEntry, shared by every process using the database.
+class DatabaseCache(BaseCache):
+    def _load(self, key):
+        entry = (
+            LLMCacheEntry.objects.filter(key=key, expires_at__gt=timezone.now())
+            .only("value")
+            .first()
+        )
+        return entry.value if entry else None
+
+    def _store(self, key, value, expires_at):
+        LLMCacheEntry.objects.update_or_create(
+            key=key,
+            defaults={
+                "value": value,
+                "expires_at": datetime.fromtimestamp(expires_at, tz=dt_timezone.utc),
+            },
+        )
+        if self._prune_due():
+            self.prune()
+
+    # Remove expired rows, then the oldest beyond max_entries.
+    def prune(self) -> None:
+        deleted, _ = LLMCacheEntry.objects.filter(expires_at__lte=timezone.now()).delete()
+        overflow = list(
+            LLMCacheEntry.objects.order_by("-expires_at").values_list(
+                "expires_at", flat=True
+            )[self.max_entries:self.max_entries + 1]
+        )  # Expiry of the first entry past the size bound
+        if overflow:
+            extra, _ = LLMCacheEntry.objects.filter(expires_at__lte=overflow[0]).delete()
+            deleted += extra
+        self._bump("evictions", deleted)
+
+    async def aget(self, key):
+        return await sync_to_async(self.get)(key)  # ORM is sync-only
+
+    async def aset(self, key, value):
+        await sync_to_async(self.set)(key, value)
+
+
+# --- Configured Backend -----------------------------------------------
+
+# Build the backend selected by LLM_CACHE_BACKEND; None disables caching.
+def build_cache(backend: str = CACHE_BACKEND) -> BaseCache | None:
+    if not backend or backend == "none":
+        return None
+    if backend == "memory":
+        return MemoryCache()
+    if backend == "db":
+        return DatabaseCache()
+    if backend == "file":
+        directory = CACHE_DIR
+        if not directory:
+            directory = settings.BASE_DIR / ".llm_cache"
+        return FileCache(directory)
+    raise ValueError(f"Unknown LLM_CACHE_BACKEND: {backend}")
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+
+from .diet_rules import classify_diet_rules
+
+FAKE_LATENCY_MS = float(os.environ.get("LLM_FAKE_LATENCY_MS", "50"))  # Mean response time
+FAKE_JITTER_MS = float(os.environ.get("LLM_FAKE_JITTER_MS", "20"))  # +/- uniform spread
+FAKE_ERROR_RATE = float(os.environ.get("LLM_FAKE_ERROR_RATE", "0"))  # Share of failed calls
+FAKE_SEED = int(os.environ.get("LLM_FAKE_SEED", "0"))  # Makes runs reproducible
+
+FOODS = {
+    "vegan": ["lentil curry", "falafel", "tofu stir fry", "mushroom risotto", "hummus", "ratatouille", "pad thai with tofu", "bean chili"],
+    "vegetarian": ["margherita pizza", "cheese omelette", "paneer tikka", "spinach lasagna", "greek yogurt", "mac and cheese", "egg fried rice", "caprese salad"],
+    "omnivore": ["beef burger", "chicken curry", "salmon sushi", "pork ramen", "steak frites", "fish tacos", "lamb kebab", "bacon carbonara"],
+}  # Diet-consistent vocabulary for structured outputs
+
+LINES = [
+    "Sounds great, thank you!",
+    "It has been a long but good day.",
+    "I'd love to try that.",
+    "Could I get that, please?",
+    "Welcome! How has your day been?",
+    "What would you like to order today?",
+]  # Canned free-text replies
+
+DIET_RE = re.compile(r"diet is (omnivore|vegetarian|vegan)")  # Diet named in simulator prompts
+FOOD_LIST_RE = re.compile(r"\[([^\]]*)\]")  # Food lists quoted in classifier prompts
+
+
+# Raised for injected failures; status_code mirrors a transient provider error.
+class FakeLLMError(RuntimeError):
+    status_code = 503
+
+
+# Deterministic stand-in for the OpenAI Responses API.
+# Latency, jitter and error rate are configurable; structured outputs follow the schema.
+class FakeBackend:
+    name = "fake"
+
+    def __init__(
+        self,
+        latency_ms: float = FAKE_LATENCY_MS,
+        jitter_ms: float = FAKE_JITTER_MS,
+        error_rate: float = FAKE_ERROR_RATE,
+        seed: int = FAKE_SEED,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    # Draw the delay and failure decision, plus a per-call RNG, under one lock.
+    def _plan(self) -> tuple[float, bool, random.Random]:
+        with self._lock:
+            jitter = self._rng.uniform(-self.jitter_ms, self.jitter_ms)
+            fail = self._rng.random() < self.error_rate
+            rng = random.Random(self._rng.getrandbits(64))
+        return max(self.latency_ms + jitter, 0.0) / 1000, fail, rng
+
+    def _respond(self, rng: random.Random, params: dict[str, object]):
+        user_input = str(params.get("input", ""))
+        text_format = (params.get("text") or {}).get("format") or {}
+        if text_format.get("type") == "json_schema":
+            output = json.dumps(_fake_value(text_format["schema"], "", user_input, rng))
+        else:
+            output = rng.choice(LINES)
+        prompt = str(params.get("instructions", "")) + user_input
+        return SimpleNamespace(
+            id=f"resp_fake_{uuid.UUID(int=rng.getrandbits(128)).hex}",
+            output_text=output,
+            usage=SimpleNamespace(
+                input_tokens=len(prompt) // 4 + 1,
+                output_tokens=len(output) // 4 + 1,
+                input_tokens_details=SimpleNamespace(cached_tokens=0),
+            ),
+        )  # Same attributes the simulator reads from real responses
+
+    def create(self, **params):
+        delay, fail, rng = self._plan()
+        time.sleep(delay)
+        if fail:
+            raise FakeLLMError("Injected fake LLM failure")
+        return self._respond(rng, params)
+
+    async def acreate(self, **params):
+        delay, fail, rng = self._plan()
+        await asyncio.sleep(delay)
+        if fail:
+            raise FakeLLMError("Injected fake LLM failure")
+        return self._respond(rng, params)
+
+    async def astream(self, **params):
+        response = await self.acreate(**params)
+        for word in response.output_text.split(" "):
+            await asyncio.sleep(self.latency_ms / 10000)  # Spread tokens out a little
+            yield word + " "
+
+
+# Build a value matching a JSON schema, using prompt hints for diets, foods and ids.
+def _fake_value(schema: dict[str, object], field: str, user_input: str, rng: random.Random):
+    kind = schema.get("type")
+    if kind == "object":
+        properties = schema.get("properties", {})
+        return {
+            key: _fake_value(sub_schema, key, user_input, rng)
+            for key, sub_schema in properties.items()
+        }
+    if kind == "array":
+        item_schema = schema.get("items", {})
+        if "id" in item_schema.get("properties", {}):
+            return _fake_batch_items(item_schema, user_input, rng)  # Echo ids from the prompt
+        low = schema.get("minItems", 1)
+        high = schema.get("maxItems", max(low, 3))
+        diet = _prompt_diet(user_input, rng)
+        if field in {"favorite_foods", "ordered_dishes"}:
+            return rng.sample(FOODS[diet], rng.randint(low, high))
+        return [_fake_value(item_schema, field, user_input, rng) for _ in range(rng.randint(low, high))]
+    if "enum" in schema:
+        if field == "diet":
+            return _prompt_diet(user_input, rng)
+        return rng.choice(schema["enum"])
+    if kind == "string":
+        return rng.choice(LINES)
+    if kind in {"integer", "number"}:
+        return rng.randint(0, 100)
+    if kind == "boolean":
+        return rng.random() < 0.5
+    return None
+
+
+# Diet requested by the prompt, else inferred from its food lists, else random.
+def _prompt_diet(user_input: str, rng: random.Random) -> str:
+    match = DIET_RE.search(user_input)
+    if match:
+        return match.group(1)
+    foods = [foods.replace("'", " ") for foods in FOOD_LIST_RE.findall(user_input)]  # Unquote
+    return classify_diet_rules(foods, None) or rng.choice(list(FOODS))
+
+
+# One result per JSON line carrying an "id" in the prompt (batch classification).
+def _fake_batch_items(item_schema, user_input, rng):
+    items = []
+    for line in user_input.splitlines():
+        try:
+            payload = json.loads(line)
+        except ValueError:
+            continue
+        if not isinstance(payload, dict) or "id" not in payload:
+            continue
+        item = _fake_value(item_schema, "", json.dumps(payload), rng)
+        item["id"] = payload["id"]
+        if "diet" in item:
+            foods = (payload.get("favorite_foods") or []) + (payload.get("ordered_dishes") or [])
+            item["diet"] = classify_diet_rules(foods, None) or item["diet"]
+        items.append(item)
+    return items
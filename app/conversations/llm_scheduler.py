@@ -0,0 +1,284 @@
+import asyncio
+import email.utils
+import os
+import random
+import threading
+import time
+
+import httpx
+from openai import APIConnectionError
+
+MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "5"))  # Retries after the first attempt
+BACKOFF_BASE = float(os.environ.get("LLM_BACKOFF_BASE", "0.5"))  # First backoff ceiling, seconds
+BACKOFF_MAX = float(os.environ.get("LLM_BACKOFF_MAX", "30"))  # Largest backoff ceiling, seconds
+REQUESTS_PER_MINUTE = float(os.environ.get("LLM_RPM", "0"))  # 0 disables the request limit
+TOKENS_PER_MINUTE = float(os.environ.get("LLM_TPM", "0"))  # 0 disables the token limit
+BREAKER_THRESHOLD = int(os.environ.get("LLM_BREAKER_THRESHOLD", "5"))  # Consecutive failures; 0 disables
+BREAKER_COOLDOWN = float(os.environ.get("LLM_BREAKER_COOLDOWN", "30"))  # Seconds before a probe call
+
+OUTPUT_TOKEN_ESTIMATE = 200  # Reserved per call until the real usage is known
+RETRYABLE_STATUS = {408, 409, 429}  # Plus every 5xx
+
+
+# Raised instead of calling the provider while the breaker is open.
+class CircuitOpenError(RuntimeError):
+    def __init__(self, retry_after: float):
+        super().__init__(f"LLM circuit open, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+# Rate limiter shared by threads and event loops.
+# reserve() takes capacity immediately and returns how long to wait before using it,
+# so concurrent callers queue up in order instead of racing for the next refill.
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60  # Refill per second
+        self.capacity = per_minute  # Allows a full minute of burst, like provider quotas
+        self._level = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+            self._updated = now
+            self._level -= amount  # May go negative; later callers wait longer
+            return max(0.0, -self._level / self.rate)
+
+    # Give back (or, when negative, charge) capacity once the real cost is known.
+    def refund(self, amount: float) -> None:
+        with self._lock:
+            self._level = min(self.capacity, self._level + amount)
+
+
+# Stop calling a failing provider for a cooldown, then let one probe call through.
+class CircuitBreaker:
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.trips = 0
+        self._failures = 0  # Consecutive retryable failures
+        self._opened_at = None
+        self._probe_started = None  # Set while the half-open probe is in flight
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half-open" if self._probe_started is not None else "open"
+
+    # Raise CircuitOpenError unless this call may go to the provider.
+    def before_call(self) -> None:
+        if self.threshold <= 0:
+            return
+        with self._lock:
+            if self._opened_at is None:
+                return  # Closed
+            now = time.monotonic()
+            remaining = self._opened_at + self.cooldown - now
+            if remaining > 0:
+                raise CircuitOpenError(remaining)
+            if self._probe_started is not None and now - self._probe_started < self.cooldown:
+                raise CircuitOpenError(min(self.cooldown, BACKOFF_BASE * 2))  # Probe in flight
+            self._probe_started = now  # This caller is the probe
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probe_started = None
+
+    def record_failure(self) -> None:
+        if self.threshold <= 0:
+            return
+        with self._lock:
+            self._failures += 1
+            probe_failed = self._probe_started is not None
+            if probe_failed or (self._opened_at is None and self._failures >= self.threshold):
+                if not probe_failed:
+                    self.trips += 1
+                self._opened_at = time.monotonic()  # (Re)start the cooldown
+                self._probe_started = None
+
+
+# Transient failures worth retrying: timeouts, dropped connections, 429 and 5xx.
+def is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, (CircuitOpenError, APIConnectionError, httpx.TransportError, TimeoutError)):
+        return True
+    status = getattr(exc, "status_code", None)
+    return isinstance(status, int) and (status in RETRYABLE_STATUS or status >= 500)
+
+
+# Seconds the provider asked us to wait (Retry-After / retry-after-ms), if any.
+def retry_after(exc: Exception) -> float | None:
+    if isinstance(exc, CircuitOpenError):
+        return exc.retry_after
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(float(value) / 1000, 0.0)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None  # Unparseable header
+
+
+# Full-jitter exponential backoff, or the server's hint plus a little jitter.
+def backoff_delay(attempt: int, hint: float | None = None) -> float:
+    if hint is not None:
+        return hint + random.uniform(0, BACKOFF_BASE)
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+# Rough token cost of a Responses API call (about 4 characters per token).
+def estimate_tokens(params: dict[str, object]) -> int:
+    text = str(params.get("instructions") or "") + str(params.get("input") or "")
+    return len(text) // 4 + OUTPUT_TOKEN_ESTIMATE
+
+
+# Paces, retries and circuit-breaks backend calls; one instance per process.
+class Scheduler:
+    def __init__(
+        self,
+        max_retries: int = MAX_RETRIES,
+        requests_per_minute: float = REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = TOKENS_PER_MINUTE,
+        breaker_threshold: int = BREAKER_THRESHOLD,
+        breaker_cooldown: float = BREAKER_COOLDOWN,
+    ):
+        self.max_retries = max_retries
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_cooldown)
+        self._lock = threading.Lock()
+        self._counters = {"retries": 0, "gave_up": 0, "throttled": 0, "throttled_seconds": 0.0}
+
+    def _count(self, key: str, amount=1) -> None:
+        with self._lock:
+            self._counters[key] += amount
+
+    # Check the breaker and reserve rate limit capacity; returns (wait seconds, tokens reserved).
+    def _admit(self, params: dict[str, object]) -> tuple[float, int]:
+        self.breaker.before_call()
+        estimate = estimate_tokens(params)
+        wait = 0.0
+        if self.requests:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens:
+            wait = max(wait, self.tokens.reserve(estimate))
+        if wait:
+            self._count("throttled")
+            self._count("throttled_seconds", wait)
+        return wait, estimate
+
+    # Close the breaker and correct the token reservation with the reported usage.
+    def _succeeded(self, response, estimate: int) -> None:
+        self.breaker.record_success()
+        usage = getattr(response, "usage", None)
+        if self.tokens is None or usage is None:
+            return
+        actual = (getattr(usage, "input_tokens", 0) or 0) + (getattr(usage, "output_tokens", 0) or 0)
+        self.tokens.refund(estimate - actual)
+
+    # Record a failed attempt and give back its token reservation;
+    # returns the delay before the next one, or None to give up.
+    def _failed(self, exc: Exception, attempt: int, estimate: int = 0) -> float | None:
+        if self.tokens and estimate:
+            self.tokens.refund(estimate)  # The retry reserves again
+        retryable = is_retryable(exc)
+        if not isinstance(exc, CircuitOpenError):
+            if retryable:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()  # The provider answered; the request was bad
+        if not retryable:
+            return None
+        if attempt >= self.max_retries:
+            self._count("gave_up")
+            return None
+        self._count("retries")
+        return backoff_delay(attempt, retry_after(exc))
+
+    # Call create(**params) with pacing and retries (blocking).
+    def call(self, create, **params):
+        attempt = 0
+        while True:
+            estimate = 0
+            try:
+                wait, estimate = self._admit(params)
+                if wait:
+                    time.sleep(wait)
+                response = create(**params)
+            except Exception as exc:
+                delay = self._failed(exc, attempt, estimate)
+                if delay is None:
+                    raise
+                attempt += 1
+                time.sleep(delay)
+                continue
+            self._succeeded(response, estimate)
+            return response
+
+    # Await acreate(**params) with pacing and retries.
+    async def acall(self, acreate, **params):
+        attempt = 0
+        while True:
+            estimate = 0
+            try:
+                wait, estimate = self._admit(params)
+                if wait:
+                    await asyncio.sleep(wait)
+                response = await acreate(**params)
+            except Exception as exc:
+                delay = self._failed(exc, attempt, estimate)
+                if delay is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            self._succeeded(response, estimate)
+            return response
+
+    # Relay astream(**params) deltas; failures are retried only until the first delta is sent.
+    async def astream(self, astream, **params):
+        attempt = 0
+        while True:
+            started = False
+            estimate = 0
+            try:
+                wait, estimate = self._admit(params)
+                if wait:
+                    await asyncio.sleep(wait)
+                async for delta in astream(**params):
+                    started = True
+                    yield delta
+            except Exception as exc:
+                if started:
+                    delay = self._failed(exc, self.max_retries)  # Text already sent and paid for
+                else:
+                    delay = self._failed(exc, attempt, estimate)
+                if delay is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return
+
+    def stats(self) -> dict[str, object]:
+        with self._lock:
+            counters = dict(self._counters)
+        return {**counters, "breaker_trips": self.breaker.trips, "breaker_state": self.breaker.state}
@@ -0,0 +1,74 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from conversations.aggregates import rebuild_stats
+from conversations.constants import ARCHIVE_KEEP_MONTHS
+from conversations.models import Conversation, Message
+from conversations.partitions import (
+    add_months,
+    archive_dir,
+    archive_month,
+    ensure_partitions,
+    list_partitions,
+    month_start,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Create upcoming monthly partitions, then dump conversations older than the retention "
+        "window to gzipped CSV files and detach their partitions"
+    )  # CLI description
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--keep-months",
+            type=int,
+            default=ARCHIVE_KEEP_MONTHS,
+            help="Full months kept online besides the current one.",
+        )  # Retention window
+        parser.add_argument(
+            "--dir",
+            help="Directory for the dumps (default ARCHIVE_DIR or app/archive).",
+        )  # One YYYY-MM folder per archived month
+        parser.add_argument(
+            "--keep-tables",
+            action="store_true",
+            help="Detach archived partitions but keep them as standalone tables.",
+        )  # Drop them later by hand
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only list the months that would be archived.",
+        )
+
+    def handle(self, *args, **options):
+        if options["keep_months"] < 0:
+            raise CommandError("--keep-months must not be negative")
+        if not options["dry_run"]:
+            for name in ensure_partitions():
+                self.stdout.write(f"Created partition {name}")
+        cutoff = add_months(month_start(timezone.now()), -options["keep_months"])
+        months = [month for month in list_partitions(Conversation._meta.db_table) if month < cutoff]
+        if not months:
+            self.stdout.write(f"Nothing to archive before {cutoff:%Y-%m}")
+            return
+        directory = Path(options["dir"]) if options["dir"] else archive_dir()
+        if options["dry_run"]:
+            for month in months:
+                self.stdout.write(f"Would archive {month:%Y-%m} to {directory / f'{month:%Y-%m}'}")
+            return
+
+        for month in months:
+            started = time.perf_counter()
+            rows = archive_month(month, directory, drop=not options["keep_tables"])
+            self.stdout.write(
+                f"Archived {month:%Y-%m}: {rows[Conversation._meta.db_table]} conversations, "
+                f"{rows[Message._meta.db_table]} messages to {directory / f'{month:%Y-%m}'} "
+                f"in {time.perf_counter() - started:.1f}s"
+            )  # Per-month summary
+        conversations, foods = rebuild_stats()  # Aggregates only count rows still online
+        self.stdout.write(f"Rebuilt stats from {conversations} conversations ({foods} diet/food pairs)")
@@ -0,0 +1,217 @@
+import random
+import statistics
+import time
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+
+from conversations import views
+from conversations.aggregates import rebuild_stats
+from conversations.llm import scheduler_stats, set_backend
+from conversations.llm_fake import FOODS, FakeBackend
+from conversations.models import Conversation
+from conversations.persistence import PendingConversation, write_batch
+from conversations.simulation import SimulatedConversation, run_simulations
+
+BENCH_PREFIX = "bench"  # customer_label prefix of every row this command writes
+SEED_BATCH_SIZE = 1000  # Synthetic conversations per write_batch call
+
+ENDPOINTS = [
+    ("dashboard", views.dashboard, {}),
+    ("latest json (500)", views.simulations_latest, {"limit": "500"}),
+    ("latest csv (stream all)", views.simulations_latest, {"format": "csv", "stream": "1"}),
+    ("vegetarians page", views.vegetarian_summary, {}),
+    ("conversations by food", views.food_conversations, {"food": "falafel"}),
+    ("ordered dishes top 10", views.food_summary, {"kind": "ordered"}),
+    ("search transcripts (rare word)", views.search, {"q": "gluten"}),
+    ("search transcripts (food)", views.search, {"q": "falafel", "role": "customer"}),
+    ("search foods (misspelled)", views.search, {"q": "falafle", "scope": "favorite"}),
+]  # (label, view, query) timed at every table size
+DAY_LINES = ["It has been a long but good day."] * 99 + [
+    "Good, thanks. I have to avoid gluten these days."
+]  # Customer small talk; about 1% of rows mention the rare search word
+
+
+# Synthetic conversation shaped like simulator output, without any LLM calls.
+def _synthetic(rng: random.Random) -> SimulatedConversation:
+    diet = rng.choice(list(FOODS))
+    favorites = rng.sample(FOODS[diet], 3)
+    dishes = rng.sample(FOODS[diet], 2)
+    return SimulatedConversation(
+        diet=diet,
+        favorite_foods=favorites,
+        ordered_dishes=dishes,
+        transcript=[
+            ("waiter", "Welcome! How has your day been?"),
+            ("customer", rng.choice(DAY_LINES)),
+            ("waiter", "What are your favorite foods?"),
+            ("customer", ", ".join(favorites)),
+            ("waiter", "What would you like to order today?"),
+            ("customer", ", ".join(dishes)),
+        ],
+    )
+
+
+# Bytes of a streamed body, read chunk by chunk like the ASGI server does.
+def _streamed_size(response) -> int:
+    if not response.is_async:
+        return sum(len(chunk) for chunk in response.streaming_content)
+
+    async def drain():
+        size = 0
+        async for chunk in response.streaming_content:
+            size += len(chunk)
+        return size
+
+    return async_to_sync(drain)()
+
+
+# p50 / p95 / max of a list of seconds, in milliseconds.
+def _percentiles(samples: list[float]) -> str:
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return (
+        f"p50 {statistics.median(ordered) * 1000:.1f} ms, "
+        f"p95 {p95 * 1000:.1f} ms, max {ordered[-1] * 1000:.1f} ms"
+    )
+
+
+# --- Command ----------------------------------------------------------
+
+class Command(BaseCommand):
+    help = "Benchmark simulation throughput and dashboard/export latency offline"  # CLI description
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            default="1000,10000,100000",
+            help="Comma-separated benchmark row counts to time the endpoints at.",
+        )  # Table sizes
+        parser.add_argument(
+            "--simulate",
+            type=int,
+            default=200,
+            help="Conversations to run end to end through the simulator (0 skips).",
+        )  # Simulator sample
+        parser.add_argument("--concurrency", type=int, default=20)  # Simulator fan-out
+        parser.add_argument(
+            "--diet-mode",
+            choices=["self", "rules", "llm"],
+            default="self",
+        )  # Diet source
+        parser.add_argument("--latency-ms", type=float, default=50.0)  # Fake mean latency
+        parser.add_argument("--jitter-ms", type=float, default=20.0)  # Fake latency spread
+        parser.add_argument("--error-rate", type=float, default=0.0)  # Fake failure share
+        parser.add_argument("--repeat", type=int, default=5)  # Requests per endpoint and size
+        parser.add_argument(
+            "--live",
+            action="store_true",
+            help="Use the configured LLM backend instead of the offline fake.",
+        )  # Real API calls
+        parser.add_argument(
+            "--keep",
+            action="store_true",
+            help="Leave the benchmark rows in the database afterwards.",
+        )  # Skip cleanup
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted({int(size) for size in options["sizes"].split(",") if size.strip()})
+        except ValueError:
+            raise CommandError("--sizes must be comma-separated integers")
+        if not sizes or sizes[0] < 1:
+            raise CommandError("--sizes must be positive")
+        if options["repeat"] < 1:
+            raise CommandError("--repeat must be at least 1")
+        if options["concurrency"] < 1:
+            raise CommandError("--concurrency must be at least 1")
+
+        previous = None
+        if not options["live"]:
+            previous = set_backend(
+                FakeBackend(
+                    latency_ms=options["latency_ms"],
+                    jitter_ms=options["jitter_ms"],
+                    error_rate=options["error_rate"],
+                )
+            )  # Offline, repeatable timings
+        try:
+            if options["simulate"] > 0:
+                self._bench_simulation(options)
+            self._bench_endpoints(sizes, options["repeat"])
+        finally:
+            if previous is not None:
+                set_backend(previous)
+            if not options["keep"]:
+                deleted, _ = Conversation.objects.filter(
+                    customer_label__startswith=f"{BENCH_PREFIX}_"
+                ).delete()
+                rebuild_stats()  # Drop the benchmark rows from the aggregates
+                self.stdout.write(f"Cleanup: removed {deleted} benchmark rows")
+
+    # End-to-end simulator throughput, LLM calls included.
+    def _bench_simulation(self, options):
+        stats = run_simulations(
+            options["simulate"],
+            options["diet_mode"],
+            concurrency=options["concurrency"],
+            label_prefix=f"{BENCH_PREFIX}_sim",
+        )
+        self.stdout.write(
+            f"Simulation: {stats.completed} ok, {stats.failed} failed, {stats.resumed} resumed "
+            f"in {stats.elapsed:.1f}s ({stats.conversations_per_second:.2f} conversations/s, "
+            f"{stats.calls_per_second:.2f} calls/s, {stats.cache_hits} cache hits, "
+            f"concurrency {options['concurrency']})"
+        )
+        timings = ", ".join(f"{name} {ms:.0f} ms" for name, ms in stats.mean_timings_ms().items())
+        if timings:
+            self.stdout.write(f"Mean latency: {timings}")
+        scheduler = scheduler_stats()
+        self.stdout.write(
+            f"Scheduler: {scheduler['retries']} retries, {scheduler['gave_up']} gave up, "
+            f"{scheduler['breaker_trips']} breaker trips"
+        )
+
+    # Grow the table to each size and time the read endpoints against it.
+    def _bench_endpoints(self, sizes: list[int], repeat: int):
+        rng = random.Random(0)
+        factory = RequestFactory()
+        user = get_user_model()(username="benchmark", is_superuser=True, is_active=True)
+        seeded = Conversation.objects.filter(customer_label__startswith=f"{BENCH_PREFIX}_").count()
+        for size in sizes:
+            started = time.perf_counter()
+            written = 0
+            while seeded < size:
+                batch = [
+                    PendingConversation(seeded + i, f"{BENCH_PREFIX}_{seeded + i + 1}", _synthetic(rng))
+                    for i in range(min(SEED_BATCH_SIZE, size - seeded))
+                ]
+                write_batch(batch)
+                seeded += len(batch)
+                written += len(batch)
+            if written:
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f"Seeded {written} rows in {elapsed:.1f}s "
+                    f"({elapsed / written * 1000:.2f} ms per conversation)"
+                )  # Write cost, messages and aggregates included
+            total = Conversation.objects.count()
+            self.stdout.write(f"-- {size} benchmark rows ({total} total) --")
+            for label, view, query in ENDPOINTS:
+                samples = []
+                size_bytes = 0
+                for _ in range(repeat):
+                    request = factory.get("/", query)
+                    request.user = user
+                    started = time.perf_counter()
+                    response = view(request)
+                    if response.streaming:
+                        size_bytes = _streamed_size(response)
+                    else:
+                        size_bytes = len(response.content)
+                    samples.append(time.perf_counter() - started)
+                self.stdout.write(
+                    f"{label}: {_percentiles(samples)} ({size_bytes / 1024:.0f} KiB)"
+                )
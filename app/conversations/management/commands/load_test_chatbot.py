@@ -0,0 +1,133 @@
+import asyncio
+import os
+import time
+
+import httpx
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from conversations.management.commands.benchmark_simulator import _percentiles
+
+LOGIN_PATH = "/accounts/login/"  # Django auth login form
+CHATBOT_PATH = "/api/chatbot/"  # Endpoint under test
+MESSAGES = [
+    "Hi! What would you recommend today?",
+    "I really like spicy food.",
+    "Is there anything vegetarian on the menu?",
+    "Great, I'll have that. Thank you!",
+]  # Sent in turn by every simulated chat session
+
+
+# Log in through the login form; the client then carries the session and CSRF cookies.
+async def _login(client: httpx.AsyncClient, username: str, password: str) -> None:
+    await client.get(LOGIN_PATH)  # Sets the CSRF cookie
+    response = await client.post(
+        LOGIN_PATH,
+        data={
+            "username": username,
+            "password": password,
+            "csrfmiddlewaretoken": client.cookies.get(settings.CSRF_COOKIE_NAME, ""),
+        },
+        headers={"Referer": f"{client.base_url}{LOGIN_PATH}"},
+    )
+    if settings.SESSION_COOKIE_NAME not in client.cookies:
+        raise CommandError(f"Login as {username} failed (HTTP {response.status_code})")
+
+
+# One user chatting: `turns` messages in a new session, each sent after the previous reply.
+# Reply latencies are appended to `latencies`; returns the error, or None.
+async def _chat_session(
+    client: httpx.AsyncClient, turns: int, latencies: list[float]
+) -> str | None:
+    session = None
+    for turn in range(turns):
+        payload = {"message": MESSAGES[turn % len(MESSAGES)]}
+        if session:
+            payload["session"] = session
+        started = time.perf_counter()
+        try:
+            response = await client.post(
+                CHATBOT_PATH,
+                json=payload,
+                headers={
+                    "X-CSRFToken": client.cookies.get(settings.CSRF_COOKIE_NAME, ""),
+                    "Referer": f"{client.base_url}{CHATBOT_PATH}",
+                },
+            )
+        except httpx.HTTPError as exc:
+            return f"{type(exc).__name__}: {exc}"
+        if response.status_code != 200:
+            return f"HTTP {response.status_code}"
+        latencies.append(time.perf_counter() - started)
+        session = response.json()["session"]
+    return None
+
+
+# --- Command ----------------------------------------------------------
+
+class Command(BaseCommand):
+    help = "Load-test the chatbot endpoint of a running server with concurrent chat sessions"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--url",
+            default="http://localhost:8000",
+            help="Base URL of the server under test.",
+        )  # Target server
+        parser.add_argument(
+            "--levels",
+            default="1,10,50,100",
+            help="Comma-separated numbers of simultaneous chat sessions to try in turn.",
+        )  # Concurrency steps
+        parser.add_argument("--turns", type=int, default=3)  # Messages per chat session
+        parser.add_argument(
+            "--user",
+            default=os.environ.get("API_USER", "admin"),
+        )  # Login used by every session
+        parser.add_argument(
+            "--password",
+            default=os.environ.get("API_PASSWORD", "admin"),
+        )  # Password of --user
+        parser.add_argument("--timeout", type=float, default=120.0)  # Seconds per request
+
+    def handle(self, *args, **options):
+        try:
+            levels = [int(level) for level in options["levels"].split(",") if level.strip()]
+        except ValueError:
+            raise CommandError("--levels must be comma-separated integers")
+        if not levels or min(levels) < 1:
+            raise CommandError("--levels must be positive")
+        if options["turns"] < 1:
+            raise CommandError("--turns must be at least 1")
+        asyncio.run(self._load_test(levels, options))
+
+    async def _load_test(self, levels: list[int], options):
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        async with httpx.AsyncClient(
+            base_url=options["url"].rstrip("/"), timeout=options["timeout"], limits=limits
+        ) as client:
+            await _login(client, options["user"], options["password"])
+            for level in levels:
+                await self._run_level(client, level, options["turns"])
+
+    # Run `level` chat sessions at once and report throughput and reply latency.
+    # "In flight" is the mean number of requests the server was handling at a time
+    # (reply time summed over the wall time): the chats one deployment really serves at once.
+    async def _run_level(self, client: httpx.AsyncClient, level: int, turns: int):
+        latencies = []
+        started = time.perf_counter()
+        errors = await asyncio.gather(
+            *(_chat_session(client, turns, latencies) for _ in range(level))
+        )
+        elapsed = time.perf_counter() - started
+        failed = [error for error in errors if error]
+        message = (
+            f"{level} sessions: {level - len(failed)} ok, {len(failed)} failed "
+            f"in {elapsed:.1f}s ({len(latencies) / elapsed:.2f} replies/s, "
+            f"{sum(latencies) / elapsed:.1f} in flight)"
+        )
+        if latencies:
+            message += f", reply {_percentiles(latencies)}"
+        self.stdout.write(message)
+        if failed:
+            self.stderr.write(f"First error: {failed[0]}")
@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from conversations.aggregates import rebuild_stats
+
+
+class Command(BaseCommand):
+    help = "Recompute the per-diet dashboard aggregates from all conversations"  # CLI description
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        conversations, foods = rebuild_stats()
+        self.stdout.write(
+            f"Rebuilt stats from {conversations} conversations "
+            f"({foods} diet/kind/food rows) in {time.perf_counter() - started:.1f}s"
+        )  # Rebuild summary
@@ -0,0 +1,86 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from conversations.aggregates import record_reclassified
+from conversations.constants import DIET_BATCH_SIZE, RECLASSIFY_RULES_BATCH_SIZE
+from conversations.diet_llm import classify_diets_llm_batch
+from conversations.diet_rules import classify_many
+from conversations.models import Conversation
+
+
+class Command(BaseCommand):
+    help = "Re-run diet classification over stored conversations in batches"  # CLI description
+
+    def add_arguments(self, parser):
+        parser.add_argument("--mode", choices=["llm", "rules"], default="llm")  # Classifier
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            help=f"Rows per batch (default {DIET_BATCH_SIZE} for llm, "
+            f"{RECLASSIFY_RULES_BATCH_SIZE} for rules).",
+        )  # Rows per request / transaction
+        parser.add_argument("--start-id", type=int, default=0, help="Resume after this id.")  # Resume point
+        parser.add_argument("--limit", type=int, help="Stop after this many rows.")  # Partial runs
+
+    # Classify rows; returns ({id: diet or None}, LLM calls made).
+    def classify(self, mode, rows):
+        if mode == "rules":
+            verdicts = classify_many((favorite, ordered) for _, _, favorite, ordered in rows)
+            return {
+                pk: verdict or diet  # Keep the stored diet when there is no evidence
+                for (pk, diet, _, _), verdict in zip(rows, verdicts)
+            }, 0
+        return classify_diets_llm_batch(
+            [(pk, favorite, ordered) for pk, _, favorite, ordered in rows]
+        )
+
+    def handle(self, *args, **options):
+        mode = options["mode"]
+        default_size = DIET_BATCH_SIZE if mode == "llm" else RECLASSIFY_RULES_BATCH_SIZE
+        batch_size = options["batch_size"] or default_size
+        limit = options["limit"]
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1")
+        last_id = options["start_id"]
+        processed = changed = failed = calls = 0
+        started = time.perf_counter()
+        while limit is None or processed < limit:
+            size = batch_size if limit is None else min(batch_size, limit - processed)
+            rows = list(
+                Conversation.objects.filter(id__gt=last_id)
+                .order_by("id")
+                .values_list("id", "diet", "favorite_foods", "ordered_dishes")[:size]
+            )  # Keyset scan by primary key
+            if not rows:
+                break
+            diets, batch_calls = self.classify(mode, rows)
+            calls += batch_calls
+            updates = {}  # new diet -> ids
+            changes = []
+            for pk, diet, favorite, ordered in rows:
+                new_diet = diets.get(pk)
+                if new_diet is None:
+                    failed += 1
+                elif new_diet != diet:
+                    updates.setdefault(new_diet, []).append(pk)
+                    changes.append((diet, new_diet, favorite, ordered))
+            with transaction.atomic():
+                for new_diet, ids in updates.items():
+                    Conversation.objects.filter(id__in=ids).update(diet=new_diet)
+                record_reclassified(changes)  # Keep dashboard aggregates in sync
+            processed += len(rows)
+            changed += len(changes)
+            last_id = rows[-1][0]
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"{processed} rows, {changed} changed, {failed} failed, "
+                f"{processed / elapsed:.1f} rows/s (last id {last_id})"
+            )  # Progress with resume point
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Done: {processed} rows in {elapsed:.1f}s "
+            f"({processed / elapsed if elapsed else 0.0:.1f} rows/s), "
+            f"{changed} changed, {failed} failed, {calls} LLM calls"
+        )  # Run summary
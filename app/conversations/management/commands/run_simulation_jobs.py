@@ -0,0 +1,69 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from conversations.constants import JOB_POLL_INTERVAL, SIMULATION_BATCH_SIZE
+from conversations.jobs import claim_next_job, requeue_job, run_job
+from conversations.metrics import serve_metrics
+from conversations.models import SimulationJob
+
+
+class Command(BaseCommand):
+    help = "Process queued simulation jobs"  # CLI description
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Drain the queue and exit instead of polling forever.",
+        )  # Cron/CI friendly
+        parser.add_argument("--poll-interval", type=float, default=JOB_POLL_INTERVAL)  # Idle sleep
+        parser.add_argument("--concurrency", type=int, default=1)  # Conversations in flight
+        parser.add_argument("--batch-size", type=int, default=SIMULATION_BATCH_SIZE)  # Bulk write size
+        parser.add_argument(
+            "--metrics-port",
+            type=int,
+            default=0,
+            help="Serve Prometheus metrics for this worker on the port (0 disables).",
+        )  # Scrape target
+        parser.add_argument(
+            "--requeue",
+            type=int,
+            action="append",
+            default=[],
+            metavar="JOB",
+            help="Queue a job left running by a dead worker (or failed) again; it resumes its run.",
+        )  # Crash recovery
+
+    def handle(self, *args, **options):
+        if options["concurrency"] < 1:
+            raise CommandError("--concurrency must be at least 1")
+        if options["metrics_port"]:
+            serve_metrics(options["metrics_port"])
+            self.stdout.write(f"Metrics on :{options['metrics_port']}/metrics")
+        for job_id in options["requeue"]:
+            job = SimulationJob.objects.filter(pk=job_id).first()
+            if job is None:
+                raise CommandError(f"Unknown job {job_id}")
+            if not requeue_job(job):
+                raise CommandError(f"Job {job_id} is {job.status}, only running or failed jobs requeue")
+            self.stdout.write(f"Job {job_id} queued again")
+        self.stdout.write("Simulation worker started")
+        while True:
+            close_old_connections()  # Drop connections broken while idle
+            job = claim_next_job()
+            if job is None:
+                if options["once"]:
+                    return
+                time.sleep(options["poll_interval"])
+                continue
+            self.stdout.write(f"Job {job.id}: {job.count} conversations ({job.diet_mode})")
+            job = run_job(
+                job,
+                concurrency=options["concurrency"],
+                batch_size=options["batch_size"],
+            )
+            self.stdout.write(
+                f"Job {job.id} {job.status}: {job.completed} ok, {job.failed} failed"
+            )  # Job summary
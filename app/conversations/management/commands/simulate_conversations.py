@@ -1,82 +1,33 @@
-import random
-from django.core.management.base import BaseCommand
-from django.db import transaction
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait
 
-from conversations.diet_rules import classify_diet_rules
-from conversations.llm import generate_text, generate_structured
-from conversations.models import Conversation, Message
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
 
-
-# --- Prompt Instructions ----------------------------------------------
-
-WAITER_INSTRUCTIONS = (
-    "You are a restaurant waiter. Be friendly and concise. "
-    "Only write the waiter line, no role labels. "
-    "Only greet once at the start, do not greet again."
-)
-
-CUSTOMER_INSTRUCTIONS = (
-    "You are a restaurant customer. Be brief and natural. "
-    "Follow the request and stay in character."
+from conversations.constants import RUN_PROGRESS_INTERVAL, SIMULATION_BATCH_SIZE
+from conversations.llm import DEFAULT_MODEL, cache_stats, client_stats, scheduler_stats
+from conversations.llm_batch import BATCH_POLL_INTERVAL
+from conversations.metrics import prompt_cache_stats
+from conversations.models import SimulationRun
+from conversations.runs import (
+    new_run_key,
+    open_run,
+    reopen_run,
+    run_shard,
+    run_totals,
+    shard_worker,
 )
 
-# TODO:
-# DIET_RULES_INLINE and DIET_RULES_TEXT should be refactored and
-# united to have only one source of diet rules.
 
-DIET_RULES_INLINE = (
-    "vegan = no meat, fish, dairy, eggs, honey; "
-    "vegetarian = no meat or fish; "
-    "omnivore = any foods.\n"
-)
-
-DIET_RULES_TEXT = {
-    "vegan": "Vegan: no meat, fish, dairy, eggs, or honey.",
-    "vegetarian": "Vegetarian: no meat or fish; dairy and eggs allowed.",
-    "omnivore": "Omnivore: any foods allowed.",
-}
-
-# --- Schemas ----------------------------------------------------------
-
-FAVORITES_SCHEMA = {
-    "type": "object",
-    "additionalProperties": False,
-    "properties": {
-        "message": {"type": "string"},
-        "diet": {"type": "string", "enum": ["omnivore", "vegetarian", "vegan"]},
-        "favorite_foods": {
-            "type": "array",
-            "items": {"type": "string"},
-            "minItems": 3,
-            "maxItems": 3,
-        },
-    },
-    "required": ["message", "diet", "favorite_foods"],
-}  # Favorites payload
-
-ORDER_SCHEMA = {
-    "type": "object",
-    "additionalProperties": False,
-    "properties": {
-        "message": {"type": "string"},
-        "ordered_dishes": {
-            "type": "array",
-            "items": {"type": "string"},
-            "minItems": 1,
-        },
-    },
-    "required": ["message", "ordered_dishes"],
-}  # Order payload
-
-DIET_CLASSIFY_SCHEMA = {
-    "type": "object",
-    "additionalProperties": False,
-    "properties": {
-        "diet": {"type": "string", "enum": ["omnivore", "vegetarian", "vegan"]},
-        "reason": {"type": "string"},
-    },
-    "required": ["diet", "reason"],
-}  # Diet classifier payload
+# Parse "k/N" (1-based) into a zero-based shard index and the shard count.
+def _parse_shard(value: str) -> tuple[int, int]:
+    try:
+        number, shard_count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise CommandError("--shard must look like k/N, e.g. 2/4")
+    if not 1 <= number <= shard_count:
+        raise CommandError("--shard k/N needs 1 <= k <= N")
+    return number - 1, shard_count
 
 
 # --- Command ----------------------------------------------------------
@@ -85,141 +36,242 @@ class Command(BaseCommand):
     help = "Simulate waiter/customer conversations"  # CLI description
 
     def add_arguments(self, parser):
-        parser.add_argument("--count", type=int, default=100)  # Conversation count
+        parser.add_argument("--count", type=int, default=100)  # Conversations in the whole run
         parser.add_argument(
             "--diet-mode",
             choices=["self", "rules", "llm"],
             default="self",
         )  # Diet source
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=1,
+            help="Conversations in flight per process (turns inside each also run in parallel).",
+        )  # Async fan-out
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=SIMULATION_BATCH_SIZE,
+            help="Conversations written per bulk insert transaction.",
+        )  # Bulk write size
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Split the run into this many shards, each in its own process.",
+        )  # Process pool
+        parser.add_argument(
+            "--shard",
+            help="Run only shard k/N of the run given by --run (one per host).",
+        )  # Multi-host mode
+        parser.add_argument(
+            "--run",
+            help="Run key shared by every shard; generated when omitted.",
+        )  # Run record and label prefix
+        parser.add_argument(
+            "--seed",
+            type=int,
+            help="Seed for the per-conversation diet choices; random when omitted.",
+        )  # Reproducible runs
+        parser.add_argument(
+            "--resume",
+            metavar="RUN",
+            help="Finish an interrupted run with its stored parameters, skipping saved rows.",
+        )  # Crash recovery
+        parser.add_argument(
+            "--batch-api",
+            action="store_true",
+            help="Send each conversation stage through the provider's batch interface.",
+        )  # Offline bulk mode
+        parser.add_argument(
+            "--batch-poll",
+            type=float,
+            default=BATCH_POLL_INTERVAL,
+            help="Seconds between batch status checks.",
+        )  # Batch polling
 
     def handle(self, *args, **options):
         count = options["count"]
-        diet_mode = options["diet_mode"]
-        for i in range(count):
+        concurrency = options["concurrency"]
+        workers = options["workers"]
+        if count < 1:
+            raise CommandError("--count must be at least 1")
+        if concurrency < 1:
+            raise CommandError("--concurrency must be at least 1")
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1")
+        if workers < 1:
+            raise CommandError("--workers must be at least 1")
+        if options["batch_api"] and workers > 1:
+            raise CommandError("--batch-api runs in one process; drop --workers")
+        if options["shard"] and workers > 1:
+            raise CommandError("--shard and --workers cannot be combined")
+        if options["seed"] is not None and options["seed"] < 0:
+            raise CommandError("--seed must not be negative")
+        if options["resume"] and options["run"]:
+            raise CommandError("--resume already names the run; drop --run")
+        if options["shard"] and not (options["run"] or options["resume"]):
+            raise CommandError("--shard needs --run so every host joins the same run")
+
+        index, shard_count = _parse_shard(options["shard"]) if options["shard"] else (None, workers)
+        if options["resume"]:
+            run = SimulationRun.objects.filter(key=options["resume"]).first()
+            if run is None:
+                raise CommandError(f"Unknown run {options['resume']}")
+            if index is not None and shard_count != run.shard_count:
+                raise CommandError(f"Run {run.key} has {run.shard_count} shards")
+            indices = reopen_run(run, index)
+            if not indices:
+                self.stdout.write(f"Run {run.key} is complete, nothing to resume")
+                return
+            self.stdout.write(
+                f"Resuming run {run.key}: {run.count} conversations ({run.diet_mode}, "
+                f"seed {run.seed}), shards {', '.join(str(i + 1) for i in indices)} "
+                f"of {run.shard_count}"
+            )
+            if run.model != DEFAULT_MODEL:
+                self.stderr.write(f"Run was started with {run.model}, now using {DEFAULT_MODEL}")
+        else:
+            key = options["run"] or new_run_key()
             try:
-                with transaction.atomic():
-                    conv = Conversation.objects.create(
-                        customer_label=f"customer_{i + 1}",
-                    )  # New conversation
-                    turn = 1
-
-                    waiter_greet = generate_text(
-                        "Greet the customer and ask if they had a good day. "
-                        "Do not ask about order, food or drink.",
-                        WAITER_INSTRUCTIONS,
-                    )
-                    Message.objects.create(
-                        conversation=conv,
-                        role="waiter",
-                        content=waiter_greet,
-                        turn_index=turn,
-                    )
-                    turn += 1
-
-                    customer_day = generate_text(
-                        f"Waiter said: {waiter_greet}\n"
-                        "Reply briefly about your day. "
-                        "Do not order or mention food or drinks. "
-                        "Do not ask questions.",
-                        CUSTOMER_INSTRUCTIONS,
-                    )
-                    Message.objects.create(
-                        conversation=conv,
-                        role="customer",
-                        content=customer_day,
-                        turn_index=turn,
-                    )
-                    turn += 1
+                run = open_run(key, count, options["diet_mode"], shard_count, options["seed"])
+            except ValueError as exc:
+                raise CommandError(str(exc))
+            indices = [index or 0] if workers == 1 else list(range(run.shard_count))
+            self.stdout.write(
+                f"Run {run.key}: {run.count} conversations ({run.diet_mode}, seed {run.seed}) "
+                f"in {run.shard_count} shards"
+            )
 
-                    waiter_ask_fav = generate_text(
-                        "Ask the customer for their top 3 favorite foods. Do not greet or use salutations.",
-                        WAITER_INSTRUCTIONS,
-                    )
-                    Message.objects.create(
-                        conversation=conv,
-                        role="waiter",
-                        content=waiter_ask_fav,
-                        turn_index=turn,
-                    )
-                    turn += 1
-
-                    self_diet = random.choice(["omnivore", "vegetarian", "vegan"])  # Preselect diet
-                    customer_fav = generate_structured(
-                        (
-                            f"Waiter asked: {waiter_ask_fav}\n"
-                            f"Your diet is {self_diet}. "
-                            "Set the JSON diet field to exactly this value.\n"
-                            "Do not mention your diet or the words vegan/vegetarian/omnivore in the message.\n"
-                            "Return 3 favorite foods that strictly match your diet.\n"
-                            f"Rules: {DIET_RULES_INLINE}"
-                            "Return JSON only."
-                        ),
-                        CUSTOMER_INSTRUCTIONS,
-                        FAVORITES_SCHEMA,
-                        "favorite_foods",
-                    )
-                    conv.favorite_foods = [food.strip().lower() for food in customer_fav["favorite_foods"]]  # Normalize
-                    Message.objects.create(
-                        conversation=conv,
-                        role="customer",
-                        content=customer_fav["message"],
-                        turn_index=turn,
-                    )
-                    turn += 1
+        if len(indices) == 1 or options["batch_api"]:
+            for index in indices:  # Batches run on the provider; no pool needed
+                self._run_shard(run, index, options)
+        else:
+            self._run_workers(run, indices, workers if workers > 1 else len(indices), options)
+        run.refresh_from_db()
+        if run.finished_at is not None:
+            self._report_run(run)
+        else:
+            totals = run_totals(run)
+            self.stdout.write(
+                f"Run {run.key}: {totals['shards_done']}/{run.shard_count} shards finished, "
+                f"waiting for the others"
+            )
 
-                    waiter_ask_order = generate_text(
-                        "Ask what dishes the customer wants to order today. Do not greet or use salutations.",
-                        WAITER_INSTRUCTIONS,
-                    )
-                    Message.objects.create(
-                        conversation=conv,
-                        role="waiter",
-                        content=waiter_ask_order,
-                        turn_index=turn,
-                    )
-                    turn += 1
-
-                    customer_order = generate_structured(
-                        (
-                            f"Waiter asked: {waiter_ask_order}\n"
-                            f"You previously said your diet is {self_diet}. "
-                            f"{DIET_RULES_TEXT.get(self_diet, DIET_RULES_TEXT['omnivore'])}\n"
-                            "Ordered dishes must strictly match your diet. Return JSON only."
-                        ),
-                        CUSTOMER_INSTRUCTIONS,
-                        ORDER_SCHEMA,
-                        "order",
+    # Run one shard in this process, reporting every conversation.
+    def _run_shard(self, run, index, options):
+        shard_count = run.shard_count
+
+        def report(conversation_index, error):
+            if error is None:
+                self.stdout.write(f"OK {conversation_index + 1}/{run.count}")  # Progress output
+            else:
+                self.stderr.write(f"FAIL {conversation_index + 1}/{run.count}: {error}")
+
+        def report_batch(batch_id, status, size):
+            self.stdout.write(f"Batch {batch_id} ({size} requests): {status}")
+
+        batch_api = None
+        if options["batch_api"]:
+            batch_api = {"poll_interval": options["batch_poll"], "on_status": report_batch}
+        try:
+            shard, stats = run_shard(
+                run,
+                index,
+                concurrency=options["concurrency"],
+                batch_size=options["batch_size"],
+                on_progress=report,
+                batch_api=batch_api,
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        if shard.error:
+            self.stderr.write(f"Shard {index + 1}/{shard_count} failed: {shard.error}")
+        self.stdout.write(
+            f"Done: {stats.completed} ok, {stats.failed} failed, {stats.resumed} resumed "
+            f"in {stats.elapsed:.1f}s "
+            f"({stats.conversations_per_second:.2f} conversations/s, "
+            f"{stats.calls_per_second:.2f} calls/s, {stats.cache_hits} cache hits, "
+            f"concurrency {options['concurrency']})"
+        )  # Throughput summary
+        usage = stats.usage
+        self.stdout.write(
+            f"LLM usage: {usage.calls} calls, {usage.errors} errors, "
+            f"{usage.input_tokens} input / {usage.output_tokens} output tokens "
+            f"({usage.cached_tokens} cached), est. ${usage.cost:.4f}"
+        )  # Token and cost summary
+        prompt_cache = ", ".join(
+            f"{site} {entry['cached_ratio']:.0%}" for site, entry in prompt_cache_stats().items()
+        )
+        if prompt_cache:
+            self.stdout.write(f"Prompt cache (cached input share): {prompt_cache}")
+        timings = ", ".join(f"{name} {ms:.0f} ms" for name, ms in stats.mean_timings_ms().items())
+        if timings:
+            self.stdout.write(f"Mean latency: {timings}")  # Per turn, stage and conversation
+        pool = client_stats()
+        self.stdout.write(
+            f"HTTP pool: {pool['requests']} requests, {pool['connections_opened']} connections opened, "
+            f"{pool['connections_reused']} reused ({pool['reuse_rate']:.0%})"
+        )  # Connection reuse summary
+        scheduler = scheduler_stats()
+        self.stdout.write(
+            f"Scheduler: {scheduler['retries']} retries, {scheduler['gave_up']} gave up, "
+            f"{scheduler['throttled']} throttled ({scheduler['throttled_seconds']:.1f}s waited), "
+            f"{scheduler['breaker_trips']} breaker trips"
+        )  # Retry and pacing summary
+        cache = cache_stats()
+        if cache.get("enabled", True):
+            self.stdout.write(
+                f"LLM cache: {cache['hits']} hits, {cache['misses']} misses "
+                f"({cache['hit_rate']:.0%}), {cache['evictions']} evictions"
+            )  # Cache effectiveness
+
+    # Run every shard in a pool of forked processes, printing progress from the run record.
+    # Each process has its own DB connection, HTTP pool and LLM scheduler.
+    def _run_workers(self, run, indices, workers, options):
+        connections.close_all()  # Forked children must not share the parent's DB socket
+        context = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            pending = {
+                pool.submit(
+                    shard_worker, run.pk, index, options["concurrency"], options["batch_size"]
+                )
+                for index in indices
+            }
+            while pending:
+                done, pending = wait(pending, timeout=RUN_PROGRESS_INTERVAL)
+                for future in done:
+                    try:
+                        result = future.result()
+                    except Exception as exc:
+                        self.stderr.write(f"Shard process failed: {exc}")
+                        continue
+                    message = (
+                        f"Shard {result['index'] + 1}/{run.shard_count} {result['status']}: "
+                        f"{result['completed']} ok, {result['failed']} failed"
                     )
-                    conv.ordered_dishes = [dish.strip().lower() for dish in customer_order["ordered_dishes"]]  # Normalize
-                    Message.objects.create(
-                        conversation=conv,
-                        role="customer",
-                        content=customer_order["message"],
-                        turn_index=turn,
+                    if result["error"]:
+                        self.stderr.write(f"{message} ({result['error']})")
+                    else:
+                        self.stdout.write(message)
+                if pending:
+                    totals = run_totals(run)
+                    self.stdout.write(
+                        f"Progress: {totals['completed'] + totals['failed']}/{run.count} "
+                        f"({totals['failed']} failed)"
                     )
-                    final_diet = self_diet  # Default diet classification mode: self
-                    if diet_mode == "rules":  # Diet classification mode: rules
-                        final_diet = classify_diet_rules(
-                            conv.favorite_foods,
-                            conv.ordered_dishes,
-                        ) or self_diet
-                    elif diet_mode == "llm":  # Diet classification mode: llm
-                        diet_check = generate_structured(
-                            (
-                            "You are the waiter. Classify the diet based on foods.\n"
-                            f"Favorite foods: {conv.favorite_foods}\n"
-                            f"Ordered dishes: {conv.ordered_dishes}\n"
-                            f"{DIET_RULES_INLINE}"
-                            "Return JSON only."
-                        ),
-                            WAITER_INSTRUCTIONS,
-                            DIET_CLASSIFY_SCHEMA,
-                            "diet_classification",
-                        )
-                        final_diet = diet_check["diet"]
-                    conv.diet = final_diet  # Store final diet
-                    conv.save()  # Persist extracted fields
-
-                self.stdout.write(f"OK {i + 1}/{count}")  # Progress output
-            except Exception as exc:
-                self.stderr.write(f"FAIL {i + 1}/{count}: {exc}")  # Error report
+
+    # Totals over every shard, printed by whichever process finished the run.
+    def _report_run(self, run):
+        totals = run_totals(run)
+        elapsed = totals["elapsed"]
+        rate = totals["completed"] / elapsed if elapsed else 0.0
+        self.stdout.write(
+            f"Run {run.key} finished: {totals['completed']} ok, {totals['failed']} failed, "
+            f"{totals['shards_failed']}/{run.shard_count} shards failed "
+            f"in {elapsed:.1f}s ({rate:.2f} conversations/s)"
+        )  # Whole-run throughput
+        self.stdout.write(
+            f"Run LLM usage: {totals['llm_calls']} calls, {totals['input_tokens']} input / "
+            f"{totals['output_tokens']} output tokens, est. ${totals['llm_cost']:.4f}"
+        )  # Whole-run tokens and cost
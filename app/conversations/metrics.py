@@ -0,0 +1,266 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)  # Histogram bounds, seconds
+
+MODEL_PRICES = {
+    "gpt-4.1": (Decimal("2.00"), Decimal("8.00")),
+    "gpt-4.1-mini": (Decimal("0.40"), Decimal("1.60")),
+    "gpt-4.1-nano": (Decimal("0.10"), Decimal("0.40")),
+    "gpt-4o": (Decimal("2.50"), Decimal("10.00")),
+    "gpt-4o-mini": (Decimal("0.15"), Decimal("0.60")),
+}  # USD per million (input, output) tokens
+PRICE_INPUT = os.environ.get("LLM_PRICE_INPUT", "")  # Override, USD per million input tokens
+PRICE_OUTPUT = os.environ.get("LLM_PRICE_OUTPUT", "")  # Override, USD per million output tokens
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"  # Prometheus text exposition
+
+
+# Estimated USD cost of a call; unknown models cost 0 unless prices are set in the env.
+def estimate_cost(model: str, input_tokens: int, output_tokens: int) -> Decimal:
+    input_price, output_price = MODEL_PRICES.get(model, (Decimal(0), Decimal(0)))
+    if PRICE_INPUT:
+        input_price = Decimal(PRICE_INPUT)
+    if PRICE_OUTPUT:
+        output_price = Decimal(PRICE_OUTPUT)
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+# --- Usage Collection -------------------------------------------------
+
+# LLM usage summed over a unit of work (a conversation, a run).
+@dataclass
+class UsageTotals:
+    calls: int = 0  # Provider calls, cache hits excluded
+    cache_hits: int = 0  # Answers served from the local response cache
+    errors: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cached_tokens: int = 0  # Prompt tokens served from the provider's prompt cache
+    llm_ms: float = 0.0  # Summed call latency, retries included
+    cost: Decimal = Decimal(0)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+    def add(self, other: "UsageTotals") -> None:
+        self.calls += other.calls
+        self.cache_hits += other.cache_hits
+        self.errors += other.errors
+        self.input_tokens += other.input_tokens
+        self.output_tokens += other.output_tokens
+        self.cached_tokens += other.cached_tokens
+        self.llm_ms += other.llm_ms
+        self.cost += other.cost
+
+    # Split evenly over `parts` units, e.g. a batched call over its conversations.
+    def share(self, parts: int) -> "UsageTotals":
+        parts = max(parts, 1)
+        return UsageTotals(
+            calls=0,  # Calls stay with the batch; only the cost is shared
+            cache_hits=0,
+            errors=0,
+            input_tokens=self.input_tokens // parts,
+            output_tokens=self.output_tokens // parts,
+            cached_tokens=self.cached_tokens // parts,
+            llm_ms=self.llm_ms / parts,
+            cost=self.cost / parts,
+        )
+
+
+_collectors = ContextVar("llm_usage_collectors", default=())  # Innermost last
+
+
+# Collect the usage of every LLM call made inside the block, including tasks it gathers.
+# Blocks nest: a call counts towards every enclosing collector (conversation and run).
+@contextmanager
+def collect_usage(totals: UsageTotals | None = None):
+    totals = UsageTotals() if totals is None else totals
+    token = _collectors.set(_collectors.get() + (totals,))
+    try:
+        yield totals
+    finally:
+        _collectors.reset(token)
+
+
+# --- Registry ---------------------------------------------------------
+
+_lock = threading.Lock()
+_counters = {}  # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts..., count, sum]
+
+HELP = {
+    "llm_calls_total": ("counter", "LLM calls by call site, model and outcome."),
+    "llm_tokens_total": ("counter", "LLM tokens by call site, model and kind."),
+    "llm_cost_usd_total": ("counter", "Estimated LLM cost in USD by call site and model."),
+    "llm_errors_total": ("counter", "Failed LLM calls by call site and error type."),
+    "llm_call_seconds": ("histogram", "LLM call latency by call site and model, retries included."),
+}  # Exposed metric families
+
+
+def _inc(name: str, labels: tuple, amount=1) -> None:
+    with _lock:
+        _counters[(name, labels)] = _counters.get((name, labels), 0) + amount
+
+
+def _observe(name: str, labels: tuple, value: float) -> None:
+    with _lock:
+        entry = _histograms.setdefault((name, labels), [0] * (len(LATENCY_BUCKETS) + 1) + [0.0])
+        for position, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                entry[position] += 1
+        entry[-2] += 1  # Count
+        entry[-1] += value  # Sum
+
+
+# Start from zero in forked children so each worker reports only its own calls.
+def _reset_after_fork() -> None:
+    global _lock
+    _lock = threading.Lock()
+    _counters.clear()
+    _histograms.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+# Holds the provider response once the observed call returns.
+class CallObservation:
+    response = None
+
+
+# Time one LLM call and record tokens, cost and errors under its call-site label.
+@contextmanager
+def observe_llm_call(site: str, model: str):
+    observation = CallObservation()
+    started = time.perf_counter()
+    try:
+        yield observation
+    except Exception as exc:
+        _record(site, model, time.perf_counter() - started, None, exc)
+        raise
+    _record(site, model, time.perf_counter() - started, observation.response, None)
+
+
+def _record(site, model, seconds, response, error, price_factor=1) -> None:
+    site = site or "unlabelled"
+    labels = (("site", site), ("model", model))
+    usage = getattr(response, "usage", None)
+    input_tokens = getattr(usage, "input_tokens", 0) or 0
+    output_tokens = getattr(usage, "output_tokens", 0) or 0
+    details = getattr(usage, "input_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", 0) or 0
+    cost = estimate_cost(model, input_tokens, output_tokens) * price_factor
+    _inc("llm_calls_total", labels + (("outcome", "error" if error else "ok"),))
+    if seconds is not None:
+        _observe("llm_call_seconds", labels, seconds)
+    if error is not None:
+        _inc("llm_errors_total", (("site", site), ("error", type(error).__name__)))
+    else:
+        _inc("llm_tokens_total", labels + (("kind", "input"),), input_tokens)
+        _inc("llm_tokens_total", labels + (("kind", "output"),), output_tokens)
+        _inc("llm_tokens_total", labels + (("kind", "cached"),), cached_tokens)
+        _inc("llm_cost_usd_total", labels, float(cost))
+    for totals in _collectors.get():
+        totals.calls += 1
+        totals.errors += error is not None
+        totals.input_tokens += input_tokens
+        totals.output_tokens += output_tokens
+        totals.cached_tokens += cached_tokens
+        totals.llm_ms += (seconds or 0) * 1000
+        totals.cost += cost
+
+
+# Record a call answered outside observe_llm_call, e.g. a batch API result.
+# It has no latency of its own; price_factor applies the batch discount to the cost.
+def record_llm_result(site: str, model: str, response, error=None, price_factor=1) -> None:
+    _record(site, model, None, response, error, price_factor)
+
+
+# Count a response served from the local cache (no provider call, no tokens).
+def record_cache_hit(site: str, model: str) -> None:
+    _inc("llm_calls_total", (("site", site or "unlabelled"), ("model", model), ("outcome", "cache")))
+    for totals in _collectors.get():
+        totals.cache_hits += 1
+
+
+# Prompt-cache use per call site in this process: input tokens, the share served from the
+# provider's prompt cache, and their ratio. Sites without input tokens are left out.
+def prompt_cache_stats() -> dict[str, dict[str, object]]:
+    with _lock:
+        counters = dict(_counters)
+    sites = {}
+    for (name, labels), value in counters.items():
+        labels = dict(labels)
+        if name != "llm_tokens_total" or labels["kind"] not in {"input", "cached"}:
+            continue
+        entry = sites.setdefault(labels["site"], {"input_tokens": 0, "cached_tokens": 0})
+        entry[f"{labels['kind']}_tokens"] += value
+    for entry in sites.values():
+        entry["cached_ratio"] = (
+            entry["cached_tokens"] / entry["input_tokens"] if entry["input_tokens"] else 0.0
+        )
+    return {site: entry for site, entry in sorted(sites.items()) if entry["input_tokens"]}
+
+
+# --- Exposition -------------------------------------------------------
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+# Render this process's metrics in the Prometheus text format.
+def render_prometheus() -> str:
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: list(value) for key, value in _histograms.items()}
+    lines = []
+    for name, (kind, help_text) in HELP.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == "counter":
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+            continue
+        for (metric, labels), entry in sorted(histograms.items()):
+            if metric != name:
+                continue
+            for bound, count in zip(LATENCY_BUCKETS, entry):
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {count}")
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {entry[-2]}")
+            lines.append(f"{name}_count{_format_labels(labels)} {entry[-2]}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {entry[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes are too frequent to log
+
+
+# Serve /metrics from a daemon thread, for processes without a web server (the worker).
+def serve_metrics(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
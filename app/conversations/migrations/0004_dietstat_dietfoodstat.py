@@ -0,0 +1,63 @@
+# Generated by Django 6.0.2 on 2026-10-17 11:20
+
+from collections import Counter
+
+from django.db import migrations, models
+
+
+# Backfill the stat tables from existing conversations.
+def backfill_stats(apps, schema_editor):
+    Conversation = apps.get_model('conversations', 'Conversation')
+    DietStat = apps.get_model('conversations', 'DietStat')
+    DietFoodStat = apps.get_model('conversations', 'DietFoodStat')
+    known = {'omnivore', 'vegetarian', 'vegan'}
+    diets = Counter()
+    foods = Counter()
+    rows = Conversation.objects.values_list('diet', 'favorite_foods').iterator(chunk_size=2000)
+    for diet, favorite_foods in rows:
+        if diet not in known:
+            continue
+        diets[diet] += 1
+        for food in favorite_foods or []:
+            normalized = str(food).strip().lower()[:255] if food else ''
+            if normalized:
+                foods[(diet, normalized)] += 1
+    DietStat.objects.bulk_create(
+        [DietStat(diet=diet, conversation_count=count) for diet, count in diets.items()]
+    )
+    DietFoodStat.objects.bulk_create(
+        [DietFoodStat(diet=diet, food=food, count=count) for (diet, food), count in foods.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0003_llmcacheentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DietStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('diet', models.CharField(max_length=16, unique=True)),
+                ('conversation_count', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DietFoodStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('diet', models.CharField(max_length=16)),
+                ('food', models.CharField(max_length=255)),
+                ('count', models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['diet', '-count'], name='dietfoodstat_diet_count_idx')],
+                'constraints': [models.UniqueConstraint(fields=('diet', 'food'), name='dietfoodstat_diet_food_uniq')],
+            },
+        ),
+        migrations.RunPython(backfill_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 6.0.2 on 2026-10-17 12:40
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    atomic = False  # Build indexes without locking writes on large tables
+
+    dependencies = [
+        ('conversations', '0004_dietstat_dietfoodstat'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='conversation',
+            index=models.Index(fields=['diet', 'created_at', 'id'], name='conversation_diet_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='conversation',
+            index=models.Index(fields=['created_at', 'id'], name='conversation_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 6.0.2 on 2026-10-17 15:20
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0006_conversation_llm_usage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dietstat',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dietstat',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
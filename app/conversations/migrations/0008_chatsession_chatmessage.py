@@ -0,0 +1,47 @@
+# Generated by Django 6.0.2 on 2026-10-17 16:05
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0007_dietstat_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('turn_count', models.PositiveIntegerField(default=0)),
+                ('summary', models.TextField(blank=True)),
+                ('summarized_through', models.PositiveIntegerField(default=0)),
+                ('last_response_id', models.CharField(blank=True, max_length=128)),
+                ('context_tokens', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_sessions', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChatMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('user', 'User'), ('assistant', 'Assistant')], max_length=16)),
+                ('content', models.TextField()),
+                ('turn_index', models.PositiveIntegerField()),
+                ('tokens', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='conversations.chatsession')),
+            ],
+            options={
+                'ordering': ['turn_index'],
+                'unique_together': {('session', 'turn_index')},
+            },
+        ),
+    ]
@@ -0,0 +1,86 @@
+# Generated by Django 6.0.2 on 2026-10-17 18:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Backfill the food tables from the JSON columns, normalized like foods.normalize_food
+# (strip, lowercase, 255 characters). Repeated foods keep their first position.
+FOOD_NAME = "left(lower(btrim(e.value, E' \\t\\r\\n')), 255)"
+
+BACKFILL_SQL = [
+    f"""
+    INSERT INTO conversations_food (name)
+    SELECT DISTINCT {FOOD_NAME}
+    FROM conversations_conversation c
+    CROSS JOIN LATERAL jsonb_array_elements_text(
+        COALESCE(c.favorite_foods, '[]'::jsonb) || COALESCE(c.ordered_dishes, '[]'::jsonb)
+    ) AS e(value)
+    WHERE {FOOD_NAME} <> ''
+    ON CONFLICT (name) DO NOTHING
+    """,
+] + [
+    f"""
+    INSERT INTO conversations_{table} (conversation_id, food_id, position)
+    SELECT c.id, f.id, MIN(e.position)
+    FROM conversations_conversation c
+    CROSS JOIN LATERAL jsonb_array_elements_text(COALESCE(c.{column}, '[]'::jsonb))
+        WITH ORDINALITY AS e(value, position)
+    JOIN conversations_food f ON f.name = {FOOD_NAME}
+    GROUP BY c.id, f.id
+    """
+    for table, column in [("favoritefood", "favorite_foods"), ("ordereddish", "ordered_dishes")]
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0010_simulationrun_params_conversation_run'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Food',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FavoriteFood',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField()),
+                ('conversation', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='conversations.conversation')),
+                ('food', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='conversations.food')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['food', 'conversation'], name='favoritefood_food_conv_idx')],
+                'constraints': [models.UniqueConstraint(fields=('conversation', 'food'), name='favoritefood_conversation_food_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='OrderedDish',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField()),
+                ('conversation', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='conversations.conversation')),
+                ('food', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='conversations.food')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['food', 'conversation'], name='ordereddish_food_conv_idx')],
+                'constraints': [models.UniqueConstraint(fields=('conversation', 'food'), name='ordereddish_conversation_food_uniq')],
+            },
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='favorites',
+            field=models.ManyToManyField(blank=True, related_name='favored_in', through='conversations.FavoriteFood', to='conversations.food'),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='orders',
+            field=models.ManyToManyField(blank=True, related_name='ordered_in', through='conversations.OrderedDish', to='conversations.food'),
+        ),
+        migrations.RunSQL(BACKFILL_SQL, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:10
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0011_food_favoritefood_ordereddish'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='message',
+            name='search',
+            field=models.GeneratedField(db_persist=True, expression=django.contrib.postgres.search.SearchVector('content', config='english'), output_field=django.contrib.postgres.search.SearchVectorField()),
+        ),
+        migrations.AddField(
+            model_name='food',
+            name='search',
+            field=models.GeneratedField(db_persist=True, expression=django.contrib.postgres.search.SearchVector('name', config='english'), output_field=django.contrib.postgres.search.SearchVectorField()),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search'], name='message_search_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='food',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search'], name='food_search_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='food',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['name'], name='food_name_trgm_gin', opclasses=['gin_trgm_ops']),
+        ),
+    ]
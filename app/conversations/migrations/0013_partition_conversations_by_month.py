@@ -0,0 +1,198 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:05
+
+from datetime import timezone as dt_timezone
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+# Turn the conversation and message tables into tables range partitioned by month on
+# created_at. PostgreSQL wants the partition key in every primary key and unique constraint,
+# and foreign keys can only point at such a key, so:
+# - primary keys become (id, created_at); ids still come from a sequence;
+# - message and food link rows keep conversation_id without a database foreign key
+#   (Django cascades deletes itself);
+# - messages take their conversation's created_at, so a transcript stays in one month;
+# - (run, run_index) is indexed instead of unique (persistence.write_batch locks the run).
+# Existing rows are copied into the new tables, which locks both for the duration.
+# Unapplying copies them back into plain tables (archived months are not restored).
+CONVERSATION = "conversations_conversation"
+MESSAGE = "conversations_message"
+MONTHS_AHEAD = 3  # Partitions created past the current month
+
+INDEX_SQL = [
+    f"CREATE INDEX conversation_diet_created_idx ON {CONVERSATION} (diet, created_at, id)",
+    f"CREATE INDEX conversation_created_id_idx ON {CONVERSATION} (created_at, id)",
+    f"CREATE INDEX conversation_run_index_idx ON {CONVERSATION} (run_id, run_index)",
+    f"""
+    ALTER TABLE {CONVERSATION} ADD CONSTRAINT conversation_run_id_fk
+    FOREIGN KEY (run_id) REFERENCES conversations_simulationrun (id) DEFERRABLE INITIALLY DEFERRED
+    """,
+    f"""
+    ALTER TABLE {MESSAGE} ADD CONSTRAINT message_conversation_turn_uniq
+    UNIQUE (conversation_id, turn_index, created_at)
+    """,
+    f"CREATE INDEX message_search_gin ON {MESSAGE} USING gin (search)",
+]
+
+
+def _month(value):
+    return value.astimezone(dt_timezone.utc).replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0
+    )
+
+
+def _add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+# Stored (not generated) columns, in table order.
+def _columns(cursor, table):
+    cursor.execute(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = %s AND is_generated = 'NEVER' "
+        "ORDER BY ordinal_position",
+        [table],
+    )
+    return [name for (name,) in cursor.fetchall()]
+
+
+def partition_tables(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"SELECT MIN(created_at) FROM {CONVERSATION}")
+        oldest = cursor.fetchone()[0] or django.utils.timezone.now()
+        month, last = _month(oldest), _add_months(_month(django.utils.timezone.now()), MONTHS_AHEAD)
+        months = []
+        while month <= last:
+            months.append(month)
+            month = _add_months(month, 1)
+
+        conversation_columns = ", ".join(_columns(cursor, CONVERSATION))
+        message_columns = _columns(cursor, MESSAGE)
+        message_values = ", ".join(
+            "c.created_at" if name == "created_at" else f"m.{name}" for name in message_columns
+        )  # Messages move to their conversation's created_at
+        for table in [CONVERSATION, MESSAGE]:
+            cursor.execute(
+                f"CREATE TABLE {table}_new (LIKE {table} INCLUDING DEFAULTS "
+                f"INCLUDING CONSTRAINTS INCLUDING GENERATED) PARTITION BY RANGE (created_at)"
+            )
+            for month in months:
+                cursor.execute(
+                    f"CREATE TABLE {table}_p{month:%Y%m} PARTITION OF {table}_new "
+                    f"FOR VALUES FROM (%s) TO (%s)",
+                    [month, _add_months(month, 1)],
+                )
+
+        cursor.execute(
+            f"INSERT INTO {CONVERSATION}_new ({conversation_columns}) "
+            f"SELECT {conversation_columns} FROM {CONVERSATION}"
+        )
+        cursor.execute(
+            f"INSERT INTO {MESSAGE}_new ({', '.join(message_columns)}) "
+            f"SELECT {message_values} FROM {MESSAGE} m JOIN {CONVERSATION} c ON c.id = m.conversation_id"
+        )
+        cursor.execute(f"DROP TABLE {MESSAGE}, {CONVERSATION} CASCADE")  # And the links' FKs
+
+        for table in [CONVERSATION, MESSAGE]:
+            sequence = f"{table}_id_seq"
+            cursor.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+            cursor.execute(f"CREATE SEQUENCE {sequence} AS bigint OWNED BY {table}.id")
+            cursor.execute(
+                f"SELECT setval(%s, COALESCE(MAX(id), 0) + 1, false) FROM {table}", [sequence]
+            )
+            cursor.execute(f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT nextval(%s)", [sequence])
+            cursor.execute(f"ALTER TABLE {table} ADD PRIMARY KEY (id, created_at)")
+        for statement in INDEX_SQL:
+            cursor.execute(statement)
+
+
+# Rebuild the plain tables of 0012 from its model state (apps), with the same indexes,
+# constraints and foreign keys, and copy the rows back. Fails if (run, run_index) is no
+# longer unique.
+def unpartition_tables(apps, schema_editor):
+    Conversation = apps.get_model("conversations", "Conversation")
+    Message = apps.get_model("conversations", "Message")
+    with schema_editor.connection.cursor() as cursor:
+        for table in [CONVERSATION, MESSAGE]:
+            cursor.execute(
+                f"CREATE TEMPORARY TABLE {table}_rows ON COMMIT DROP AS SELECT * FROM {table}"
+            )
+        cursor.execute(f"DROP TABLE {MESSAGE}, {CONVERSATION} CASCADE")  # With the partitions
+
+        schema_editor.create_model(Conversation)  # Indexes and foreign keys are deferred
+        schema_editor.create_model(Message)
+        for table in [CONVERSATION, MESSAGE]:
+            columns = ", ".join(_columns(cursor, table))
+            cursor.execute(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {table}_rows")
+            cursor.execute(
+                f"SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE(MAX(id), 0) + 1, false) "
+                f"FROM {table}",
+                [table],
+            )
+    for name in ["FavoriteFood", "OrderedDish"]:
+        model = apps.get_model("conversations", name)
+        schema_editor.deferred_sql.append(
+            schema_editor._create_fk_sql(
+                model, model._meta.get_field("conversation"), "_fk_%(to_table)s_%(to_column)s"
+            )
+        )  # Dropped along with the partitioned table
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0012_search_vectors'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(partition_tables, unpartition_tables),
+            ],
+            state_operations=[
+                migrations.RemoveConstraint(
+                    model_name='conversation',
+                    name='conversation_run_index_uniq',
+                ),
+                migrations.AlterField(
+                    model_name='conversation',
+                    name='run',
+                    field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='conversations', to='conversations.simulationrun'),
+                ),
+                migrations.AddIndex(
+                    model_name='conversation',
+                    index=models.Index(fields=['run', 'run_index'], name='conversation_run_index_idx'),
+                ),
+                migrations.AlterField(
+                    model_name='favoritefood',
+                    name='conversation',
+                    field=models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.CASCADE, to='conversations.conversation'),
+                ),
+                migrations.AlterField(
+                    model_name='ordereddish',
+                    name='conversation',
+                    field=models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.CASCADE, to='conversations.conversation'),
+                ),
+                migrations.AlterField(
+                    model_name='message',
+                    name='conversation',
+                    field=models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='conversations.conversation'),
+                ),
+                migrations.AlterField(
+                    model_name='message',
+                    name='created_at',
+                    field=models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                migrations.AlterUniqueTogether(
+                    name='message',
+                    unique_together=set(),
+                ),
+                migrations.AddConstraint(
+                    model_name='message',
+                    constraint=models.UniqueConstraint(fields=('conversation', 'turn_index', 'created_at'), name='message_conversation_turn_uniq'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:23
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+# Count ordered dishes per diet from the link table, next to the existing favorite rows.
+def backfill_ordered(apps, schema_editor):
+    OrderedDish = apps.get_model('conversations', 'OrderedDish')
+    DietFoodStat = apps.get_model('conversations', 'DietFoodStat')
+    rows = (
+        OrderedDish.objects.filter(conversation__diet__in=['omnivore', 'vegetarian', 'vegan'])
+        .values_list('conversation__diet', 'food__name')
+        .annotate(total=Count('id'))
+        .values_list('conversation__diet', 'food__name', 'total')
+    )
+    DietFoodStat.objects.bulk_create(
+        [DietFoodStat(diet=diet, kind='ordered', food=food, count=total) for diet, food, total in rows],
+        batch_size=1000,
+    )
+
+
+def drop_ordered(apps, schema_editor):
+    apps.get_model('conversations', 'DietFoodStat').objects.filter(kind='ordered').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0013_partition_conversations_by_month'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='dietfoodstat',
+            name='dietfoodstat_diet_food_uniq',
+        ),
+        migrations.RemoveIndex(
+            model_name='dietfoodstat',
+            name='dietfoodstat_diet_count_idx',
+        ),
+        migrations.AddField(
+            model_name='dietfoodstat',
+            name='kind',
+            field=models.CharField(default='favorite', max_length=16),
+        ),
+        migrations.AddIndex(
+            model_name='dietfoodstat',
+            index=models.Index(fields=['diet', 'kind', '-count'], name='dietfoodstat_kind_count_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dietfoodstat',
+            constraint=models.UniqueConstraint(fields=('diet', 'kind', 'food'), name='dietfoodstat_diet_kind_food_uniq'),
+        ),
+        migrations.RunPython(backfill_ordered, drop_ordered),
+    ]
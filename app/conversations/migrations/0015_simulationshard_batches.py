@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversations', '0014_dietfoodstat_kind'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='simulationshard',
+            name='batches',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
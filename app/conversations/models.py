@@ -1,6 +1,17 @@
+import uuid
+
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.db import models
+from django.utils import timezone
+
+from .constants import SEARCH_CONFIG
 
 
+# Range partitioned by month on created_at (migration 0013, see partitions.py), with the
+# primary key (id, created_at). A unique (run, run_index) would need created_at as well,
+# so persistence.write_batch enforces it under a lock on the run instead.
 class Conversation(models.Model):
     DIET_CHOICES = [
         ("omnivore", "Omnivore"),
@@ -8,7 +19,7 @@ class Conversation(models.Model):
         ("vegan", "Vegan"),
     ]
 
-    created_at = models.DateTimeField(auto_now_add=True)  # Creation timestamp
+    created_at = models.DateTimeField(auto_now_add=True)  # Creation timestamp, partition key
     customer_label = models.CharField(max_length=64)  # Stable label per sim
     diet = models.CharField(
         max_length=16,
@@ -17,11 +28,108 @@ class Conversation(models.Model):
     )
     favorite_foods = models.JSONField(default=list)  # Top 3 favorite foods
     ordered_dishes = models.JSONField(default=list)  # Orders in conversation
+    diet_mode = models.CharField(max_length=16, blank=True, default="")  # self/rules/llm
+    llm_calls = models.PositiveIntegerField(default=0)  # Provider calls, cache hits excluded
+    input_tokens = models.PositiveIntegerField(default=0)
+    output_tokens = models.PositiveIntegerField(default=0)
+    llm_ms = models.PositiveIntegerField(default=0)  # Summed LLM call time
+    llm_cost = models.DecimalField(max_digits=12, decimal_places=8, default=0)  # Estimated USD
+    run = models.ForeignKey(
+        "SimulationRun",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="conversations",
+        db_index=False,
+    )  # Producing run, if any; covered by conversation_run_index_idx
+    run_index = models.PositiveIntegerField(null=True, blank=True)  # Position in the run
+    favorites = models.ManyToManyField(
+        "Food",
+        through="FavoriteFood",
+        related_name="favored_in",
+        blank=True,
+    )  # Normalized favorite_foods
+    orders = models.ManyToManyField(
+        "Food",
+        through="OrderedDish",
+        related_name="ordered_in",
+        blank=True,
+    )  # Normalized ordered_dishes
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["diet", "created_at", "id"], name="conversation_diet_created_idx"),
+            models.Index(fields=["created_at", "id"], name="conversation_created_id_idx"),
+            models.Index(fields=["run", "run_index"], name="conversation_run_index_idx"),
+        ]  # Keyset pagination, filtered and unfiltered; a run's saved rows
 
     def __str__(self):
         return f"Conversation {self.id} ({self.diet})"
 
 
+# Canonical food name shared by favorites and orders (see foods.normalize_food).
+class Food(models.Model):
+    name = models.CharField(max_length=255, unique=True)  # Lowercase, stripped
+    search = models.GeneratedField(
+        expression=SearchVector("name", config=SEARCH_CONFIG),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )  # Kept up to date by PostgreSQL on every insert
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=["search"], name="food_search_gin"),
+            GinIndex(fields=["name"], name="food_name_trgm_gin", opclasses=["gin_trgm_ops"]),
+        ]  # Full-text match, then trigram fallback for misspelled names
+
+    def __str__(self):
+        return self.name  # Admin label
+
+
+class FavoriteFood(models.Model):
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, db_index=False, db_constraint=False
+    )  # Covered by the unique constraint; no FK into the partitioned table
+    food = models.ForeignKey(Food, on_delete=models.CASCADE, db_index=False)
+    position = models.PositiveSmallIntegerField()  # 1-based order in favorite_foods
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["conversation", "food"], name="favoritefood_conversation_food_uniq"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["food", "conversation"], name="favoritefood_food_conv_idx"),
+        ]  # Conversations by food
+
+    def __str__(self):
+        return f"{self.conversation_id} likes {self.food_id}"  # Admin label
+
+
+class OrderedDish(models.Model):
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, db_index=False, db_constraint=False
+    )  # Covered by the unique constraint; no FK into the partitioned table
+    food = models.ForeignKey(Food, on_delete=models.CASCADE, db_index=False)
+    position = models.PositiveSmallIntegerField()  # 1-based order in ordered_dishes
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["conversation", "food"], name="ordereddish_conversation_food_uniq"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["food", "conversation"], name="ordereddish_food_conv_idx"),
+        ]  # Conversations by food
+
+    def __str__(self):
+        return f"{self.conversation_id} ordered {self.food_id}"  # Admin label
+
+
+# Partitioned like Conversation, on the conversation's created_at, so a transcript always
+# lives in the same month partition as its conversation.
 class Message(models.Model):
     ROLE_CHOICES = [
         ("waiter", "Waiter"),
@@ -32,15 +140,214 @@ class Message(models.Model):
         Conversation,
         on_delete=models.CASCADE,
         related_name="messages",
-    )  # Parent conversation
+        db_index=False,
+        db_constraint=False,
+    )  # Parent conversation; no FK into the partitioned table, Django cascades deletes
     role = models.CharField(max_length=16, choices=ROLE_CHOICES)  # Speaker role
     content = models.TextField()  # Raw message text
     turn_index = models.PositiveIntegerField()  # Order in conversation
-    created_at = models.DateTimeField(auto_now_add=True)  # Creation timestamp
+    created_at = models.DateTimeField(default=timezone.now)  # The conversation's, partition key
+    search = models.GeneratedField(
+        expression=SearchVector("content", config=SEARCH_CONFIG),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )  # Kept up to date by PostgreSQL, bulk inserts included
 
     class Meta:
         ordering = ["turn_index"]  # Stable transcript order
-        unique_together = ("conversation", "turn_index")  # Prevent duplicates
+        constraints = [
+            models.UniqueConstraint(
+                fields=["conversation", "turn_index", "created_at"],
+                name="message_conversation_turn_uniq",
+            ),
+        ]  # Prevent duplicates; created_at is the same for a whole transcript
+        indexes = [GinIndex(fields=["search"], name="message_search_gin")]  # Transcript search
 
     def __str__(self):
         return f"{self.conversation_id}:{self.turn_index} ({self.role})"  # Admin label
+
+
+class SimulationJob(models.Model):
+    STATUS_CHOICES = [
+        ("queued", "Queued"),
+        ("running", "Running"),
+        ("succeeded", "Succeeded"),
+        ("failed", "Failed"),
+    ]  # Job lifecycle
+
+    created_at = models.DateTimeField(auto_now_add=True)  # Enqueue timestamp
+    started_at = models.DateTimeField(null=True, blank=True)  # Claimed by a worker
+    finished_at = models.DateTimeField(null=True, blank=True)  # Worker done
+    requested_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="simulation_jobs",
+    )  # Who queued the run
+    count = models.PositiveIntegerField()  # Conversations requested
+    diet_mode = models.CharField(max_length=16, default="self")  # Diet source
+    status = models.CharField(
+        max_length=16,
+        choices=STATUS_CHOICES,
+        default="queued",
+    )
+    completed = models.PositiveIntegerField(default=0)  # Conversations saved
+    failed = models.PositiveIntegerField(default=0)  # Conversations lost
+    errors = models.JSONField(default=list, blank=True)  # Latest failure messages
+    error = models.TextField(blank=True)  # Fatal worker error
+    run = models.OneToOneField(
+        "SimulationRun",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="job",
+    )  # Run the job writes through, set when first claimed
+
+    class Meta:
+        ordering = ["-created_at"]  # Newest jobs first
+        indexes = [
+            models.Index(fields=["status", "created_at"], name="simjob_status_created_idx"),
+        ]  # Fast queue polling
+
+    def __str__(self):
+        return f"SimulationJob {self.id} ({self.status})"  # Admin label
+
+
+# One simulate_conversations run, split into shards that processes or hosts run independently.
+class SimulationRun(models.Model):
+    key = models.CharField(max_length=32, unique=True)  # Shared by every shard; prefixes labels
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)  # Set when the last shard ends
+    count = models.PositiveIntegerField()  # Conversations over all shards
+    diet_mode = models.CharField(max_length=16, default="self")  # Diet source
+    shard_count = models.PositiveIntegerField(default=1)
+    model = models.CharField(max_length=64, blank=True)  # OPENAI_MODEL at creation
+    seed = models.PositiveBigIntegerField(default=0)  # Drives per-conversation diet choices
+
+    class Meta:
+        ordering = ["-created_at"]  # Newest runs first
+
+    def __str__(self):
+        return f"SimulationRun {self.key} ({self.count} x {self.diet_mode})"  # Admin label
+
+
+class SimulationShard(models.Model):
+    STATUS_CHOICES = SimulationJob.STATUS_CHOICES  # Same lifecycle as queued jobs
+
+    run = models.ForeignKey(
+        SimulationRun,
+        on_delete=models.CASCADE,
+        related_name="shards",
+    )  # Parent run
+    index = models.PositiveIntegerField()  # Zero-based shard number
+    first_index = models.PositiveIntegerField()  # First conversation of the run it covers
+    count = models.PositiveIntegerField()  # Conversations assigned
+    status = models.CharField(
+        max_length=16,
+        choices=STATUS_CHOICES,
+        default="queued",
+    )
+    host = models.CharField(max_length=255, blank=True)  # hostname:pid that claimed it
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    completed = models.PositiveIntegerField(default=0)  # Conversations saved
+    failed = models.PositiveIntegerField(default=0)  # Conversations lost
+    errors = models.JSONField(default=list, blank=True)  # Latest failure messages
+    error = models.TextField(blank=True)  # Fatal shard error
+    llm_calls = models.PositiveIntegerField(default=0)
+    input_tokens = models.PositiveBigIntegerField(default=0)
+    output_tokens = models.PositiveBigIntegerField(default=0)
+    llm_cost = models.DecimalField(max_digits=14, decimal_places=8, default=0)  # Estimated USD
+    batches = models.JSONField(default=dict, blank=True)  # Batch API ids by name, for resuming
+
+    class Meta:
+        ordering = ["run", "index"]
+        unique_together = ("run", "index")
+
+    def __str__(self):
+        return f"{self.run_id}:{self.index} ({self.status})"  # Admin label
+
+
+class LLMCacheEntry(models.Model):
+    key = models.CharField(max_length=64, primary_key=True)  # sha256 of the request
+    value = models.JSONField()  # Text or structured output
+    created_at = models.DateTimeField(auto_now_add=True)  # First stored
+    expires_at = models.DateTimeField(db_index=True)  # TTL boundary, used for eviction
+
+    def __str__(self):
+        return f"LLMCacheEntry {self.key[:12]}"  # Admin label
+
+
+class DietStat(models.Model):
+    diet = models.CharField(max_length=16, unique=True)  # Diet bucket
+    conversation_count = models.PositiveBigIntegerField(default=0)  # Conversations per diet
+    version = models.PositiveBigIntegerField(default=0)  # Bumped by every stats change
+    updated_at = models.DateTimeField(auto_now=True)  # Last stats change
+
+    def __str__(self):
+        return f"{self.diet}: {self.conversation_count}"  # Admin label
+
+
+class DietFoodStat(models.Model):
+    diet = models.CharField(max_length=16)  # Diet bucket
+    kind = models.CharField(max_length=16, default="favorite")  # "favorite" or "ordered"
+    food = models.CharField(max_length=255)  # Normalized food name
+    count = models.PositiveBigIntegerField(default=0)  # Conversations per diet and kind
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["diet", "kind", "food"], name="dietfoodstat_diet_kind_food_uniq"
+            ),
+        ]  # Upsert target
+        indexes = [
+            models.Index(fields=["diet", "kind", "-count"], name="dietfoodstat_kind_count_idx"),
+        ]  # Top-N per diet and kind
+
+    def __str__(self):
+        return f"{self.diet}/{self.kind}/{self.food}: {self.count}"  # Admin label
+
+
+class ChatSession(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)  # Client handle
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="chat_sessions",
+    )  # Owner
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    turn_count = models.PositiveIntegerField(default=0)  # Messages stored so far
+    summary = models.TextField(blank=True)  # Rolling summary of turns before the window
+    summarized_through = models.PositiveIntegerField(default=0)  # Last turn_index in summary
+    last_response_id = models.CharField(max_length=128, blank=True)  # Provider chain head
+    context_tokens = models.PositiveIntegerField(default=0)  # Prompt size behind the chain head
+
+    def __str__(self):
+        return f"ChatSession {self.id} ({self.turn_count} messages)"  # Admin label
+
+
+class ChatMessage(models.Model):
+    ROLE_CHOICES = [
+        ("user", "User"),
+        ("assistant", "Assistant"),
+    ]  # Speaker roles
+
+    session = models.ForeignKey(
+        ChatSession,
+        on_delete=models.CASCADE,
+        related_name="messages",
+    )  # Parent session
+    role = models.CharField(max_length=16, choices=ROLE_CHOICES)
+    content = models.TextField()
+    turn_index = models.PositiveIntegerField()  # Order in session
+    tokens = models.PositiveIntegerField(default=0)  # Estimated prompt cost
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["turn_index"]  # Stable transcript order
+        unique_together = ("session", "turn_index")  # Also the window lookup index
+
+    def __str__(self):
+        return f"{self.session_id}:{self.turn_index} ({self.role})"  # Admin label
@@ -0,0 +1,54 @@
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+
+
+# Encode a row position on the (created_at, id) key as an opaque URL-safe cursor.
+def encode_cursor(created_at: datetime, pk: int) -> str:
+    raw = f"{created_at.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+# Decode a cursor back into (created_at, id); raises ValueError when malformed.
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, pk = base64.urlsafe_b64decode(padded).decode("utf-8").split("|")
+        return datetime.fromisoformat(created_at), int(pk)
+    except (ValueError, UnicodeDecodeError) as exc:
+        raise ValueError("Invalid cursor") from exc
+
+
+# Newest-first keyset page: rows strictly after the cursor position.
+def newest_first(queryset, cursor: tuple[datetime, int] | None = None):
+    if cursor is not None:
+        created_at, pk = cursor
+        queryset = queryset.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+        )  # Seek past the last row the client saw
+    return queryset.order_by("-created_at", "-id")
+
+
+# Encode a position on a (rank, id) key, for relevance-ordered results.
+def encode_rank_cursor(rank: float, pk: int) -> str:
+    raw = f"{rank!r}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_rank_cursor(cursor: str) -> tuple[float, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        rank, pk = base64.urlsafe_b64decode(padded).decode("utf-8").split("|")
+        return float(rank), int(pk)
+    except (ValueError, UnicodeDecodeError) as exc:
+        raise ValueError("Invalid cursor") from exc
+
+
+# Best-first keyset page over rows annotated with `rank`, ties broken by `key` descending.
+# Works on aggregated ranks too (the seek becomes a HAVING clause).
+def best_first(queryset, cursor: tuple[float, int] | None = None, key: str = "id"):
+    if cursor is not None:
+        rank, pk = cursor
+        queryset = queryset.filter(Q(rank__lt=rank) | Q(rank=rank, **{f"{key}__lt": pk}))
+    return queryset.order_by("-rank", f"-{key}")
@@ -0,0 +1,140 @@
+import gzip
+import os
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .constants import PARTITION_MONTHS_AHEAD
+from .models import Conversation, FavoriteFood, Message, OrderedDish
+
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "")  # Dumps of archived months; default BASE_DIR
+PARTITIONED_MODELS = [Conversation, Message]  # Range partitioned by month on created_at
+LINK_MODELS = [FavoriteFood, OrderedDish]  # Unpartitioned, archived with their conversation
+
+_ensured_month = None  # Month whose partitions this process has already checked
+
+
+def archive_dir() -> Path:
+    return Path(ARCHIVE_DIR) if ARCHIVE_DIR else settings.BASE_DIR / "archive"
+
+
+# First instant of the UTC month containing `value`; partition bounds fall on these.
+def month_start(value: datetime) -> datetime:
+    return value.astimezone(dt_timezone.utc).replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0
+    )
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+# Partition of `table` holding the month, e.g. conversations_message_p202610.
+def partition_name(table: str, month: datetime) -> str:
+    return f"{table}_p{month:%Y%m}"
+
+
+# Attached monthly partitions of a table as {month start: partition name}, oldest first.
+def list_partitions(table: str) -> dict[datetime, str]:
+    prefix = f"{table}_p"
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass",
+            [table],
+        )
+        names = sorted(name for (name,) in cursor.fetchall())
+    return {
+        datetime.strptime(name[len(prefix):], "%Y%m").replace(tzinfo=dt_timezone.utc): name
+        for name in names
+        if name.startswith(prefix) and name[len(prefix):].isdigit()
+    }
+
+
+# Create the partitions of the current month and the next `months_ahead` where missing.
+# There is no default partition (it would stop PostgreSQL from scanning partitions in
+# order), so a row for a month without a partition fails to insert. Returns created names.
+def ensure_partitions(
+    months_ahead: int = PARTITION_MONTHS_AHEAD, now: datetime | None = None
+) -> list[str]:
+    first = month_start(now or timezone.now())
+    created = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Writers of several processes may get here at once; one creates, the others see it
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", ["conversation_partitions"])
+        for model in PARTITIONED_MODELS:
+            table = model._meta.db_table
+            existing = list_partitions(table)
+            for offset in range(months_ahead + 1):
+                month = add_months(first, offset)
+                if month in existing:
+                    continue
+                name = partition_name(table, month)
+                cursor.execute(
+                    f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)",
+                    [month, add_months(month, 1)],
+                )
+                created.append(name)
+    return created
+
+
+# Make sure this month's partitions exist before writing; checked once a month per process.
+def ensure_current_partitions() -> None:
+    global _ensured_month
+    month = month_start(timezone.now())
+    if month != _ensured_month:
+        ensure_partitions(now=month)
+        _ensured_month = month
+
+
+# Stored columns of a model (generated ones are left out), as a COPY column list.
+def _stored_columns(model) -> str:
+    return ", ".join(field.column for field in model._meta.concrete_fields if not field.generated)
+
+
+# Dump one month of conversations, transcripts and food links to gzipped CSV files in
+# `directory`/YYYY-MM, delete the links and detach the month's partitions (dropped unless
+# `drop` is false). Everything happens in one transaction. The files only get their final
+# names once it has committed. Returns the rows dumped per table.
+def archive_month(month: datetime, directory: Path, drop: bool = True) -> dict[str, int]:
+    conversations = partition_name(Conversation._meta.db_table, month)
+    messages = partition_name(Message._meta.db_table, month)
+    queries = {
+        Conversation._meta.db_table: f"SELECT {_stored_columns(Conversation)} FROM {conversations}",
+        Message._meta.db_table: f"SELECT {_stored_columns(Message)} FROM {messages}",
+    }
+    for model in LINK_MODELS:
+        queries[model._meta.db_table] = (
+            f"SELECT {_stored_columns(model)} FROM {model._meta.db_table} "
+            f"WHERE conversation_id IN (SELECT id FROM {conversations})"
+        )
+    folder = Path(directory) / f"{month:%Y-%m}"
+    folder.mkdir(parents=True, exist_ok=True)
+    rows = {}
+    written = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Reclassification may still update old rows; keep the month still while dumping
+        cursor.execute(f"LOCK TABLE {conversations}, {messages} IN SHARE MODE")
+        for table, query in queries.items():
+            path = folder / f"{table}.csv.gz"
+            partial = folder / f"{table}.csv.gz.partial"
+            with gzip.open(partial, "wb") as out:
+                cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", out)
+            rows[table] = cursor.rowcount
+            written.append((partial, path))
+        for model in LINK_MODELS:
+            cursor.execute(
+                f"DELETE FROM {model._meta.db_table} "
+                f"WHERE conversation_id IN (SELECT id FROM {conversations})"
+            )
+        for model, partition in [(Conversation, conversations), (Message, messages)]:
+            cursor.execute(f"ALTER TABLE {model._meta.db_table} DETACH PARTITION {partition}")
+            if drop:
+                cursor.execute(f"DROP TABLE {partition}")
+    for partial, path in written:
+        partial.replace(path)
+    return rows
@@ -0,0 +1,105 @@
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.db import transaction
+
+from .aggregates import record_conversations
+from .constants import RUN_CLOCK_SKEW_HOURS
+from .foods import link_foods
+from .models import Conversation, Message, SimulationRun
+from .partitions import ensure_current_partitions
+
+
+# Finished conversation waiting in the buffer for the next batch write.
+@dataclass
+class PendingConversation:
+    index: int  # Position in the run, used for progress reporting
+    customer_label: str
+    convo: object  # simulation.SimulatedConversation
+
+
+# Collect finished conversations in memory and hand them out in batches.
+# Failed conversations are simply never added, so they cannot spoil a batch.
+class ConversationBuffer:
+    def __init__(self, batch_size: int):
+        self.batch_size = max(batch_size, 1)
+        self._pending = []
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    # Add a conversation; returns a full batch to write, or None.
+    def add(self, index: int, customer_label: str, convo) -> list[PendingConversation] | None:
+        self._pending.append(PendingConversation(index, customer_label, convo))
+        if len(self._pending) >= self.batch_size:
+            return self.drain()
+        return None
+
+    # Take everything buffered so far.
+    def drain(self) -> list[PendingConversation]:
+        batch, self._pending = self._pending, []
+        return batch
+
+
+# Conversations of a run. None are older than the run (less some clock skew between
+# hosts), so the month partitions before it are pruned from the lookup.
+def run_conversations(run: SimulationRun):
+    return Conversation.objects.filter(
+        run=run, created_at__gte=run.created_at - timedelta(hours=RUN_CLOCK_SKEW_HOURS)
+    )
+
+
+# Persist a batch of conversations, their transcripts, food links and the diet stats
+# in one transaction.
+# With a run, (run, index) is the idempotency key: conversations it already saved are skipped.
+# The partitioned table cannot enforce it, so writers of one run take turns on the run row.
+def write_batch(batch: list[PendingConversation], run_id: int | None = None) -> list[Conversation]:
+    if not batch:
+        return []
+    ensure_current_partitions()  # Outside the transaction: creating a partition locks the table
+    with transaction.atomic():
+        if run_id is not None:
+            run = SimulationRun.objects.select_for_update().get(pk=run_id)
+            saved = set(
+                run_conversations(run)
+                .filter(run_index__in=[item.index for item in batch])
+                .values_list("run_index", flat=True)
+            )  # Written by an earlier attempt of the run
+            batch = [item for item in batch if item.index not in saved]
+            if not batch:
+                return []
+        conversations = Conversation.objects.bulk_create(
+            [
+                Conversation(
+                    customer_label=item.customer_label,
+                    diet=item.convo.diet,
+                    favorite_foods=item.convo.favorite_foods,
+                    ordered_dishes=item.convo.ordered_dishes,
+                    diet_mode=item.convo.diet_mode,
+                    llm_calls=item.convo.usage.calls,
+                    input_tokens=item.convo.usage.input_tokens,
+                    output_tokens=item.convo.usage.output_tokens,
+                    llm_ms=round(item.convo.usage.llm_ms),
+                    llm_cost=item.convo.usage.cost,
+                    run_id=run_id,
+                    run_index=item.index if run_id is not None else None,
+                )
+                for item in batch
+            ]
+        )  # PKs come back from PostgreSQL
+        Message.objects.bulk_create(
+            [
+                Message(
+                    conversation=conv,
+                    role=role,
+                    content=content,
+                    turn_index=turn,
+                    created_at=conv.created_at,  # Same month partition as the conversation
+                )
+                for conv, item in zip(conversations, batch)
+                for turn, (role, content) in enumerate(item.convo.transcript, start=1)
+            ]
+        )
+        link_foods(conversations)  # Normalized favorites and orders
+        record_conversations(conversations)  # Keep dashboard aggregates current
+    return conversations
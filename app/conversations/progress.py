@@ -0,0 +1,49 @@
+import threading
+
+from django.db import connection
+
+from .constants import JOB_ERRORS_KEPT, JOB_PROGRESS_INTERVAL
+from .models import SimulationJob, SimulationShard
+
+
+# Periodically copy in-memory progress to a job (or run shard) row from a side thread.
+# The simulation reports progress from both sync and async code, so DB writes live here.
+class ProgressWriter(threading.Thread):
+    def __init__(self, job: SimulationJob | SimulationShard):
+        super().__init__(daemon=True)
+        self.rows = type(job).objects.filter(pk=job.pk)
+        self.completed = job.completed  # Resumed shards start from what is already saved
+        self.failed = job.failed
+        self.errors = list(job.errors)
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def record(self, index, error):
+        with self._lock:
+            if error is None:
+                self.completed += 1
+            else:
+                self.failed += 1
+                self.errors = (self.errors + [f"#{index + 1}: {error}"])[-JOB_ERRORS_KEPT:]
+
+    def snapshot(self) -> dict[str, object]:
+        with self._lock:
+            return {
+                "completed": self.completed,
+                "failed": self.failed,
+                "errors": list(self.errors),
+            }
+
+    def write(self):
+        self.rows.update(**self.snapshot())
+
+    def run(self):
+        try:
+            while not self._done.wait(JOB_PROGRESS_INTERVAL):
+                self.write()
+        finally:
+            connection.close()  # Thread owns its own DB connection
+
+    def stop(self):
+        self._done.set()
+        self.join()
@@ -0,0 +1,202 @@
+from dataclasses import dataclass
+
+# --- Diet Rules -------------------------------------------------------
+
+DIET_RULES = {
+    "vegan": "no meat, fish, dairy, eggs or honey",
+    "vegetarian": "no meat or fish, dairy and eggs allowed",
+    "omnivore": "any foods",
+}  # The one source of diet rules for every prompt
+
+DIET_RULES_TEXT = "Diet rules: " + "; ".join(
+    f"{diet} = {rule}" for diet, rule in DIET_RULES.items()
+) + "."  # Rendered once, so every prompt carries byte-identical rules
+
+# --- Prompt Instructions ----------------------------------------------
+
+WAITER_INSTRUCTIONS = (
+    "You are a restaurant waiter. Be friendly and concise. "
+    "Only write the waiter line, no role labels. "
+    "Only greet once at the start, do not greet again."
+)
+
+CUSTOMER_INSTRUCTIONS = (
+    "You are a restaurant customer. Be brief and natural. "
+    "Follow the request and stay in character."
+)
+
+DIET_CLASSIFIER_INSTRUCTIONS = (
+    "You are the waiter. Classify customers' diets from the foods they like and order. "
+    f"{DIET_RULES_TEXT} Return JSON only."
+)
+
+BOT_INSTRUCTIONS = (
+    "You are a polite restaurant waiter. "
+    "Ask the user what their top 3 favorite foods are. "
+    "Keep it as an open question with an open answer."
+)
+
+CHAT_SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a chat between a restaurant waiter and a guest. "
+    "Merge the new turns into the existing summary. Keep names, preferences, dietary needs, "
+    "foods mentioned and open questions. At most 120 words, plain text, no preamble."
+)
+
+# --- Schemas ----------------------------------------------------------
+
+FAVORITES_SCHEMA = {
+    "type": "object",
+    "additionalProperties": False,
+    "properties": {
+        "message": {"type": "string"},
+        "diet": {"type": "string", "enum": ["omnivore", "vegetarian", "vegan"]},
+        "favorite_foods": {
+            "type": "array",
+            "items": {"type": "string"},
+            "minItems": 3,
+            "maxItems": 3,
+        },
+    },
+    "required": ["message", "diet", "favorite_foods"],
+}  # Favorites payload
+
+ORDER_SCHEMA = {
+    "type": "object",
+    "additionalProperties": False,
+    "properties": {
+        "message": {"type": "string"},
+        "ordered_dishes": {
+            "type": "array",
+            "items": {"type": "string"},
+            "minItems": 1,
+        },
+    },
+    "required": ["message", "ordered_dishes"],
+}  # Order payload
+
+DIET_CLASSIFY_SCHEMA = {
+    "type": "object",
+    "additionalProperties": False,
+    "properties": {
+        "diet": {"type": "string", "enum": ["omnivore", "vegetarian", "vegan"]},
+        "reason": {"type": "string"},
+    },
+    "required": ["diet", "reason"],
+}  # Diet classifier payload
+
+DIET_BATCH_SCHEMA = {
+    "type": "object",
+    "additionalProperties": False,
+    "properties": {
+        "results": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "additionalProperties": False,
+                "properties": {
+                    "id": {"type": "string"},
+                    "diet": {"type": "string", "enum": ["omnivore", "vegetarian", "vegan"]},
+                    "reason": {"type": "string"},
+                },
+                "required": ["id", "diet", "reason"],
+            },
+        },
+    },
+    "required": ["results"],
+}  # Batch diet classifier payload
+
+
+# --- Templates --------------------------------------------------------
+
+# A prompt laid out stable part first: the instructions, then the fixed task text, then
+# the per-call values. Everything before the values is byte-identical from call to call,
+# so the provider can serve that prefix from its prompt cache. It only caches prompts of
+# 1024 tokens or more; the largest stable prefix here (customer_fav with its schema) is
+# about 190 tokens, so the layout pays off only once prompts grow (menus, personas).
+# Padding them up to the minimum would cost more input tokens than the discount saves.
+@dataclass(frozen=True)
+class PromptTemplate:
+    site: str  # Call site label in the metrics
+    instructions: str
+    task: str = ""  # Fixed request text, first in the input
+    suffix: str = ""  # str.format template of the per-call part, last in the input
+    schema: dict[str, object] | None = None  # Structured output when set
+    schema_name: str = ""
+
+    def render(self, **values) -> str:
+        parts = [self.task, self.suffix.format(**values) if self.suffix else ""]
+        return "\n\n".join(part for part in parts if part)
+
+
+PROMPTS = {
+    template.site: template
+    for template in [
+        PromptTemplate(
+            "waiter_greet",
+            WAITER_INSTRUCTIONS,
+            "Greet the customer and ask if they had a good day. "
+            "Do not ask about order, food or drink.",
+        ),
+        PromptTemplate(
+            "customer_day",
+            CUSTOMER_INSTRUCTIONS,
+            "Reply briefly about your day. Do not order or mention food or drinks. "
+            "Do not ask questions.",
+            "Waiter said: {waiter}",
+        ),
+        PromptTemplate(
+            "waiter_ask_fav",
+            WAITER_INSTRUCTIONS,
+            "Ask the customer for their top 3 favorite foods. Do not greet or use salutations.",
+        ),
+        PromptTemplate(
+            "customer_fav",
+            CUSTOMER_INSTRUCTIONS,
+            "Return 3 favorite foods that strictly match your diet. "
+            "Set the JSON diet field to exactly your diet. "
+            "Do not mention your diet or the words vegan/vegetarian/omnivore in the message. "
+            f"{DIET_RULES_TEXT} Return JSON only.",
+            "Your diet is {diet}.\nWaiter asked: {waiter}",
+            FAVORITES_SCHEMA,
+            "favorite_foods",
+        ),
+        PromptTemplate(
+            "waiter_ask_order",
+            WAITER_INSTRUCTIONS,
+            "Ask what dishes the customer wants to order today. Do not greet or use salutations.",
+        ),
+        PromptTemplate(
+            "customer_order",
+            CUSTOMER_INSTRUCTIONS,
+            "Order dishes that strictly match the diet you told the waiter about. "
+            f"{DIET_RULES_TEXT} Return JSON only.",
+            "Your diet is {diet}.\nWaiter asked: {waiter}",
+            ORDER_SCHEMA,
+            "order",
+        ),
+        PromptTemplate(
+            "diet_classification",
+            DIET_CLASSIFIER_INSTRUCTIONS,
+            "Classify the diet of this customer.",
+            "Favorite foods: {favorite_foods}\nOrdered dishes: {ordered_dishes}",
+            DIET_CLASSIFY_SCHEMA,
+            "diet_classification",
+        ),
+        PromptTemplate(
+            "diet_batch_classification",
+            DIET_CLASSIFIER_INSTRUCTIONS,
+            "Classify the diet of each customer. "
+            "Return one result per customer with the same id.\n"
+            "Customers, one JSON object per line:",
+            "{customers}",
+            DIET_BATCH_SCHEMA,
+            "diet_batch_classification",
+        ),
+        PromptTemplate("chat", BOT_INSTRUCTIONS),
+        PromptTemplate(
+            "chat_summary",
+            CHAT_SUMMARY_INSTRUCTIONS,
+            suffix="Existing summary:\n{summary}\n\nNew turns:\n{transcript}",
+        ),
+    ]
+}  # Every prompt the app sends, by call site
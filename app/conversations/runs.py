@@ -0,0 +1,240 @@
+import os
+import secrets
+import socket
+
+from django.db import close_old_connections, connections, transaction
+from django.db.models import Max, Min, Sum
+from django.utils import timezone
+
+from .constants import SIMULATION_BATCH_SIZE
+from .llm import DEFAULT_MODEL
+from .models import SimulationRun, SimulationShard
+from .persistence import run_conversations
+from .progress import ProgressWriter
+from .simulation import SimulationStats, run_simulations, run_simulations_batch
+
+
+# Random run key; conversation labels are prefixed with it so runs never collide.
+def new_run_key() -> str:
+    return secrets.token_hex(4)
+
+
+# Conversations [first, first + size) of a `count` run belong to shard `index`.
+def shard_range(count: int, shard_count: int, index: int) -> tuple[int, int]:
+    base, extra = divmod(count, shard_count)
+    return index * base + min(index, extra), base + (index < extra)
+
+
+# Random seed for runs started without one; stored so the run can be reproduced.
+def new_run_seed() -> int:
+    return secrets.randbits(32)
+
+
+# Create a run and its shards, or join the run with the same key (other hosts).
+# Joining with different parameters raises ValueError instead of mixing two runs.
+def open_run(
+    key: str, count: int, diet_mode: str, shard_count: int, seed: int | None = None
+) -> SimulationRun:
+    with transaction.atomic():
+        run, created = SimulationRun.objects.get_or_create(
+            key=key,
+            defaults={
+                "count": count,
+                "diet_mode": diet_mode,
+                "shard_count": shard_count,
+                "model": DEFAULT_MODEL,
+                "seed": new_run_seed() if seed is None else seed,
+            },
+        )
+        if created:
+            shards = []
+            for index in range(shard_count):
+                first, size = shard_range(count, shard_count, index)
+                shards.append(
+                    SimulationShard(run=run, index=index, first_index=first, count=size)
+                )
+            SimulationShard.objects.bulk_create(shards)
+    if (run.count, run.diet_mode, run.shard_count) != (count, diet_mode, shard_count) or (
+        seed is not None and seed != run.seed
+    ):
+        raise ValueError(
+            f"run {key} was started with count={run.count}, diet_mode={run.diet_mode}, "
+            f"{run.shard_count} shards, seed={run.seed}"
+        )
+    return run
+
+
+# Queue the shards of an interrupted run again: those that never finished (their process
+# died, so "running" is reset too) and those that lost conversations. Returns their indices.
+# Conversations the run already saved are skipped when the shards run again.
+def reopen_run(run: SimulationRun, index: int | None = None) -> list[int]:
+    with transaction.atomic():
+        shards = run.shards.select_for_update().exclude(status="succeeded", failed=0)
+        if index is not None:
+            shards = shards.filter(index=index)
+        reopened = list(shards.values_list("index", flat=True))
+        shards.update(status="queued", error="", finished_at=None)
+        if reopened:
+            SimulationRun.objects.filter(pk=run.pk).update(finished_at=None)
+    return reopened
+
+
+# Run indices of the shard's conversations that are already saved.
+def _saved_indices(run: SimulationRun, shard: SimulationShard) -> set[int]:
+    return set(
+        run_conversations(run).filter(
+            run_index__gte=shard.first_index,
+            run_index__lt=shard.first_index + shard.count,
+        ).values_list("run_index", flat=True)
+    )
+
+
+# Label prefix of the run's conversations: <key>_customer_<n>.
+def run_label_prefix(run: SimulationRun) -> str:
+    return f"{run.key}_customer"
+
+
+# Atomically take a queued shard for this process.
+def _claim_shard(run: SimulationRun, index: int) -> SimulationShard:
+    with transaction.atomic():
+        shard = SimulationShard.objects.select_for_update().get(run=run, index=index)
+        if shard.status != "queued":
+            raise ValueError(
+                f"shard {index + 1}/{run.shard_count} of run {run.key} is already "
+                f"{shard.status} ({shard.host})"
+            )
+        shard.status = "running"
+        shard.host = f"{socket.gethostname()}:{os.getpid()}"
+        shard.started_at = timezone.now()
+        shard.save(update_fields=["status", "host", "started_at"])
+    return shard
+
+
+# Simulate one shard of a run in this process; progress is written to the shard row.
+# batch_api (keyword arguments of run_simulations_batch, may be empty) selects batch mode.
+# Submitted batch ids are saved on the shard as they are created, so a shard that is
+# requeued after a crash polls them again instead of paying for the requests twice.
+def run_shard(
+    run: SimulationRun,
+    index: int,
+    concurrency: int = 1,
+    batch_size: int = SIMULATION_BATCH_SIZE,
+    on_progress=None,
+    batch_api: dict[str, object] | None = None,
+) -> tuple[SimulationShard, SimulationStats]:
+    shard = _claim_shard(run, index)
+    saved = _saved_indices(run, shard)
+    shard.completed, shard.failed, shard.errors = len(saved), 0, []  # Counted afresh
+    progress = ProgressWriter(shard)
+    progress.start()
+
+    def record(conversation_index, error):
+        progress.record(conversation_index, error)
+        if on_progress is not None:
+            on_progress(conversation_index, error)
+
+    stats = SimulationStats()
+    options = {
+        "batch_size": batch_size,
+        "on_progress": record,
+        "label_prefix": run_label_prefix(run),
+        "first_index": shard.first_index,
+        "run_id": run.pk,
+        "seed": run.seed,
+        "skip": saved,
+    }
+    def save_batches(name, batch_ids):
+        shard.batches[name] = batch_ids
+        SimulationShard.objects.filter(pk=shard.pk).update(batches=shard.batches)
+
+    try:
+        if batch_api is not None:  # Provider batch interface; options such as on_status
+            options.update(submitted=dict(shard.batches), on_submit=save_batches)
+            stats = run_simulations_batch(shard.count, run.diet_mode, **options, **batch_api)
+        else:
+            stats = run_simulations(
+                shard.count, run.diet_mode, concurrency=concurrency, **options
+            )
+        shard.status = "succeeded"
+        shard.batches = {}  # Answered and saved; a later reopen starts afresh
+    except Exception as exc:
+        shard.status = "failed"
+        shard.error = str(exc)  # Whole shard aborted
+    finally:
+        progress.stop()
+    for key, value in progress.snapshot().items():
+        setattr(shard, key, value)
+    shard.llm_calls += stats.usage.calls  # Spent over every attempt
+    shard.input_tokens += stats.usage.input_tokens
+    shard.output_tokens += stats.usage.output_tokens
+    shard.llm_cost += stats.usage.cost
+    shard.finished_at = timezone.now()
+    close_old_connections()  # Long shards can outlive the connection
+    shard.save(
+        update_fields=[
+            "status",
+            "error",
+            "completed",
+            "failed",
+            "errors",
+            "llm_calls",
+            "input_tokens",
+            "output_tokens",
+            "llm_cost",
+            "batches",
+            "finished_at",
+        ]
+    )
+    finish_run(run)
+    return shard, stats
+
+
+# Entry point of a pool process: run one shard and report its outcome.
+def shard_worker(run_id: int, index: int, concurrency: int, batch_size: int) -> dict[str, object]:
+    try:
+        run = SimulationRun.objects.get(pk=run_id)
+        shard, _ = run_shard(run, index, concurrency=concurrency, batch_size=batch_size)
+        return {
+            "index": index,
+            "status": shard.status,
+            "completed": shard.completed,
+            "failed": shard.failed,
+            "error": shard.error,
+        }
+    finally:
+        connections.close_all()
+
+
+# Mark the run finished once no shard is left; True only for the caller that finished it.
+def finish_run(run: SimulationRun) -> bool:
+    if run.shards.filter(status__in=["queued", "running"]).exists():
+        return False
+    finished = SimulationRun.objects.filter(pk=run.pk, finished_at__isnull=True).update(
+        finished_at=timezone.now()
+    )
+    return bool(finished)
+
+
+# Totals over every shard of the run, for progress and the final report.
+def run_totals(run: SimulationRun) -> dict[str, object]:
+    totals = run.shards.aggregate(
+        completed=Sum("completed"),
+        failed=Sum("failed"),
+        llm_calls=Sum("llm_calls"),
+        input_tokens=Sum("input_tokens"),
+        output_tokens=Sum("output_tokens"),
+        llm_cost=Sum("llm_cost"),
+        started_at=Min("started_at"),
+        finished_at=Max("finished_at"),
+    )
+    for key in ["completed", "failed", "llm_calls", "input_tokens", "output_tokens", "llm_cost"]:
+        totals[key] = totals[key] or 0
+    statuses = list(run.shards.values_list("status", flat=True))
+    totals["shards_done"] = sum(status in {"succeeded", "failed"} for status in statuses)
+    totals["shards_failed"] = statuses.count("failed")
+    totals["elapsed"] = (
+        (totals["finished_at"] - totals["started_at"]).total_seconds()
+        if totals["started_at"] and totals["finished_at"]
+        else 0.0
+    )  # Wall time from the first shard start to the last shard end
+    return totals
@@ -0,0 +1,106 @@
+from django.contrib.postgres.search import (
+    SearchHeadline,
+    SearchQuery,
+    SearchRank,
+    TrigramSimilarity,
+)
+from django.db.models import Case, F, FloatField, Max, Value, When
+from django.db.models.functions import Cast
+
+from .constants import SEARCH_CONFIG, SEARCH_FOOD_MATCHES
+from .foods import LINK_MODELS, normalize_food
+from .models import Food, Message
+from .pagination import best_first
+
+# Parse user input like a web search box: words, "quoted phrases", -excluded, or.
+def search_query(text: str) -> SearchQuery:
+    return SearchQuery(text, config=SEARCH_CONFIG, search_type="websearch")
+
+
+# --- Transcripts ------------------------------------------------------
+
+# Conversations whose transcript matches, ranked by their best matching message.
+# Rows are (conversation_id, rank); the GIN index finds the messages, only those are ranked.
+def rank_transcripts(text: str, role: str | None = None, cursor=None):
+    query = search_query(text)
+    messages = Message.objects.filter(search=query)
+    if role:
+        messages = messages.filter(role=role)
+    ranked = messages.values("conversation_id").annotate(
+        rank=Max(Cast(SearchRank(F("search"), query), FloatField()))
+    )  # ts_rank is a float4; as a double it round-trips through the cursor exactly
+    return best_first(ranked, cursor, key="conversation_id").values_list(
+        "conversation_id", "rank"
+    )
+
+
+# Best matching message of each conversation, with the matched words highlighted.
+# Only called for one page of conversations, so headlines are built for few rows.
+# `created_at` (the conversations' timestamps) limits the lookup to their month partitions.
+def transcript_headlines(
+    text: str,
+    conversation_ids: list[int],
+    role: str | None = None,
+    created_at: set | None = None,
+) -> dict[int, dict[str, object]]:
+    query = search_query(text)
+    messages = Message.objects.filter(conversation_id__in=conversation_ids, search=query)
+    if created_at:
+        messages = messages.filter(created_at__in=created_at)
+    if role:
+        messages = messages.filter(role=role)
+    best = {}
+    for conversation_id, turn_index, message_role, headline in (
+        messages.annotate(
+            rank=SearchRank(F("search"), query),
+            headline=SearchHeadline("content", query, config=SEARCH_CONFIG),
+        )
+        .order_by("conversation_id", "-rank", "turn_index")
+        .values_list("conversation_id", "turn_index", "role", "headline")
+    ):
+        best.setdefault(
+            conversation_id, {"turn_index": turn_index, "role": message_role, "headline": headline}
+        )
+    return best
+
+
+# --- Foods ------------------------------------------------------------
+
+# Foods matching the text as (id, name, score), best first, and how they matched.
+# Full-text on the name finds word matches ("burgers" -> "beef burger"); when nothing
+# matches, trigram similarity through the pg_trgm index catches misspellings ("falafle").
+def match_foods(text: str, limit: int = SEARCH_FOOD_MATCHES) -> tuple[list[tuple], str]:
+    query = search_query(text)
+    foods = list(
+        Food.objects.filter(search=query)
+        .annotate(score=SearchRank(F("search"), query))
+        .order_by("-score", "name")
+        .values_list("id", "name", "score")[:limit]
+    )
+    if foods:
+        return foods, "fulltext"
+    name = normalize_food(text)
+    foods = list(
+        Food.objects.filter(name__trigram_similar=name)
+        .annotate(score=TrigramSimilarity("name", name))
+        .order_by("-score", "name")
+        .values_list("id", "name", "score")[:limit]
+    )
+    return foods, "trigram"
+
+
+# Conversations that list any of the matched foods as a favorite or an order, ranked by
+# their best matching food. Rows are (conversation_id, rank).
+def rank_food_conversations(foods: list[tuple], kind: str = "favorite", cursor=None):
+    score = Case(
+        *[When(food_id=food_id, then=Value(float(score))) for food_id, _, score in foods],
+        output_field=FloatField(),
+    )
+    ranked = (
+        LINK_MODELS[kind].objects.filter(food_id__in=[food_id for food_id, _, _ in foods])
+        .values("conversation_id")
+        .annotate(rank=Max(score))
+    )
+    return best_first(ranked, cursor, key="conversation_id").values_list(
+        "conversation_id", "rank"
+    )
@@ -4,36 +4,147 @@ from .constants import (
     DASHBOARD_LATEST_COUNT,
     DIET_MODES,
     MAX_EXPORT_COUNT,
+    MAX_PAGE_SIZE,
     MAX_RUN_COUNT,
+    PAGE_SIZE,
+    SEARCH_MAX_PAGE_SIZE,
+    SEARCH_PAGE_SIZE,
+    TOP_FOODS_COUNT,
+    TOP_FOODS_MAX_COUNT,
 )
+from .pagination import decode_cursor, decode_rank_cursor
 
 # --- Query Serializers ------------------------------------------------
 
 # Validate query params for latest simulations exports.
+# Buffered exports are capped at MAX_EXPORT_COUNT; streamed exports may omit limit.
 class SimulationsLatestQuerySerializer(serializers.Serializer):
-    limit = serializers.IntegerField(
-        required=False,
-        default=DASHBOARD_LATEST_COUNT,
-        min_value=1,
-        max_value=MAX_EXPORT_COUNT,
-    )
+    limit = serializers.IntegerField(required=False, min_value=1)
     format = serializers.CharField(required=False, default="json")
+    stream = serializers.BooleanField(required=False, default=False)
+    cursor = serializers.CharField(required=False)
 
     def validate_format(self, value: str) -> str:
         normalized = value.lower()  # Normalize export format to lowercase
-        if normalized not in {"json", "csv"}:
-            raise serializers.ValidationError("Format must be json or csv.")
+        if normalized not in {"json", "csv", "ndjson"}:
+            raise serializers.ValidationError("Format must be json, csv or ndjson.")
         return normalized
 
+    def validate_cursor(self, value: str):
+        try:
+            return decode_cursor(value)
+        except ValueError:
+            raise serializers.ValidationError("Invalid cursor.")
+
+    def validate(self, attrs):
+        if attrs["format"] == "ndjson":
+            attrs["stream"] = True  # NDJSON is always streamed
+        limit = attrs.get("limit")
+        if attrs["stream"]:
+            attrs["limit"] = limit  # None exports the full history
+        elif limit is None:
+            attrs["limit"] = DASHBOARD_LATEST_COUNT
+        elif limit > MAX_EXPORT_COUNT:
+            raise serializers.ValidationError(
+                {"limit": f"Ensure this value is less than or equal to {MAX_EXPORT_COUNT} (use stream=1 for more)."}
+            )
+        return attrs
+
+
+# Validate query params for the paginated vegetarian/vegan summary.
+class VegetariansQuerySerializer(serializers.Serializer):
+    limit = serializers.IntegerField(
+        required=False,
+        default=PAGE_SIZE,
+        min_value=1,
+        max_value=MAX_PAGE_SIZE,
+    )
+    cursor = serializers.CharField(required=False)
+    format = serializers.ChoiceField(
+        required=False,
+        choices=["json", "ndjson"],
+        default="json",
+    )
+
+    def validate_cursor(self, value: str):
+        try:
+            return decode_cursor(value)
+        except ValueError:
+            raise serializers.ValidationError("Invalid cursor.")
+
 
-# Validate query params for dashboard counters.
+# Validate query params for the dashboard job notice.
 class DashboardQuerySerializer(serializers.Serializer):
-    ran = serializers.IntegerField(
+    job = serializers.IntegerField(required=False, min_value=1)
+
+
+# Validate query params for the top foods summary.
+class FoodSummaryQuerySerializer(serializers.Serializer):
+    diet = serializers.ChoiceField(
         required=False,
-        default=0,
-        min_value=0,
-        max_value=MAX_RUN_COUNT,
+        choices=["omnivore", "vegetarian", "vegan"],
+    )
+    limit = serializers.IntegerField(
+        required=False,
+        default=TOP_FOODS_COUNT,
+        min_value=1,
+        max_value=TOP_FOODS_MAX_COUNT,
+    )
+    kind = serializers.ChoiceField(
+        required=False,
+        choices=["favorite", "ordered"],
+        default="favorite",
+    )
+
+
+# Validate query params for the conversations-by-food lookup.
+class FoodConversationsQuerySerializer(serializers.Serializer):
+    food = serializers.CharField(max_length=255)
+    kind = serializers.ChoiceField(
+        required=False,
+        choices=["favorite", "ordered"],
+        default="favorite",
+    )
+    limit = serializers.IntegerField(
+        required=False,
+        default=PAGE_SIZE,
+        min_value=1,
+        max_value=MAX_PAGE_SIZE,
     )
+    cursor = serializers.CharField(required=False)
+
+    def validate_cursor(self, value: str):
+        try:
+            return decode_cursor(value)
+        except ValueError:
+            raise serializers.ValidationError("Invalid cursor.")
+
+
+# Validate query params for ranked search over transcripts and foods.
+class SearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=200)
+    scope = serializers.ChoiceField(
+        required=False,
+        choices=["transcript", "favorite", "ordered"],
+        default="transcript",
+    )
+    role = serializers.ChoiceField(
+        required=False,
+        choices=["waiter", "customer"],
+    )  # Transcript scope only
+    limit = serializers.IntegerField(
+        required=False,
+        default=SEARCH_PAGE_SIZE,
+        min_value=1,
+        max_value=SEARCH_MAX_PAGE_SIZE,
+    )
+    cursor = serializers.CharField(required=False)
+
+    def validate_cursor(self, value: str):
+        try:
+            return decode_rank_cursor(value)
+        except ValueError:
+            raise serializers.ValidationError("Invalid cursor.")
 
 
 # --- Payload Serializers ----------------------------------------------
@@ -60,3 +171,4 @@ class ChatbotPayloadSerializer(serializers.Serializer):
         allow_blank=True,
         default="",
     )
+    session = serializers.UUIDField(required=False)  # Omit to start a new chat session
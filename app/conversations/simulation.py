@@ -0,0 +1,572 @@
+import asyncio
+import hashlib
+import json
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable
+
+from asgiref.sync import sync_to_async
+
+from .constants import DIET_BATCH_SIZE, SIMULATION_BATCH_SIZE, SIMULATION_RESUME_ATTEMPTS
+from .diet_llm import classify_diets_llm_batch
+from .diet_rules import classify_diet_rules
+from .llm import (
+    DEFAULT_MODEL,
+    aclose_async_client,
+    agenerate_structured,
+    agenerate_text,
+    get_cache,
+    response_params,
+)
+from .llm_batch import BATCH_POLL_INTERVAL, BATCH_PRICE_FACTOR, run_batch
+from .metrics import UsageTotals, collect_usage, record_llm_result
+from .persistence import ConversationBuffer, write_batch
+from .prompts import PROMPTS
+
+
+# --- Conversation Script ----------------------------------------------
+
+# One LLM request issued by the conversation script.
+@dataclass
+class LLMCall:
+    key: str  # Turn name, e.g. "waiter_greet"
+    user_input: str
+    instructions: str
+    schema: dict[str, object] | None = None  # Structured output when set
+    name: str = ""  # Schema name for structured output
+    cache: bool = True  # False for turns that must vary between conversations
+
+
+# Finished conversation kept in memory until it is persisted.
+@dataclass
+class SimulatedConversation:
+    diet: str
+    favorite_foods: list[str]
+    ordered_dishes: list[str]
+    transcript: list[tuple[str, str]] = field(default_factory=list)  # (role, content)
+    diet_mode: str = ""
+    usage: UsageTotals = field(default_factory=UsageTotals)  # Tokens, time and cost spent
+
+
+# Aggregate counters for a simulation run.
+@dataclass
+class SimulationStats:
+    completed: int = 0
+    failed: int = 0
+    resumed: int = 0  # Interruptions picked up again from the last finished turn
+    elapsed: float = 0.0  # Wall-clock seconds
+    usage: UsageTotals = field(default_factory=UsageTotals)  # Every call of the run
+    timings: dict[str, list] = field(default_factory=dict)  # name -> [count, total seconds]
+
+    @property
+    def conversations_per_second(self) -> float:
+        return self.completed / self.elapsed if self.elapsed else 0.0
+
+    # Calls that reached the provider, retries and errors included; cache hits are not calls.
+    @property
+    def calls(self) -> int:
+        return self.usage.calls
+
+    @property
+    def cache_hits(self) -> int:
+        return self.usage.cache_hits
+
+    @property
+    def calls_per_second(self) -> float:
+        return self.calls / self.elapsed if self.elapsed else 0.0
+
+    def record_timing(self, name: str, seconds: float) -> None:
+        entry = self.timings.setdefault(name, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+    # Mean milliseconds per turn, per stage and per conversation, in recording order.
+    def mean_timings_ms(self) -> dict[str, float]:
+        return {name: total / count * 1000 for name, (count, total) in self.timings.items()}
+
+
+# One conversation turn; its request is built from the results of the turns it depends on.
+@dataclass
+class Turn:
+    key: str
+    role: str  # Speaker in the transcript
+    depends_on: tuple[str, ...]
+    build: Callable[[str, dict[str, object]], LLMCall]  # (self_diet, results) -> request
+
+
+# Request for a turn from its prompt template; the turn key is the template's call site.
+def _prompt_call(site: str, cache: bool = True, **values) -> LLMCall:
+    template = PROMPTS[site]
+    return LLMCall(
+        site,
+        template.render(**values),
+        template.instructions,
+        template.schema,
+        template.schema_name,
+        cache=cache,
+    )
+
+
+def _waiter_greet(self_diet, results):
+    return _prompt_call("waiter_greet")
+
+
+def _customer_day(self_diet, results):
+    return _prompt_call(
+        "customer_day", cache=False, waiter=results["waiter_greet"]
+    )  # Customers must not share replies
+
+
+def _waiter_ask_fav(self_diet, results):
+    return _prompt_call("waiter_ask_fav")
+
+
+def _customer_fav(self_diet, results):
+    return _prompt_call(
+        "customer_fav", cache=False, diet=self_diet, waiter=results["waiter_ask_fav"]
+    )  # Keep favorite foods diverse
+
+
+def _waiter_ask_order(self_diet, results):
+    return _prompt_call("waiter_ask_order")
+
+
+def _customer_order(self_diet, results):
+    return _prompt_call(
+        "customer_order", cache=False, diet=self_diet, waiter=results["waiter_ask_order"]
+    )  # Keep orders diverse
+
+
+# Turns in transcript order. Waiter prompts need no customer output, so the graph is
+# three waiter -> customer chains that can run side by side.
+CONVERSATION_TURNS = [
+    Turn("waiter_greet", "waiter", (), _waiter_greet),
+    Turn("customer_day", "customer", ("waiter_greet",), _customer_day),
+    Turn("waiter_ask_fav", "waiter", (), _waiter_ask_fav),
+    Turn("customer_fav", "customer", ("waiter_ask_fav",), _customer_fav),
+    Turn("waiter_ask_order", "waiter", (), _waiter_ask_order),
+    Turn("customer_order", "customer", ("waiter_ask_order",), _customer_order),
+]
+
+
+# Group turns into stages; every turn in a stage depends only on earlier stages.
+def turn_stages(turns: list[Turn]) -> list[list[Turn]]:
+    done = set()
+    remaining = list(turns)
+    stages = []
+    while remaining:
+        stage = [turn for turn in remaining if set(turn.depends_on) <= done]
+        if not stage:
+            raise ValueError("Conversation turns have a missing or circular dependency")
+        stages.append(stage)
+        done |= {turn.key for turn in stage}
+        remaining = [turn for turn in remaining if turn.key not in done]
+    return stages
+
+
+CONVERSATION_STAGES = turn_stages(CONVERSATION_TURNS)  # Computed once at import
+
+
+# Build the finished conversation from the results of every turn.
+def finish_conversation(
+    self_diet: str, diet_mode: str, results: dict[str, object]
+) -> SimulatedConversation:
+    favorite_foods = [
+        food.strip().lower() for food in results["customer_fav"]["favorite_foods"]
+    ]  # Normalize
+    ordered_dishes = [
+        dish.strip().lower() for dish in results["customer_order"]["ordered_dishes"]
+    ]  # Normalize
+    transcript = []
+    for turn in CONVERSATION_TURNS:
+        result = results[turn.key]
+        transcript.append((turn.role, result["message"] if isinstance(result, dict) else result))
+
+    final_diet = self_diet  # Default diet classification mode: self
+    if diet_mode == "rules":  # Diet classification mode: rules
+        final_diet = classify_diet_rules(favorite_foods, ordered_dishes) or self_diet
+    # Diet classification mode llm runs in batches before each write, see _classify_batch
+
+    return SimulatedConversation(
+        diet=final_diet,
+        favorite_foods=favorite_foods,
+        ordered_dishes=ordered_dishes,
+        transcript=transcript,
+        diet_mode=diet_mode,
+    )
+
+
+# --- Drivers ----------------------------------------------------------
+
+# Execute one scripted call with the async client.
+async def _aexecute(call: LLMCall):
+    if call.schema is None:
+        return await agenerate_text(
+            call.user_input, call.instructions, cache=call.cache, site=call.key
+        )
+    return await agenerate_structured(
+        call.user_input, call.instructions, call.schema, call.name, cache=call.cache, site=call.key
+    )
+
+
+# Time one call under its turn key.
+async def _atimed(call: LLMCall, stats: SimulationStats | None):
+    started = time.perf_counter()
+    result = await _aexecute(call)
+    if stats is not None:
+        stats.record_timing(call.key, time.perf_counter() - started)
+    return result
+
+
+# Run a conversation stage by stage, issuing the calls of each stage concurrently.
+# Each result is stored in `results` under its turn key; pass the dict (and usage) of an
+# interrupted attempt to skip its finished turns and continue after the last successful one.
+async def arun_conversation(
+    self_diet: str,
+    diet_mode: str,
+    results: dict[str, object] | None = None,
+    stats: SimulationStats | None = None,
+    usage: UsageTotals | None = None,
+) -> SimulatedConversation:
+    results = {} if results is None else results
+    with collect_usage(usage) as usage:
+        await _arun_stages(self_diet, results, stats)
+    convo = finish_conversation(self_diet, diet_mode, results)
+    convo.usage = usage
+    return convo
+
+
+async def _arun_stages(self_diet, results, stats):
+    started = time.perf_counter()
+    for number, stage in enumerate(CONVERSATION_STAGES, 1):
+        pending = [turn for turn in stage if turn.key not in results]
+        stage_started = time.perf_counter()
+        outcomes = await asyncio.gather(
+            *(_atimed(turn.build(self_diet, results), stats) for turn in pending),
+            return_exceptions=True,
+        )
+        for turn, outcome in zip(pending, outcomes):
+            if not isinstance(outcome, BaseException):
+                results[turn.key] = outcome  # Keep successes even if a sibling failed
+        for outcome in outcomes:
+            if isinstance(outcome, BaseException):
+                raise outcome
+        if stats is not None and pending:
+            stats.record_timing(f"stage {number}", time.perf_counter() - stage_started)
+    if stats is not None:
+        stats.record_timing("conversation", time.perf_counter() - started)
+
+
+# --- Runners ----------------------------------------------------------
+
+# A conversation still to be finished, with the results of the turns already paid for.
+@dataclass
+class ConversationProgress:
+    index: int
+    self_diet: str
+    results: dict[str, object] = field(default_factory=dict)  # Turn key -> result
+    usage: UsageTotals = field(default_factory=UsageTotals)  # Spent over every attempt
+    interruptions: int = 0
+
+
+# Conversations left to run: fresh ones first, then interrupted ones to resume.
+class _WorkQueue:
+    def __init__(self, indices, seed: int | None = None):
+        self._fresh = iter(indices)
+        self._resume = deque()
+        self._seed = seed
+
+    def next(self) -> ConversationProgress | None:
+        index = next(self._fresh, None)
+        if index is not None:
+            rng = random if self._seed is None else random.Random(f"{self._seed}:{index}")
+            self_diet = rng.choice(["omnivore", "vegetarian", "vegan"])  # Preselect diet
+            return ConversationProgress(index, self_diet)
+        return self._resume.popleft() if self._resume else None
+
+    # Queue an interrupted conversation for another try; False once it is out of tries.
+    def requeue(self, work: ConversationProgress) -> bool:
+        work.interruptions += 1
+        if work.interruptions > SIMULATION_RESUME_ATTEMPTS:
+            return False
+        self._resume.append(work)
+        return True
+
+
+# Resume an interrupted conversation later, or report it failed when out of tries.
+def _interrupted(work, exc, queue, stats, on_progress):
+    if queue.requeue(work):
+        stats.resumed += 1
+        return
+    stats.failed += 1
+    on_progress(work.index, exc)  # Left out of every batch
+
+
+# Classify a batch for diet mode llm with one request per DIET_BATCH_SIZE conversations.
+# Conversations that cannot be classified are dropped as failed.
+def _classify_batch(batch, stats, on_progress):
+    kept = []
+    for start in range(0, len(batch), DIET_BATCH_SIZE):
+        chunk = batch[start:start + DIET_BATCH_SIZE]
+        with collect_usage() as usage:
+            diets, _ = classify_diets_llm_batch(
+                [(item.index, item.convo.favorite_foods, item.convo.ordered_dishes) for item in chunk]
+            )
+        share = usage.share(len(chunk))  # Batched calls are billed to their conversations
+        for item in chunk:
+            diet = diets.get(item.index)
+            if diet is None:
+                stats.failed += 1
+                on_progress(item.index, RuntimeError("diet classification failed"))
+                continue
+            item.convo.diet = diet
+            item.convo.usage.add(share)
+            kept.append(item)
+    return kept
+
+
+# Write one batch; its conversations count as completed only once committed.
+def _flush(batch, diet_mode, stats, on_progress, run_id=None):
+    if diet_mode == "llm":
+        batch = _classify_batch(batch, stats, on_progress)
+    try:
+        write_batch(batch, run_id)
+    except Exception as exc:
+        stats.failed += len(batch)
+        for item in batch:
+            on_progress(item.index, exc)
+        return
+    stats.completed += len(batch)
+    for item in batch:
+        on_progress(item.index, None)
+
+
+# Run the conversations numbered `indices` with at most `concurrency` in flight.
+# Turns inside each conversation fan out as well, one stage at a time.
+async def _run_concurrent(
+    indices, diet_mode, concurrency, batch_size, label_prefix, stats, on_progress, run_id, seed
+):
+    queue = _WorkQueue(indices, seed)  # Shared by the worker tasks on the loop thread
+    buffer = ConversationBuffer(batch_size)
+    flush = sync_to_async(_flush)  # ORM stays on a sync thread
+
+    async def worker():
+        while (work := queue.next()) is not None:
+            try:
+                convo = await arun_conversation(
+                    work.self_diet, diet_mode, work.results, stats, work.usage
+                )
+            except Exception as exc:
+                _interrupted(work, exc, queue, stats, on_progress)
+                continue
+            label = f"{label_prefix}_{work.index + 1}"
+            batch = buffer.add(work.index, label, convo)  # Drained on the loop thread
+            if batch:
+                await flush(batch, diet_mode, stats, on_progress, run_id)
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(min(concurrency, len(indices)))))
+        await flush(buffer.drain(), diet_mode, stats, on_progress, run_id)
+    finally:
+        await aclose_async_client()  # Release the loop-bound pool
+
+
+# Simulate and persist `count` conversations; returns aggregate stats.
+# on_progress(index, error) is called once per conversation, error is None on success.
+# Conversations are numbered from first_index, so shards of one run get distinct labels;
+# indices in `skip` (already saved by the run) are not simulated again. With a seed the
+# preselected diets are reproducible per index, so a resumed run makes the same choices.
+def run_simulations(
+    count: int,
+    diet_mode: str,
+    concurrency: int = 1,
+    batch_size: int = SIMULATION_BATCH_SIZE,
+    on_progress=None,
+    label_prefix: str = "customer",
+    first_index: int = 0,
+    run_id: int | None = None,
+    seed: int | None = None,
+    skip=frozenset(),
+) -> SimulationStats:
+    on_progress = on_progress or (lambda index, error: None)
+    stats = SimulationStats()
+    started = time.perf_counter()
+    with collect_usage(stats.usage):
+        asyncio.run(
+            _run_concurrent(
+                [index for index in range(first_index, first_index + count) if index not in skip],
+                diet_mode,
+                concurrency,
+                batch_size,
+                label_prefix,
+                stats,
+                on_progress,
+                run_id,
+                seed,
+            )
+        )
+    stats.elapsed = time.perf_counter() - started
+    return stats
+
+
+# --- Batch API Runner -------------------------------------------------
+
+# One custom id for every conversation sending the same cacheable prompt.
+# Only used with a response cache configured, where live runs would share the answer too.
+def _shared_id(call: LLMCall) -> str:
+    payload = json.dumps([call.instructions, call.user_input, call.schema, call.name])
+    return f"shared:{call.key}:{hashlib.sha256(payload.encode()).hexdigest()[:16]}"
+
+
+# Result of a scripted call from its batch output, parsed like the live call would be.
+def _batch_value(call: LLMCall, result):
+    if not result.ok:
+        raise RuntimeError(result.error)
+    return result.text.strip() if call.schema is None else json.loads(result.text)
+
+
+# Run one stage for every remaining conversation through the batch interface.
+# Failed requests are resubmitted in a new batch; conversations still failing after
+# SIMULATION_RESUME_ATTEMPTS resubmissions are removed from `works` and reported.
+# Batches already listed in `submitted` under their name are polled, not submitted again.
+def _run_batch_stage(
+    number,
+    stage,
+    works,
+    stats,
+    on_progress,
+    name,
+    backend,
+    poll_interval,
+    on_status,
+    submitted,
+    on_submit,
+):
+    pending = {
+        (index, turn.key): turn.build(work.self_diet, work.results)
+        for index, work in works.items()
+        for turn in stage
+    }
+    errors = {}
+    share = get_cache() is not None  # Caching is opt-in, sharing answers follows it
+    for attempt in range(SIMULATION_RESUME_ATTEMPTS + 1):
+        requests = {}
+        owners = {}  # custom id -> [(conversation index, call)]
+        for (index, key), call in pending.items():
+            custom_id = _shared_id(call) if share and call.cache else f"{index}:{key}"
+            requests[custom_id] = response_params(
+                call.user_input, call.instructions, call.schema, call.name
+            )
+            owners.setdefault(custom_id, []).append((index, call))
+        batch_name = f"{name}-stage{number}-try{attempt + 1}"
+        results = run_batch(
+            requests,
+            batch_name,
+            backend,
+            poll_interval,
+            on_status,
+            submitted=submitted.get(batch_name),
+            on_submit=lambda batch_ids: on_submit(batch_name, batch_ids),
+        )
+        failed = {}
+        for custom_id, result in results.items():
+            owner, call = owners[custom_id][0]
+            error = None if result.ok else RuntimeError(result.error)
+            if custom_id.startswith("shared:"):  # Billed to the run only, like a cache hit
+                record_llm_result(
+                    call.key, DEFAULT_MODEL, result.response, error, BATCH_PRICE_FACTOR
+                )
+            else:
+                with collect_usage(works[owner].usage):  # Billed to its conversation
+                    record_llm_result(
+                        call.key, DEFAULT_MODEL, result.response, error, BATCH_PRICE_FACTOR
+                    )
+            try:
+                value = _batch_value(call, result)
+            except (RuntimeError, ValueError) as exc:
+                for index, owned in owners[custom_id]:
+                    failed[(index, owned.key)] = owned
+                    errors[index] = exc
+                continue
+            for index, owned in owners[custom_id]:
+                works[index].results[owned.key] = value
+        pending = failed
+        if not pending:
+            return
+        if attempt < SIMULATION_RESUME_ATTEMPTS:
+            stats.resumed += len({index for index, _ in pending})
+    for index in sorted({index for index, _ in pending}):
+        del works[index]
+        stats.failed += 1
+        on_progress(index, errors[index])
+
+
+# Simulate and persist conversations through the provider's batch interface instead of
+# live calls: each stage of the turn graph becomes one batch built from the results of the
+# previous stage, so latency is hours at worst, but throughput per quota is far higher
+# and the calls cost half. Cacheable prompts (the waiter turns) are requested once per
+# stage and shared. Parameters mirror run_simulations; on_status(batch_id, status, size)
+# is called on every poll. Diet mode llm classifies each write batch with live calls.
+# on_submit(name, {batch_id: size}) reports every submitted batch; passing those back as
+# `submitted` ({name: {batch_id: size}}) resumes an interrupted run without resubmitting.
+# Requests are rebuilt from the seed and earlier results, so they match the stored batches.
+def run_simulations_batch(
+    count: int,
+    diet_mode: str,
+    batch_size: int = SIMULATION_BATCH_SIZE,
+    on_progress=None,
+    label_prefix: str = "customer",
+    first_index: int = 0,
+    run_id: int | None = None,
+    seed: int | None = None,
+    skip=frozenset(),
+    backend=None,
+    poll_interval: float = BATCH_POLL_INTERVAL,
+    on_status=None,
+    submitted: dict[str, dict[str, int]] | None = None,
+    on_submit=None,
+) -> SimulationStats:
+    on_progress = on_progress or (lambda index, error: None)
+    on_submit = on_submit or (lambda name, batch_ids: None)
+    stats = SimulationStats()
+    started = time.perf_counter()
+    queue = _WorkQueue(
+        [index for index in range(first_index, first_index + count) if index not in skip], seed
+    )
+    works = {}
+    while (work := queue.next()) is not None:
+        works[work.index] = work
+    with collect_usage(stats.usage):
+        for number, stage in enumerate(CONVERSATION_STAGES, 1):
+            stage_started = time.perf_counter()
+            _run_batch_stage(
+                number,
+                stage,
+                works,
+                stats,
+                on_progress,
+                f"{label_prefix}-{first_index + 1}",
+                backend,
+                poll_interval,
+                on_status,
+                submitted or {},
+                on_submit,
+            )
+            stats.record_timing(f"stage {number}", time.perf_counter() - stage_started)
+        buffer = ConversationBuffer(batch_size)
+        for index, work in works.items():
+            try:
+                convo = finish_conversation(work.self_diet, diet_mode, work.results)
+            except (KeyError, TypeError, AttributeError) as exc:  # Output missing fields
+                stats.failed += 1
+                on_progress(index, exc)
+                continue
+            convo.usage = work.usage
+            batch = buffer.add(index, f"{label_prefix}_{index + 1}", convo)
+            if batch:
+                _flush(batch, diet_mode, stats, on_progress, run_id)
+        _flush(buffer.drain(), diet_mode, stats, on_progress, run_id)
+    stats.elapsed = time.perf_counter() - started
+    return stats
@@ -1,3 +1,892 @@
-from django.test import TestCase
+import asyncio
+import dataclasses
+import email.utils
+import hashlib
+import io
+import json
+import string
+import tempfile
+import time
+from decimal import Decimal
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import httpx
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.models import Sum
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from .aggregates import llm_usage_by_mode, rebuild_stats, top_foods
+from .jobs import claim_next_job, enqueue_simulation, requeue_job, run_job
+from .llm import set_backend
+from .llm_batch import LocalBatchBackend
+from .llm_cache import DatabaseCache, FileCache, MemoryCache, cache_key
+from .diet_llm import classify_diets_llm_batch
+from .diet_rules import classify_diet_rules, classify_many
+from .llm_fake import FakeBackend, FakeLLMError
+from .llm_scheduler import (
+    BACKOFF_BASE,
+    BACKOFF_MAX,
+    CircuitBreaker,
+    CircuitOpenError,
+    Scheduler,
+    backoff_delay,
+    estimate_tokens,
+    retry_after,
+)
+from .metrics import UsageTotals
+from .foods import conversations_with_food, food_counts
+from .models import (
+    Conversation,
+    DietStat,
+    FavoriteFood,
+    Food,
+    ChatSession,
+    Message,
+    OrderedDish,
+    SimulationJob,
+)
+from .pagination import decode_cursor, encode_cursor, newest_first
+from .persistence import PendingConversation, write_batch
+from .prompts import DIET_RULES_TEXT, PROMPTS
+from .runs import open_run, reopen_run, run_shard, run_totals
+from .simulation import SimulatedConversation, run_simulations, run_simulations_batch
+
+
+# Simulator-shaped conversation with LLM usage, written without any LLM calls.
+def _conversation(diet: str = "vegan", calls: int = 6) -> SimulatedConversation:
+    return SimulatedConversation(
+        diet=diet,
+        favorite_foods=["falafel", "hummus", "lentil soup"],
+        ordered_dishes=["falafel"],
+        transcript=[("waiter", "Welcome!"), ("customer", "Falafel, please.")],
+        diet_mode="self",
+        usage=UsageTotals(
+            calls=calls, input_tokens=600, output_tokens=120, llm_ms=900.0, cost=Decimal("0.002")
+        ),
+    )
+
+
+class DashboardTests(TestCase):
+    def setUp(self):
+        cache.clear()  # Fragments are cached per stats version
+        user = get_user_model().objects.create_superuser("admin", password="admin")
+        self.client.force_login(user)
+
+    def test_renders_with_simulated_rows(self):
+        write_batch(
+            [
+                PendingConversation(index, f"customer_{index + 1}", _conversation(diet, calls))
+                for index, (diet, calls) in enumerate(
+                    [("vegan", 6), ("vegetarian", 6), ("omnivore", 0)]
+                )
+            ]
+        )
+        response = self.client.get("/dashboard/")
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "customer_1")
+        self.assertContains(response, "falafel")
+
+    def test_renders_empty(self):
+        response = self.client.get("/dashboard/")
+        self.assertEqual(response.status_code, 200)
+
+
+class PaginationTests(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_superuser("admin", password="admin")
+        self.client.force_login(user)
+        write_batch(
+            [
+                PendingConversation(index, f"customer_{index + 1}", _conversation(diet))
+                for index, diet in enumerate(["vegan", "omnivore", "vegetarian"] * 3)
+            ]
+        )
+
+    def _pages(self, queryset, size):
+        cursor, seen = None, []
+        while True:
+            page = list(newest_first(queryset, cursor)[:size])
+            seen.extend(conv.customer_label for conv in page)
+            if len(page) < size:
+                return seen
+            cursor = decode_cursor(encode_cursor(page[-1].created_at, page[-1].id))
+
+    def test_pages_walk_every_row_once_newest_first(self):
+        labels = self._pages(Conversation.objects.all(), 2)
+        self.assertEqual(labels, [f"customer_{n}" for n in range(9, 0, -1)])
+
+    def test_ties_on_created_at_fall_back_to_id(self):
+        Conversation.objects.update(created_at=Conversation.objects.latest("id").created_at)
+        labels = self._pages(Conversation.objects.all(), 4)
+        self.assertEqual(labels, [f"customer_{n}" for n in range(9, 0, -1)])
+
+    def test_api_next_cursor_reaches_the_last_page(self):
+        labels, query = [], {"limit": 2}
+        while True:
+            response = self.client.get("/api/vegetarians/", query)
+            self.assertEqual(response.status_code, 200)
+            labels.extend(item["customer_label"] for item in response.json()["items"])
+            if response.json()["next"] is None:
+                break
+            query["cursor"] = response.json()["next"]
+        self.assertEqual(labels, [f"customer_{n}" for n in [9, 7, 6, 4, 3, 1]])
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get("/api/vegetarians/", {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, 400)
+
+
+class FoodTests(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_superuser("admin", password="admin")
+        self.client.force_login(user)
+
+    def _write(self, *rows):
+        write_batch(
+            [
+                PendingConversation(
+                    index,
+                    f"customer_{index + 1}",
+                    dataclasses.replace(
+                        _conversation(diet), favorite_foods=favorite, ordered_dishes=ordered
+                    ),
+                )
+                for index, (diet, favorite, ordered) in enumerate(rows)
+            ]
+        )
+
+    def test_foods_are_normalized_and_linked_once_per_conversation(self):
+        self._write(
+            ("vegan", [" Falafel", "HUMMUS", "falafel ", ""], ["Falafel"]),
+            ("vegan", ["falafel"], ["lentil soup", "LENTIL SOUP"]),
+        )
+        names = sorted(Food.objects.values_list("name", flat=True))
+        self.assertEqual(names, ["falafel", "hummus", "lentil soup"])
+        first = Conversation.objects.get(customer_label="customer_1")
+        self.assertEqual(
+            list(
+                FavoriteFood.objects.filter(conversation_id=first.pk)
+                .order_by("position")
+                .values_list("food__name", "position")
+            ),
+            [("falafel", 1), ("hummus", 2)],
+        )
+        self.assertEqual(OrderedDish.objects.count(), 2)  # One per conversation
+        self.assertEqual(conversations_with_food("  FALAFEL").count(), 2)
+        self.assertEqual(conversations_with_food("falafel", "ordered").get(), first)
+
+    def test_top_foods_per_diet_and_kind(self):
+        self._write(
+            ("vegan", ["falafel", "hummus"], ["falafel"]),
+            ("vegan", ["hummus"], ["tofu stir fry", "falafel"]),
+            ("vegan", ["hummus", "falafel"], ["falafel"]),
+            ("vegetarian", ["cheese omelette"], ["margherita pizza"]),
+        )
+        expected = {
+            ("vegan", "favorite"): [("hummus", 3), ("falafel", 2)],
+            ("vegan", "ordered"): [("falafel", 3), ("tofu stir fry", 1)],
+            ("vegetarian", "ordered"): [("margherita pizza", 1)],
+            ("omnivore", "ordered"): [],
+        }
+        for (diet, kind), foods in expected.items():
+            with self.subTest(diet=diet, kind=kind):
+                self.assertEqual(top_foods(diet, 5, kind), foods)  # Incremented on write
+                grouped = food_counts(kind, [diet])  # GROUP BY over the link table
+                ranked = sorted(grouped.items(), key=lambda item: (-item[1], item[0]))
+                self.assertEqual([(food, total) for (_, food), total in ranked], foods)
+        rebuild_stats()
+        self.assertEqual(top_foods("vegan", 1, "ordered"), [("falafel", 3)])
+        response = self.client.get("/api/summary/foods/", {"kind": "ordered", "limit": 1})
+        self.assertEqual(response.json()["vegan"], [{"food": "falafel", "count": 3}])
+
+    def test_reclassified_conversations_move_their_ordered_counts(self):
+        self._write(("vegan", ["falafel"], ["beef burger"]))
+        call_command("reclassify_diets", mode="rules", stdout=io.StringIO())
+        self.assertEqual(top_foods("vegan", 5, "ordered"), [])
+        self.assertEqual(top_foods("omnivore", 5, "ordered"), [("beef burger", 1)])
+        self.assertEqual(top_foods("omnivore", 5), [("falafel", 1)])
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_superuser("admin", password="admin")
+        self.client.force_login(user)
+        rows = [
+            ("vegan", ["falafel"], [("waiter", "Welcome!"), ("customer", "Lentil soup, please.")]),
+            (
+                "vegan",
+                ["hummus"],
+                [("waiter", "Our lentil soup is great."), ("customer", "Hummus.")],
+            ),
+            (
+                "omnivore",
+                ["beef burger"],
+                [("waiter", "Hello!"), ("customer", "Lentil soup and a beef burger.")],
+            ),
+            (
+                "vegetarian",
+                ["falafel", "cheese omelette"],
+                [("waiter", "Hi!"), ("customer", "Soup. Lentil soup. Lentil soup again!")],
+            ),
+        ]
+        write_batch(
+            [
+                PendingConversation(
+                    index,
+                    f"customer_{index + 1}",
+                    dataclasses.replace(
+                        _conversation(diet), favorite_foods=favorite, transcript=transcript
+                    ),
+                )
+                for index, (diet, favorite, transcript) in enumerate(rows)
+            ]
+        )
+
+    def _search(self, **query):
+        response = self.client.get("/api/search/", query)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def _labels(self, payload):
+        return [item["customer_label"] for item in payload["items"]]
+
+    def test_websearch_phrases_and_exclusions(self):
+        payload = self._search(q='"lentil soup" -beef')
+        self.assertEqual(set(self._labels(payload)), {"customer_1", "customer_2", "customer_4"})
+        self.assertEqual(self._labels(payload)[0], "customer_4")  # Most mentions ranks first
+        self.assertIn("<b>", payload["items"][0]["match"]["headline"])
+
+    def test_role_filter(self):
+        payload = self._search(q="lentil", role="waiter")
+        self.assertEqual(self._labels(payload), ["customer_2"])
+        self.assertEqual(payload["items"][0]["match"]["role"], "waiter")
+        payload = self._search(q="lentil", role="customer")
+        self.assertNotIn("customer_2", self._labels(payload))
+
+    def test_rank_cursor_walks_every_match_once(self):
+        expected = self._labels(self._search(q="lentil soup", limit=10))
+        labels, query = [], {"q": "lentil soup", "limit": 1}
+        for _ in range(len(expected) + 1):
+            payload = self._search(**query)
+            labels.extend(self._labels(payload))
+            if payload["next"] is None:
+                break
+            query["cursor"] = payload["next"]
+        else:
+            self.fail(f"cursor never reached the end: {labels}")
+        self.assertEqual(len(expected), 4)
+        self.assertEqual(labels, expected)
+
+    def test_misspelled_food_falls_back_to_trigrams(self):
+        payload = self._search(q="falafle", scope="favorite")
+        self.assertEqual((payload["match"], payload["foods"]), ("trigram", ["falafel"]))
+        self.assertEqual(set(self._labels(payload)), {"customer_1", "customer_4"})
+        payload = self._search(q="burgers", scope="favorite")
+        self.assertEqual((payload["match"], payload["foods"]), ("fulltext", ["beef burger"]))
+
+    def test_conversation_gone_between_queries_is_skipped(self):
+        gone = Conversation.objects.get(customer_label="customer_2").pk
+        with connection.cursor() as cursor:  # Leaves its messages behind, like a racing archive
+            cursor.execute(f"DELETE FROM {Conversation._meta.db_table} WHERE id = %s", [gone])
+        payload = self._search(q="lentil", role="waiter")
+        self.assertEqual(payload["items"], [])
+
+
+class StreamingExportTests(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_superuser("admin", password="admin")
+        self.async_client.force_login(user)
+        write_batch(
+            [PendingConversation(index, f"customer_{index + 1}", _conversation()) for index in range(3)]
+        )
+
+    # Read the body the way the ASGI server does; a sync iterator would be buffered whole.
+    async def _stream(self, path: str, query: dict[str, str]) -> list[str]:
+        response = await self.async_client.get(path, query)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        return [
+            chunk.decode() async for chunk in response.streaming_content
+        ]
+
+    async def test_csv_export_streams_every_row(self):
+        lines = await self._stream("/api/simulations/latest/", {"format": "csv", "stream": "1"})
+        self.assertEqual(len(lines), 4)  # Header and three rows
+        self.assertTrue(lines[0].startswith("id,created_at,"))
+        self.assertIn("customer_3", lines[1])  # Newest first
+
+    async def test_vegetarians_ndjson_streams_every_row(self):
+        lines = await self._stream("/api/vegetarians/", {"format": "ndjson"})
+        self.assertEqual(len(lines), 3)
+        self.assertIn('"diet": "vegan"', lines[0])
+
+
+# Fake backend whose stream sends one word, then waits for the test to release the rest.
+class GatedStreamBackend(FakeBackend):
+    def __init__(self):
+        super().__init__(latency_ms=0, jitter_ms=0, seed=1)
+        self.gate = asyncio.Event()
+
+    async def astream(self, **params):
+        yield "Hello "
+        await self.gate.wait()
+        yield "there!"
+
+
+class ChatStreamTests(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_superuser("admin", password="admin")
+        self.async_client.force_login(user)
+        self.backend = GatedStreamBackend()
+        previous = set_backend(self.backend)
+        self.addCleanup(set_backend, previous)
+
+    async def test_first_token_is_sent_before_the_reply_is_finished(self):
+        response = await self.async_client.post(
+            "/api/chatbot/stream/", {"message": "Hi"}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        chunks = aiter(response.streaming_content)
+        first = await asyncio.wait_for(anext(chunks), timeout=5)  # Hangs if buffered
+        self.assertEqual(first.decode(), 'event: token\ndata: {"text": "Hello "}\n\n')
+        self.assertFalse(self.backend.gate.is_set())  # The model is still "generating"
+
+        self.backend.gate.set()
+        rest = [chunk.decode() async for chunk in chunks]
+        self.assertEqual(
+            [chunk.split("\n")[0] for chunk in rest], ["event: token", "event: done"]
+        )
+        session = await ChatSession.objects.aget()
+        contents = [
+            content
+            async for content in session.messages.order_by("turn_index").values_list(
+                "content", flat=True
+            )
+        ]
+        self.assertEqual(contents, ["Hi", "Hello there!"])
+
+
+class BatchModeTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        settings_override = override_settings(BASE_DIR=self.directory)  # Request files
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def _run(self, count: int):
+        backend = LocalBatchBackend(
+            self.directory / "local", FakeBackend(latency_ms=0, jitter_ms=0, seed=1)
+        )
+        return run_simulations_batch(count, "self", backend=backend, poll_interval=0)
+
+    def test_every_conversation_gets_its_own_requests_without_a_cache(self):
+        with mock.patch("conversations.simulation.get_cache", return_value=None):
+            stats = self._run(4)
+        self.assertEqual(stats.completed, 4)
+        self.assertEqual(stats.calls, 4 * 6)  # Six scripted turns each
+        self.assertEqual(Conversation.objects.count(), 4)
+
+    def test_cacheable_prompts_are_shared_with_a_cache(self):
+        with mock.patch("conversations.simulation.get_cache", return_value=object()):
+            stats = self._run(4)
+        self.assertEqual(stats.completed, 4)
+        self.assertLess(stats.calls, 4 * 6)  # Waiter turns requested once per stage
+
+
+# Provider error carrying response headers, like openai.APIStatusError.
+def _status_error(status: int, headers: dict[str, str]) -> Exception:
+    exc = RuntimeError(f"HTTP {status}")
+    exc.status_code = status
+    exc.response = httpx.Response(status, headers=headers)
+    return exc
+
+
+class SchedulerTests(SimpleTestCase):
+    PARAMS = {"model": "m", "instructions": "Be brief.", "input": "x" * 400}
+
+    def test_backoff_is_full_jitter_below_the_ceiling(self):
+        for attempt in range(8):
+            ceiling = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+            delays = [backoff_delay(attempt) for _ in range(200)]
+            self.assertTrue(all(0 <= delay <= ceiling for delay in delays), attempt)
+        delays = [backoff_delay(3, hint=2.0) for _ in range(200)]
+        self.assertTrue(all(2.0 <= delay <= 2.0 + BACKOFF_BASE for delay in delays))
+
+    def test_retry_after_headers(self):
+        self.assertEqual(retry_after(_status_error(429, {"retry-after-ms": "1500"})), 1.5)
+        self.assertEqual(retry_after(_status_error(429, {"retry-after": "7"})), 7.0)
+        self.assertEqual(retry_after(_status_error(429, {"retry-after": "-3"})), 0.0)
+        date = email.utils.formatdate(time.time() + 30, usegmt=True)
+        self.assertAlmostEqual(retry_after(_status_error(503, {"retry-after": date})), 30, delta=2)
+        self.assertIsNone(retry_after(_status_error(429, {"retry-after": "soon"})))
+        self.assertIsNone(retry_after(_status_error(500, {})))
+        self.assertIsNone(retry_after(ValueError("no response")))
+        self.assertEqual(retry_after(CircuitOpenError(4.0)), 4.0)
+
+    def test_breaker_opens_then_lets_one_probe_through(self):
+        now = [100.0]
+        clock = SimpleNamespace(monotonic=lambda: now[0])
+        with mock.patch("conversations.llm_scheduler.time", clock):
+            breaker = CircuitBreaker(threshold=2, cooldown=10)
+            breaker.record_failure()
+            self.assertEqual(breaker.state, "closed")
+            breaker.record_failure()
+            self.assertEqual((breaker.state, breaker.trips), ("open", 1))
+            with self.assertRaises(CircuitOpenError):
+                breaker.before_call()
+
+            now[0] += 10
+            breaker.before_call()  # The probe
+            self.assertEqual(breaker.state, "half-open")
+            with self.assertRaises(CircuitOpenError):
+                breaker.before_call()  # Only one probe at a time
+            breaker.record_failure()  # Probe failed: a new cooldown, not a new trip
+            self.assertEqual((breaker.state, breaker.trips), ("open", 1))
+            with self.assertRaises(CircuitOpenError):
+                breaker.before_call()
+
+            now[0] += 10
+            breaker.before_call()
+            breaker.record_success()
+            self.assertEqual(breaker.state, "closed")
+            breaker.before_call()
+
+    def test_failed_attempts_give_back_their_tokens(self):
+        self.assertGreater(estimate_tokens(self.PARAMS), 60 + 5)  # A kept reservation would show
+        usage = SimpleNamespace(input_tokens=50, output_tokens=10)
+        answers = [FakeLLMError("busy"), SimpleNamespace(usage=usage)]
+
+        def create(**params):
+            answer = answers.pop(0)
+            if isinstance(answer, Exception):
+                raise answer
+            return answer
+
+        async def acreate(**params):
+            return create(**params)
+
+        with mock.patch("conversations.llm_scheduler.backoff_delay", return_value=0):
+            scheduler = Scheduler(max_retries=1, tokens_per_minute=60000, breaker_threshold=0)
+            scheduler.call(create, **self.PARAMS)
+            self.assertAlmostEqual(scheduler.tokens._level, 60000 - 60, delta=5)
+
+            scheduler = Scheduler(max_retries=1, tokens_per_minute=60000, breaker_threshold=0)
+            answers[:] = [_status_error(400, {})]  # Not retried
+            with self.assertRaises(RuntimeError):
+                asyncio.run(scheduler.acall(acreate, **self.PARAMS))
+            self.assertAlmostEqual(scheduler.tokens._level, 60000, delta=5)
+
+
+class PromptTemplateTests(SimpleTestCase):
+    # Render a template with every placeholder set to `value`.
+    def _render(self, template, value):
+        fields = {name for _, name, _, _ in string.Formatter().parse(template.suffix) if name}
+        return template.render(**{name: value for name in fields})
+
+    def test_values_only_change_the_end_of_the_input(self):
+        for site, template in PROMPTS.items():
+            with self.subTest(site=site):
+                first, second = self._render(template, "first"), self._render(template, "second")
+                self.assertTrue(first.startswith(template.task))
+                self.assertTrue(second.startswith(template.task))
+                if template.suffix:
+                    self.assertNotEqual(first, second)
+
+    def test_diet_rules_are_byte_identical_across_sites(self):
+        for site in [
+            "customer_fav",
+            "customer_order",
+            "diet_classification",
+            "diet_batch_classification",
+        ]:
+            with self.subTest(site=site):
+                template = PROMPTS[site]
+                self.assertEqual(
+                    (template.instructions + template.task).count(DIET_RULES_TEXT), 1
+                )
+        self.assertEqual(
+            PROMPTS["diet_classification"].instructions,
+            PROMPTS["diet_batch_classification"].instructions,
+        )
+
+
+class DietRulesTests(SimpleTestCase):
+    CASES = [
+        (["sausages"], "omnivore"),
+        (["anchovies on toast"], "omnivore"),
+        (["pad thai", "fish  sauce"], "omnivore"),
+        (["peanut butter toast"], "vegan"),
+        (["Coconut-cream curry"], "vegan"),
+        (["ice cream"], "vegetarian"),
+        (["boiled eggs"], "vegetarian"),
+        (["vegan cheese"], "vegan"),
+        (["discount codes", "falafel"], "vegan"),  # Not "cod" + "es"
+        (["cods"], "omnivore"),
+        ([" "], None),
+    ]
+
+    def test_keywords_phrases_and_plurals(self):
+        for foods, diet in self.CASES:
+            with self.subTest(foods=foods):
+                self.assertEqual(classify_diet_rules(foods, None), diet)
+
+    def test_classify_many_matches_row_by_row(self):
+        rows = [
+            (foods, ["hummus"] if index % 2 else None)
+            for index, (foods, _) in enumerate(self.CASES)
+        ]
+        rows.append((None, None))
+        self.assertEqual(
+            classify_many(rows),
+            [classify_diet_rules(favorite, ordered) for favorite, ordered in rows],
+        )
+
+
+# Fake backend whose batch classification replies are rewritten by edit(results) -> output text.
+class EditedBatchBackend(FakeBackend):
+    def __init__(self, edit):
+        super().__init__(latency_ms=0, jitter_ms=0, seed=1)
+        self.edit = edit
+
+    def _respond(self, rng, params):
+        response = super()._respond(rng, params)
+        reply = json.loads(response.output_text)
+        if "results" in reply:
+            response.output_text = self.edit(reply["results"])
+        return response
+
+
+class BatchClassificationTests(TestCase):
+    ITEMS = [
+        (1, ["falafel"], ["hummus"]),
+        (2, ["cheese omelette"], ["margherita pizza"]),
+        (3, ["beef burger"], ["steak frites"]),
+    ]
+    EXPECTED = {1: "vegan", 2: "vegetarian", 3: "omnivore"}
+
+    def _classify(self, edit):
+        previous = set_backend(EditedBatchBackend(edit))
+        self.addCleanup(set_backend, previous)
+        return classify_diets_llm_batch(self.ITEMS)
+
+    def test_complete_reply_is_one_call(self):
+        diets, calls = self._classify(lambda results: json.dumps({"results": results}))
+        self.assertEqual((diets, calls), (self.EXPECTED, 1))
+
+    def test_misordered_reply_maps_back_by_id(self):
+        diets, calls = self._classify(lambda results: json.dumps({"results": results[::-1]}))
+        self.assertEqual((diets, calls), (self.EXPECTED, 1))
+
+    def test_short_reply_falls_back_for_missing_ids(self):
+        diets, calls = self._classify(lambda results: json.dumps({"results": results[:1]}))
+        self.assertEqual((diets, calls), (self.EXPECTED, 3))
+
+    def test_unknown_label_falls_back_for_that_id(self):
+        def edit(results):
+            results[1]["diet"] = "pescatarian"
+            return json.dumps({"results": results})
+
+        diets, calls = self._classify(edit)
+        self.assertEqual((diets, calls), (self.EXPECTED, 2))
+
+    def test_failed_batch_call_falls_back_for_every_id(self):
+        diets, calls = self._classify(lambda results: "not json")
+        self.assertEqual((diets, calls), (self.EXPECTED, 4))
+
+    def test_empty_batch_makes_no_calls(self):
+        self.assertEqual(classify_diets_llm_batch([]), ({}, 0))
+
+
+class ResponseCacheTests(TestCase):
+    def test_key_is_the_hash_of_the_canonical_request(self):
+        schema = {"type": "object", "properties": {"diet": {"type": "string"}}}
+        canonical = json.dumps(
+            {"model": "m", "instructions": "i", "input": "u", "schema": schema, "name": "n"},
+            sort_keys=True,
+            separators=(",", ":"),
+        )
+        key = cache_key("m", "i", "u", schema, "n")
+        self.assertEqual(key, hashlib.sha256(canonical.encode("utf-8")).hexdigest())
+        reordered = {"properties": {"diet": {"type": "string"}}, "type": "object"}
+        self.assertEqual(cache_key("m", "i", "u", reordered, "n"), key)
+        self.assertNotEqual(cache_key("m", "i", "u!", schema, "n"), key)
+
+    def test_memory_cache_evicts_the_least_recently_used(self):
+        store = MemoryCache(max_entries=2)
+        store.set("a", 1)
+        store.set("b", 2)
+        self.assertEqual(store.get("a"), 1)  # "b" is now the oldest
+        store.set("c", 3)
+        self.assertEqual((store.get("a"), store.get("b"), store.get("c")), (1, None, 3))
+        self.assertEqual(store.stats()["evictions"], 1)
+
+    def test_expired_entries_are_misses(self):
+        store = MemoryCache(ttl=-1)
+        store.set("a", 1)
+        self.assertIsNone(store.get("a"))
+
+    def test_file_cache_round_trip(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        key = cache_key("m", "i", "u")
+        FileCache(directory.name).set(key, {"text": "Welcome!", "usage": [1, 2]})
+        reader = FileCache(directory.name)  # Another process on the same host
+        self.assertEqual(reader.get(key), {"text": "Welcome!", "usage": [1, 2]})
+        self.assertTrue((Path(directory.name) / key[:2] / f"{key}.json").exists())
+
+    def test_database_cache_round_trip(self):
+        key = cache_key("m", "i", "u")
+        DatabaseCache().set(key, {"text": "Welcome!"})
+        DatabaseCache().set(key, {"text": "Hello!"})  # Overwrites in place
+        self.assertEqual(DatabaseCache().get(key), {"text": "Hello!"})
+        self.assertIsNone(DatabaseCache().get(cache_key("m", "i", "other")))
+
+
+# Local batch backend that counts submissions and can lose its connection while polling.
+class FlakyBatchBackend(LocalBatchBackend):
+    def __init__(self, directory, fail_polls=frozenset()):
+        super().__init__(directory, FakeBackend(latency_ms=0, jitter_ms=0, seed=1))
+        self.fail_polls = fail_polls  # 1-based poll numbers that raise
+        self.submits = self.polls = 0
+
+    def submit(self, path):
+        self.submits += 1
+        return super().submit(path)
+
+    def status(self, batch_id):
+        self.polls += 1
+        if self.polls in self.fail_polls:
+            raise ConnectionError("connection lost while polling")
+        return super().status(batch_id)
+
+
+# Simulations write from worker threads with their own connections, so these tests commit.
+class FakeBackendTestCase(TransactionTestCase):
+    def setUp(self):
+        previous = set_backend(FakeBackend(latency_ms=0, jitter_ms=0, seed=1))
+        self.addCleanup(set_backend, previous)
+        self.addCleanup(self._close_writer_connection)
+
+    # Simulations write on asgiref's sync thread, whose connection would outlive the test
+    # and block dropping the test database.
+    def _close_writer_connection(self):
+        asyncio.run(sync_to_async(connections.close_all)())
+
+
+# Sum of a Prometheus counter's samples whose labels include every pair in `match`.
+def _scraped(body: str, name: str, **match: str) -> float:
+    total = 0.0
+    for line in body.splitlines():
+        sample, _, value = line.rpartition(" ")
+        if not sample.startswith(name + "{"):
+            continue
+        if all(f'{key}="{label}"' in sample for key, label in match.items()):
+            total += float(value)
+    return total
+
+
+class SimulationTests(FakeBackendTestCase):
+    def test_every_conversation_is_written_in_batches(self):
+        stats = run_simulations(5, "self", concurrency=3, batch_size=2)
+        self.assertEqual((stats.completed, stats.failed), (5, 0))
+        self.assertEqual(Conversation.objects.count(), 5)
+        self.assertEqual(Message.objects.count(), 5 * 6)  # Six scripted turns each
+        self.assertEqual(sum(DietStat.objects.values_list("conversation_count", flat=True)), 5)
+        self.assertEqual(
+            set(Conversation.objects.values_list("customer_label", flat=True)),
+            {f"customer_{n}" for n in range(1, 6)},
+        )
+
+    def test_cache_hits_are_not_counted_as_calls(self):
+        stats = run_simulations(4, "self", concurrency=2)
+        self.assertEqual((stats.calls, stats.cache_hits), (4 * 6, 0))
+        with mock.patch("conversations.llm.get_cache", return_value=MemoryCache()):
+            stats = run_simulations(4, "self", concurrency=2)
+        self.assertGreater(stats.cache_hits, 0)  # Identical waiter prompts
+        self.assertEqual(stats.calls + stats.cache_hits, 4 * 6)
+        self.assertEqual(stats.calls, stats.usage.calls)
+
+    @override_settings(METRICS_TOKEN="scrape-token")
+    def test_metrics_endpoint_and_saved_usage_agree(self):
+        self.assertEqual(self.client.get("/api/metrics/").status_code, 403)
+        auth = {"HTTP_AUTHORIZATION": "Bearer scrape-token"}
+        before = self.client.get("/api/metrics/", **auth).content.decode()
+        run_simulations(3, "self", concurrency=2)
+        response = self.client.get("/api/metrics/", **auth)
+        self.assertEqual(response.status_code, 200)
+        after = response.content.decode()
+
+        saved = Conversation.objects.aggregate(
+            calls=Sum("llm_calls"), input=Sum("input_tokens"), output=Sum("output_tokens")
+        )
+        self.assertEqual(saved["calls"], 3 * 6)
+        for metric, labels, expected in [
+            ("llm_calls_total", {"outcome": "ok"}, saved["calls"]),
+            ("llm_tokens_total", {"kind": "input"}, saved["input"]),
+            ("llm_tokens_total", {"kind": "output"}, saved["output"]),
+            ("llm_call_seconds_count", {}, saved["calls"]),
+        ]:
+            with self.subTest(metric=metric, **labels):
+                scraped = _scraped(after, metric, **labels) - _scraped(before, metric, **labels)
+                self.assertEqual(scraped, expected)
+
+        (usage,) = llm_usage_by_mode(1000)
+        self.assertEqual((usage["diet_mode"], usage["conversations"]), ("self", 3))
+        self.assertEqual(usage["avg_tokens"], round((saved["input"] + saved["output"]) / 3))
+        self.assertLessEqual(usage["p50_ms"], usage["p95_ms"])
+
+    def test_serial_run_writes_the_same_rows(self):
+        stats = run_simulations(3, "self", batch_size=2)
+        self.assertEqual((stats.completed, stats.failed), (3, 0))
+        self.assertEqual(Conversation.objects.count(), 3)
+        self.assertEqual(Message.objects.count(), 3 * 6)
+
+    def test_rerun_of_a_run_writes_nothing_twice(self):
+        run = open_run("rerun", 4, "self", 1)
+        for _ in range(2):
+            run_simulations(4, "self", batch_size=3, run_id=run.pk, seed=run.seed)
+        self.assertEqual(Conversation.objects.count(), 4)
+        self.assertEqual(
+            sorted(run.conversations.values_list("run_index", flat=True)), [0, 1, 2, 3]
+        )
+        self.assertEqual(sum(DietStat.objects.values_list("conversation_count", flat=True)), 4)
+
+    def test_reopened_shard_only_simulates_missing_conversations(self):
+        run = open_run("resume", 6, "self", 2)
+        for index in range(2):
+            shard, _ = run_shard(run, index, batch_size=2)
+            self.assertEqual(shard.status, "succeeded")
+        run.refresh_from_db()
+        self.assertIsNotNone(run.finished_at)
+        self.assertEqual(reopen_run(run), [])  # Nothing left to do
+
+        # The second shard's process died after saving one conversation
+        run.conversations.filter(run_index__gt=3).delete()
+        run.shards.filter(index=1).update(status="running")
+        self.assertEqual(reopen_run(run), [1])
+        with self.assertRaises(ValueError):
+            open_run("resume", 6, "self", 3)  # Joining with another layout
+        shard, stats = run_shard(run, 1, batch_size=2)
+        self.assertEqual((shard.status, shard.completed, stats.completed), ("succeeded", 3, 2))
+        self.assertEqual(
+            sorted(run.conversations.values_list("run_index", flat=True)), list(range(6))
+        )
+        self.assertEqual(run_totals(run)["completed"], 6)
+
+
+class BatchResumeTests(FakeBackendTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        settings_override = override_settings(BASE_DIR=self.directory)  # Request files
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def _shard(self, run, backend):
+        return run_shard(run, 0, batch_api={"backend": backend, "poll_interval": 0})[0]
+
+    def test_request_files_are_never_shared(self):
+        backend = FlakyBatchBackend(self.directory / "local")
+        for _ in range(2):
+            run_simulations_batch(2, "self", backend=backend, poll_interval=0)
+        files = list((self.directory / ".llm_batches" / "requests").glob("*.jsonl"))
+        self.assertEqual(len(files), backend.submits)  # Same names, separate files
+
+    def test_requeued_shard_polls_its_stored_batches(self):
+        run = open_run("batch-resume", 3, "self", 1)
+        crashing = FlakyBatchBackend(self.directory / "local", fail_polls={2})  # In stage 2
+        shard = self._shard(run, crashing)
+        self.assertEqual((shard.status, crashing.submits), ("failed", 2))
+        self.assertEqual(len(shard.batches), 2)  # Saved as submitted, kept for the resume
+        self.assertEqual(run.conversations.count(), 0)
+
+        self.assertEqual(reopen_run(run), [0])
+        healthy = FlakyBatchBackend(self.directory / "local")
+        shard = self._shard(run, healthy)
+        self.assertEqual((shard.status, shard.completed), ("succeeded", 3))
+        self.assertEqual(healthy.submits, 0)  # Both stages answered from the stored batches
+        self.assertEqual(shard.batches, {})
+        shard.refresh_from_db()
+        self.assertEqual(shard.batches, {})
+
+
+class MigrationTests(TransactionTestCase):
+    # Count rows with SQL; the models describe the latest schema, not the migrated one.
+    def _count(self, model) -> int:
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM {model._meta.db_table}")
+            return cursor.fetchone()[0]
+
+    def _is_partitioned(self, model) -> bool:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT relkind FROM pg_class WHERE relname = %s", [model._meta.db_table]
+            )
+            return cursor.fetchone()[0] == "p"
+
+    def test_partitioning_round_trip_keeps_every_row(self):
+        write_batch(
+            [
+                PendingConversation(index, f"customer_{index + 1}", _conversation())
+                for index in range(3)
+            ]
+        )
+        self.assertTrue(self._is_partitioned(Conversation))
+        call_command("migrate", "conversations", "0012", verbosity=0)
+        self.assertFalse(self._is_partitioned(Conversation))
+        self.assertFalse(self._is_partitioned(Message))
+        self.assertEqual((self._count(Conversation), self._count(Message)), (3, 3 * 2))
+
+        call_command("migrate", "conversations", verbosity=0)
+        self.assertTrue(self._is_partitioned(Conversation))
+        self.assertTrue(self._is_partitioned(Message))
+        self.assertEqual(Conversation.objects.count(), 3)
+        self.assertEqual(Message.objects.count(), 3 * 2)
+        self.assertEqual(top_foods("vegan", 5, "ordered"), [("falafel", 3)])  # Backfilled again
+        write_batch([PendingConversation(3, "customer_4", _conversation())])  # Ids continue
+        self.assertEqual(Conversation.objects.count(), 4)
+
+
+class JobTests(FakeBackendTestCase):
+    def _work(self) -> SimulationJob:
+        job = claim_next_job()
+        return run_job(job, concurrency=4, batch_size=2)
+
+    def test_jobs_write_through_their_own_run(self):
+        first, second = enqueue_simulation(3, "self"), enqueue_simulation(2, "rules")
+        self.assertEqual(self._work().status, "succeeded")
+        self.assertEqual(self._work().status, "succeeded")
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.completed, second.completed), (3, 2))
+        self.assertEqual(first.run.shards.get().completed, 3)
+        labels = set(Conversation.objects.values_list("customer_label", flat=True))
+        self.assertEqual(len(labels), 5)  # No label shared between the jobs
+        self.assertIn(f"job-{first.pk}_customer_1", labels)
+        self.assertIn(f"job-{second.pk}_customer_1", labels)
+
+    def test_requeued_job_resumes_its_run(self):
+        job = enqueue_simulation(4, "self")
+        self._work()
+        job.refresh_from_db()
+        # A worker that died halfway: two conversations saved, job and shard still running
+        job.run.conversations.filter(run_index__gte=2).delete()
+        job.run.shards.update(status="running")
+        SimulationJob.objects.filter(pk=job.pk).update(status="running")
+        self.assertTrue(requeue_job(job))
+        job = self._work()
+        self.assertEqual((job.status, job.completed), ("succeeded", 4))
+        self.assertEqual(
+            sorted(job.run.conversations.values_list("run_index", flat=True)), [0, 1, 2, 3]
+        )
@@ -1,7 +1,15 @@
 from django.urls import path
 
 from .views import (
-    ChatbotAPIView,
+    chatbot,
+    chatbot_stream,
+    conversation_messages,
+    diet_summary,
+    food_conversations,
+    food_summary,
+    llm_metrics,
+    search,
+    simulation_job,
     simulations_latest,
     simulations_run,
     vegetarian_summary,
@@ -10,8 +18,20 @@ from .views import (
 # Routes live in the app for scalability
 
 urlpatterns = [
-    path("chatbot/", ChatbotAPIView.as_view(), name="chatbot"),  # Chatbot endpoint
+    path("chatbot/", chatbot, name="chatbot"),  # Chatbot endpoint (async)
+    path("chatbot/stream/", chatbot_stream, name="chatbot_stream"),  # Streamed chatbot (SSE)
     path("simulations/latest/", simulations_latest, name="simulations_latest"),  # Export
-    path("simulations/run/", simulations_run, name="simulations_run"),  # Trigger sims
+    path("simulations/run/", simulations_run, name="simulations_run"),  # Queue sims
+    path("simulations/jobs/<int:job_id>/", simulation_job, name="simulation_job"),  # Job status
+    path(
+        "conversations/<int:conversation_id>/messages/",
+        conversation_messages,
+        name="conversation_messages",
+    ),  # Transcript of one conversation
     path("vegetarians/", vegetarian_summary, name="vegetarians"),  # Vegetarian/vegan summary
+    path("summary/diets/", diet_summary, name="diet_summary"),  # Counts per diet
+    path("summary/foods/", food_summary, name="food_summary"),  # Top foods per diet
+    path("foods/conversations/", food_conversations, name="food_conversations"),  # By food
+    path("search/", search, name="search"),  # Ranked full-text search
+    path("metrics/", llm_metrics, name="llm_metrics"),  # Prometheus scrape target
 ]
@@ -1,66 +1,97 @@
 import csv
 import io
+import json
+import logging
 import os
-from collections import Counter
+import time
+from functools import partial
+from django.conf import settings
 from django.contrib.auth.decorators import login_required, permission_required
-from django.core.management import call_command
-from django.db.models import Count
-from django.http import JsonResponse, HttpResponse
-from django.shortcuts import redirect, render
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
-from rest_framework import status
-from rest_framework.authentication import SessionAuthentication
-from rest_framework.permissions import IsAuthenticated
-from rest_framework.response import Response
-from rest_framework.views import APIView
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import condition
 
+from .aggregates import (
+    dashboard_state,
+    diet_counts,
+    llm_usage_by_mode,
+    top_foods,
+    top_foods_by_diet,
+)
 from .constants import (
+    DASHBOARD_CACHE_SECONDS,
     DASHBOARD_LATEST_COUNT,
+    DASHBOARD_USAGE_WINDOW,
+    EXPORT_CHUNK_SIZE,
+    MAX_RUN_COUNT,
     TOP_FOODS_COUNT,
 )
-from .llm import generate_text
-from .models import Conversation
+from .exports import EXPORT_FIELDS, csv_row, streaming_export
+from .foods import conversations_with_food
+from .jobs import aenqueue_simulation, job_payload
+from .chat import achat_reply, aget_session, aprepare_turn, arecord_turn
+from .llm import astream_text
+from .metrics import CONTENT_TYPE, render_prometheus
+from .models import Conversation, Message, SimulationJob
+from .pagination import encode_cursor, encode_rank_cursor, newest_first
+from .search import match_foods, rank_food_conversations, rank_transcripts, transcript_headlines
 from .serializers import (
     ChatbotPayloadSerializer,
     DashboardQuerySerializer,
+    FoodConversationsQuerySerializer,
+    FoodSummaryQuerySerializer,
+    SearchQuerySerializer,
     SimulationsLatestQuerySerializer,
     SimulationsRunSerializer,
+    VegetariansQuerySerializer,
 )
 
+logger = logging.getLogger(__name__)
+
+
+# NDJSON lines of the vegetarians export, fetched in chunks; async so ASGI streams them.
+async def _vegetarian_lines(queryset):
+    rows = queryset.values("customer_label", "diet", "favorite_foods")  # See exports.iter_rows
+    async for row in rows.aiterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield json.dumps(row) + "\n"
+
 
-# Aggregate top foods per diet from conversation rows.
-def _top_foods_by_diet(rows, top_n):
-    counters = {diet: Counter() for diet, _ in Conversation.DIET_CHOICES}  # Buckets
-    for row in rows:
-        diet = row.get("diet")
-        foods = row.get("favorite_foods") or []
-        if diet not in counters:
-            continue  # Skip unknown diet
-        for food in foods:
-            if not food:
-                continue  # Skip blanks
-            normalized = str(food).strip().lower()
-            if not normalized:
-                continue  # Skip empty
-            counters[diet][normalized] += 1  # Count foods
-    return {
-        diet: counter.most_common(top_n) for diet, counter in counters.items()
-    }  # Top lists
-
-
-# Serve vegetarian/vegan summaries with favorite foods.
+# Serve vegetarian/vegan summaries with favorite foods, one keyset page at a time.
+# format=ndjson streams every matching row after the cursor instead.
 @login_required
 @permission_required("conversations.view_conversation", raise_exception=True)
 def vegetarian_summary(request):
-    items = list(
-        Conversation.objects.filter(diet__in=["vegetarian", "vegan"]).values(
-            "customer_label", "diet", "favorite_foods"
-        )
-    )
-    return JsonResponse({"count": len(items), "items": items})  # Return summary
+    serializer = VegetariansQuerySerializer(data=request.GET)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)  # Invalid query
+    limit = serializer.validated_data["limit"]
+    queryset = newest_first(
+        Conversation.objects.filter(diet__in=["vegetarian", "vegan"]),
+        serializer.validated_data.get("cursor"),
+    ).values_list("id", "created_at", "customer_label", "diet", "favorite_foods")
+    if serializer.validated_data["format"] == "ndjson":
+        return StreamingHttpResponse(
+            _vegetarian_lines(queryset), content_type="application/x-ndjson"
+        )  # Stream all
+    rows = list(queryset[:limit + 1])  # One extra row tells whether a next page exists
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
+    items = [
+        {"customer_label": label, "diet": diet, "favorite_foods": foods}
+        for _, _, label, diet, foods in rows
+    ]
+    return JsonResponse(
+        {"count": len(items), "items": items, "next": next_cursor}
+    )  # Return summary page
 
 
-# Export latest simulations in JSON or CSV.
+# Export latest simulations in JSON, CSV or NDJSON.
+# stream=1 (or format=ndjson) streams any number of rows; cursor resumes after a row.
 @login_required
 @permission_required("conversations.view_conversation", raise_exception=True)
 def simulations_latest(request):
@@ -69,53 +100,31 @@ def simulations_latest(request):
         return JsonResponse(serializer.errors, status=400)  # Invalid query
     limit = serializer.validated_data["limit"]
     export_format = serializer.validated_data["format"]
-    queryset = Conversation.objects.order_by("-created_at")[:limit]  # Latest sims
+    queryset = newest_first(
+        Conversation.objects.all(), serializer.validated_data.get("cursor")
+    )  # Latest sims
+    if serializer.validated_data["stream"]:
+        return streaming_export(queryset, export_format, limit)  # Flat-memory export
+    items = list(queryset[:limit].values(*EXPORT_FIELDS))
     if export_format == "csv":
         output = io.StringIO()
         writer = csv.writer(output)
-        writer.writerow(
-            [
-                "id",
-                "created_at",
-                "customer_label",
-                "diet",
-                "favorite_foods",
-                "ordered_dishes",
-            ]
-        )
-        for convo in queryset:
-            writer.writerow(
-                [
-                    convo.id,
-                    convo.created_at.isoformat(),
-                    convo.customer_label,
-                    convo.diet,
-                    "|".join(str(food) for food in (convo.favorite_foods or [])),
-                    "|".join(str(dish) for dish in (convo.ordered_dishes or [])),
-                ]
-            )
+        writer.writerow(EXPORT_FIELDS)
+        for item in items:
+            writer.writerow(csv_row(item))
         response = HttpResponse(output.getvalue(), content_type="text/csv")
         response["Content-Disposition"] = (
             f'attachment; filename="simulations_latest_{limit}.csv"'
         )
         return response  # Send CSV download
-    items = list(
-        queryset.values(
-            "id",
-            "created_at",
-            "customer_label",
-            "diet",
-            "favorite_foods",
-            "ordered_dishes",
-        )
-    )
     return JsonResponse({"count": len(items), "items": items})  # Send JSON payload
 
 
-# Trigger a sync simulation run from a POST request.
+# Queue a background simulation run from a POST request.
+# Async view: the insert runs on the async ORM, so under config.asgi it needs no thread.
 @login_required
 @permission_required("conversations.add_conversation", raise_exception=True)
-def simulations_run(request):
+async def simulations_run(request):
     if request.method != "POST":
         return JsonResponse({"error": "POST only"}, status=405)  # Method guard
     payload = request.POST.copy()
@@ -124,40 +133,235 @@ def simulations_run(request):
     serializer = SimulationsRunSerializer(data=payload)
     if not serializer.is_valid():
         return JsonResponse(serializer.errors, status=400)  # Invalid payload
-    count = serializer.validated_data["count"]
-    diet_mode = serializer.validated_data["diet_mode"]
-    call_command(
-        "simulate_conversations", count=count, diet_mode=diet_mode
-    )  # Run sync command
+    job = await aenqueue_simulation(
+        serializer.validated_data["count"],
+        serializer.validated_data["diet_mode"],
+        user=await request.auser(),
+    )  # Worker picks it up
+    if "text/html" not in request.headers.get("Accept", ""):
+        return JsonResponse(
+            {
+                "job_id": job.id,
+                "status": job.status,
+                "status_url": reverse("simulation_job", args=[job.id]),
+            },
+            status=202,
+        )  # API clients poll the status URL
     dashboard_url = reverse("dashboard")
-    return redirect(f"{dashboard_url}?ran={count}")  # Return to dashboard
+    return redirect(f"{dashboard_url}?job={job.id}")  # Return to dashboard
+
+
+# Report progress and failures of a queued simulation job.
+@login_required
+@permission_required("conversations.view_conversation", raise_exception=True)
+def simulation_job(request, job_id):
+    job = get_object_or_404(SimulationJob, pk=job_id)
+    return JsonResponse(job_payload(job))  # Job status
+
+
+# Serve conversation counts per diet from the aggregate store.
+@login_required
+@permission_required("conversations.view_conversation", raise_exception=True)
+def diet_summary(request):
+    counts = diet_counts()
+    return JsonResponse({"total": sum(counts.values()), "diets": counts})  # Diet totals
+
+
+# Serve top favorite foods (or, with kind=ordered, ordered dishes) per diet from the
+# aggregate store.
+@login_required
+@permission_required("conversations.view_conversation", raise_exception=True)
+def food_summary(request):
+    serializer = FoodSummaryQuerySerializer(data=request.GET)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)  # Invalid query
+    limit = serializer.validated_data["limit"]
+    diet = serializer.validated_data.get("diet")
+    kind = serializer.validated_data["kind"]
+    if diet:
+        foods = {diet: top_foods(diet, limit, kind)}
+    else:
+        foods = top_foods_by_diet(limit, kind)
+    return JsonResponse(
+        {
+            diet: [{"food": food, "count": count} for food, count in items]
+            for diet, items in foods.items()
+        }
+    )  # Top foods per diet
+
+
+# Conversations that list a food as a favorite or an order, newest first, one keyset page
+# at a time. The food name is normalized like stored foods, so "Tofu " matches "tofu".
+@login_required
+@permission_required("conversations.view_conversation", raise_exception=True)
+def food_conversations(request):
+    serializer = FoodConversationsQuerySerializer(data=request.GET)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)  # Invalid query
+    limit = serializer.validated_data["limit"]
+    queryset = newest_first(
+        conversations_with_food(
+            serializer.validated_data["food"], serializer.validated_data["kind"]
+        ),
+        serializer.validated_data.get("cursor"),
+    ).values_list(
+        "id", "created_at", "customer_label", "diet", "favorite_foods", "ordered_dishes"
+    )
+    rows = list(queryset[:limit + 1])  # One extra row tells whether a next page exists
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
+    items = [
+        {
+            "id": pk,
+            "customer_label": label,
+            "diet": diet,
+            "favorite_foods": favorites,
+            "ordered_dishes": dishes,
+        }
+        for pk, _, label, diet, favorites, dishes in rows
+    ]
+    return JsonResponse({"count": len(items), "items": items, "next": next_cursor})
+
+
+# Ranked full-text search, best match first, one keyset page at a time.
+# scope=transcript searches message text (optionally one role) and returns the best matching
+# line of each conversation highlighted; scope=favorite|ordered matches food names, falling
+# back to trigram similarity for misspellings, and returns the foods it matched.
+@login_required
+@permission_required("conversations.view_conversation", raise_exception=True)
+def search(request):
+    serializer = SearchQuerySerializer(data=request.GET)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)  # Invalid query
+    text = serializer.validated_data["q"]
+    scope = serializer.validated_data["scope"]
+    role = serializer.validated_data.get("role")
+    limit = serializer.validated_data["limit"]
+    cursor = serializer.validated_data.get("cursor")
+    payload = {}
+    if scope == "transcript":
+        ranked = rank_transcripts(text, role, cursor)
+    else:
+        foods, match = match_foods(text)
+        payload = {"match": match, "foods": [name for _, name, _ in foods]}
+        if not foods:
+            return JsonResponse({"count": 0, "items": [], "next": None, **payload})
+        ranked = rank_food_conversations(foods, scope, cursor)
+    rows = list(ranked[:limit + 1])  # One extra row tells whether a next page exists
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_rank_cursor(rows[-1][1], rows[-1][0])
+    ids = [pk for pk, _ in rows]
+    conversations = Conversation.objects.only(
+        "created_at", "customer_label", "diet", "favorite_foods", "ordered_dishes"
+    ).in_bulk(ids)
+    headlines = {}
+    if scope == "transcript":
+        created = {conversation.created_at for conversation in conversations.values()}
+        headlines = transcript_headlines(text, ids, role, created)
+    items = []
+    for pk, rank in rows:
+        conversation = conversations.get(pk)
+        if conversation is None:
+            continue  # Deleted or archived between the two queries
+        item = {
+            "id": pk,
+            "rank": rank,
+            "customer_label": conversation.customer_label,
+            "diet": conversation.diet,
+            "favorite_foods": conversation.favorite_foods,
+            "ordered_dishes": conversation.ordered_dishes,
+        }
+        if pk in headlines:
+            item["match"] = headlines[pk]
+        items.append(item)
+    return JsonResponse({"count": len(items), "items": items, "next": next_cursor, **payload})
+
+
+# Everything the dashboard page depends on, read once per request.
+def _dashboard_state(request) -> dict[str, object]:
+    if not hasattr(request, "_dashboard_state"):
+        serializer = DashboardQuerySerializer(data=request.GET)
+        serializer.is_valid()  # Keep dashboard usable with invalid query params
+        job_id = serializer.validated_data.get("job")
+        state = dashboard_state()
+        state["job"] = SimulationJob.objects.filter(pk=job_id).first() if job_id else None
+        request._dashboard_state = state
+    return request._dashboard_state
+
+
+# Changes whenever the stats, the shown job or the viewer changes (the page holds a CSRF token).
+def _dashboard_etag(request) -> str:
+    state = _dashboard_state(request)
+    job = state["job"]
+    job_part = f"{job.id}.{job.status}.{job.completed}.{job.failed}" if job else "none"
+    return f"dash-{state['version']}-{state['rows']}-{request.user.pk}-{job_part}"
+
+
+def _dashboard_last_modified(request):
+    return _dashboard_state(request)["updated_at"]
 
 
 # Render the dashboard with metrics and recent conversations.
+# Unchanged dashboards answer 304; the page body is a fragment cached per stats version,
+# and its data is only queried on a cache miss (the context holds callables and lazy querysets).
 @login_required
 @permission_required("conversations.view_conversation", raise_exception=True)
+@condition(etag_func=_dashboard_etag, last_modified_func=_dashboard_last_modified)
 def dashboard(request):
-    latest_conversations = Conversation.objects.order_by(
-        "-created_at"
-    ).prefetch_related("messages")[:DASHBOARD_LATEST_COUNT]
-    diet_counts = {diet: 0 for diet, _ in Conversation.DIET_CHOICES}  # Baseline
-    for row in Conversation.objects.values("diet").annotate(count=Count("id")):
-        diet_counts[row["diet"]] = row["count"]  # Fill counts
-    top_foods = _top_foods_by_diet(
-        Conversation.objects.values("diet", "favorite_foods"),
-        TOP_FOODS_COUNT,
-    )
-    serializer = DashboardQuerySerializer(data=request.GET)
-    serializer.is_valid()  # Keep dashboard usable with invalid query params
-    ran_count = serializer.validated_data.get("ran", 0)
+    state = _dashboard_state(request)
+    latest_conversations = Conversation.objects.order_by("-created_at", "-id").only(
+        "id", "created_at", "customer_label", "diet", "favorite_foods", "ordered_dishes"
+    )[:DASHBOARD_LATEST_COUNT]  # Transcripts load on demand
     context = {
         "latest_conversations": latest_conversations,
-        "diet_counts": diet_counts,
-        "top_foods": top_foods,
-        "ran_count": ran_count,
+        "diet_counts": diet_counts,  # Precomputed aggregates, called by the template
+        "top_foods": partial(top_foods_by_diet, TOP_FOODS_COUNT),
+        "llm_usage": partial(llm_usage_by_mode, DASHBOARD_USAGE_WINDOW),
+        "usage_window": DASHBOARD_USAGE_WINDOW,
+        "stats_version": f"{state['version']}-{state['rows']}",
+        "cache_seconds": DASHBOARD_CACHE_SECONDS,
+        "job": state["job"],
         "latest_limit": DASHBOARD_LATEST_COUNT,
+        "max_run_count": MAX_RUN_COUNT,
     }
-    return render(request, "conversations/dashboard.html", context)  # Render UI
+    response = render(request, "conversations/dashboard.html", context)  # Render UI
+    patch_cache_control(response, private=True, no_cache=True)  # Always revalidate via ETag
+    patch_vary_headers(response, ["Cookie"])
+    return response
+
+
+# Transcript of one conversation, loaded by the dashboard when it is expanded.
+@login_required
+@permission_required("conversations.view_conversation", raise_exception=True)
+def conversation_messages(request, conversation_id):
+    created_at = (
+        Conversation.objects.filter(pk=conversation_id).values_list("created_at", flat=True).first()
+    )
+    if created_at is None:
+        return JsonResponse({"error": "Not found"}, status=404)  # Unknown conversation
+    messages = list(
+        Message.objects.filter(conversation_id=conversation_id, created_at=created_at)
+        .order_by("turn_index")
+        .values("turn_index", "role", "content")
+    )
+    response = JsonResponse({"id": conversation_id, "messages": messages})
+    patch_cache_control(response, private=True, max_age=3600)  # Transcripts never change
+    return response
+
+
+# Expose this process's LLM metrics in the Prometheus text format.
+# Scrapers authenticate with "Authorization: Bearer <METRICS_TOKEN>"; staff can use a session.
+def llm_metrics(request):
+    token = settings.METRICS_TOKEN
+    header = request.headers.get("Authorization", "")
+    allowed = bool(token) and constant_time_compare(header, f"Bearer {token}")
+    if not allowed and not (request.user.is_authenticated and request.user.is_staff):
+        return HttpResponse("Forbidden", status=403, content_type="text/plain")  # No access
+    return HttpResponse(render_prometheus(), content_type=CONTENT_TYPE)
 
 
 # Render the chatbot UI page.
@@ -167,24 +371,80 @@ def chatbot_ui(request):
     return render(request, "conversations/chatbot.html")  # Simple chat page
 
 
-BOT_INSTRUCTIONS = (
-    "You are a polite restaurant waiter. "
-    "Ask the user what their top 3 favorite foods are. "
-    "Keep it as an open question with an open answer."
-)
+# Authenticate and validate a chatbot POST for the async chat views.
+# Returns (error response, None, None) or (None, session, message).
+async def _chat_request(request):
+    if request.method != "POST":
+        return JsonResponse({"error": "POST only"}, status=405), None, None  # Method guard
+    user = await request.auser()
+    if not user.is_authenticated:
+        error = JsonResponse(
+            {"detail": "Authentication credentials were not provided."}, status=403
+        )  # Match the DRF error body
+        return error, None, None
+    try:
+        payload = json.loads(request.body or b"{}")
+    except ValueError:
+        return JsonResponse({"error": "Invalid JSON"}, status=400), None, None  # Bad body
+    serializer = ChatbotPayloadSerializer(data=payload)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400), None, None  # Invalid payload
+    session = await aget_session(user, serializer.validated_data.get("session"))
+    if session is None:
+        return JsonResponse({"detail": "Unknown session."}, status=404), None, None
+    return None, session, serializer.validated_data["message"]
 
-class ChatbotAPIView(APIView):
-    authentication_classes = [SessionAuthentication]  # Enforce CSRF for sessions
-    permission_classes = [IsAuthenticated]
 
-    def post(self, request, *args, **kwargs) -> Response:
-        serializer = ChatbotPayloadSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
+# Answer a chatbot message; history is windowed and chained server-side.
+# Async view: served from config.asgi, a request waiting on the model holds no worker,
+# so one process keeps many chats in flight.
+async def chatbot(request):
+    error, session, user_input = await _chat_request(request)
+    if error is not None:
+        return error
+    reply = await achat_reply(session, user_input)
+    return JsonResponse({"reply": reply, "session": str(session.pk)})
 
-        user_input = serializer.validated_data["message"]
-        reply = generate_text(user_input, BOT_INSTRUCTIONS)
 
-        return Response({"reply": reply}, status=status.HTTP_200_OK)
+# Encode one server-sent event.
+def _sse(event: str, data: dict[str, object]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 
-chatbot = ChatbotAPIView.as_view()
+# Stream the chatbot reply as server-sent events while tokens arrive.
+# Async view: serve it from config.asgi so no worker thread waits on the model.
+async def chatbot_stream(request):
+    error, session, user_input = await _chat_request(request)
+    if error is not None:
+        return error
+    # Streams carry no response id, so the prompt is always the window (no chaining).
+    prompt = await aprepare_turn(session, user_input, chain=False)
+
+    async def events():
+        started = time.perf_counter()
+        ttft_ms = None
+        parts = []
+        try:
+            async for delta in astream_text(
+                prompt.messages, prompt.instructions, site="chatbot_stream"
+            ):
+                if ttft_ms is None:
+                    ttft_ms = (time.perf_counter() - started) * 1000
+                    logger.info("chatbot_stream ttft_ms=%.0f user=%s", ttft_ms, session.user_id)
+                parts.append(delta)
+                yield _sse("token", {"text": delta})
+            await arecord_turn(session, user_input, "".join(parts).strip())
+        except Exception:
+            logger.exception("chatbot_stream failed user=%s", session.user_id)
+            yield _sse("error", {"error": "Generation failed."})
+            return
+        total_ms = (time.perf_counter() - started) * 1000
+        logger.info("chatbot_stream total_ms=%.0f user=%s", total_ms, session.user_id)
+        yield _sse(
+            "done", {"ttft_ms": ttft_ms, "total_ms": total_ms, "session": str(session.pk)}
+        )
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"  # Do not buffer or store the stream
+    response["X-Accel-Buffering"] = "no"  # Disable proxy buffering (nginx)
+    return response